@@ -3,11 +3,13 @@
 #----------------------------------------------------------------------------#
 
 import json
+import itertools
+import time
+import hmac
+import click
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
+from flask import Flask, render_template, stream_template, stream_with_context, request, Response, flash, redirect, url_for, abort, jsonify
 from flask_moment import Moment
-from werkzeug.utils import secure_filename
 from flask_sqlalchemy import SQLAlchemy
 import logging
 import os
@@ -16,6 +18,22 @@ from flask_wtf import Form
 from flask_wtf.csrf import CSRFProtect
 from flask_migrate import Migrate
 from forms import *
+from formatting import format_datetime
+from search import Search
+from serialization import json_response, ndjson_response
+from cache import ResponseCache, MemoryCacheBackend, FragmentCacheExtension, conditional
+from bus import InvalidationBus
+from scheduling import VenueBookings, common_free_slots
+from importer import BulkImporter, Checkpoint, RecordError, read_records
+from exporter import KINDS, export, writers
+from images import ImageStore, find_orphans
+from assets import AssetBundles
+from compression import CompressionMiddleware
+from pool import PoolStats, engine_options
+from metrics import RequestMetrics, family, histogram_samples
+import shutil
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from contextlib import nullcontext
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -23,9 +41,26 @@ from forms import *
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+pool_stats = PoolStats()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, pool_stats)
 db = SQLAlchemy(app)
+metrics = RequestMetrics(app, db) if app.config['METRICS_ENABLED'] else None
 migrate = Migrate(app, db)
 csrf = CSRFProtect(app)
+search = Search(app, db)
+page_cache = ResponseCache(app)
+bus = InvalidationBus(app, db)
+images = ImageStore(app)
+bundles = AssetBundles(app)
+app.jinja_env.add_extension(FragmentCacheExtension)
+if app.config['FRAGMENT_CACHE_MAX_ENTRIES']:
+    app.jinja_env.fragment_cache = MemoryCacheBackend(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+if app.config['COMPRESSION_ENABLED']:
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+        level=app.config['COMPRESSION_LEVEL'],
+        brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+        min_size=app.config['COMPRESSION_MIN_SIZE'],
+        cpu_budget=app.config['COMPRESSION_CPU_BUDGET'])
 ALLOWED_EXTENSIONS = {'jpeg', 'jpg', 'png'}
 
 # TODO: connect to a local postgresql database (Completed)
@@ -34,6 +69,25 @@ ALLOWED_EXTENSIONS = {'jpeg', 'jpg', 'png'}
 # Models.
 #----------------------------------------------------------------------------#
 
+# Association tables between Venue/Artist and Genre. The primary key covers
+# lookups by owner, the extra index covers lookups by genre.
+venue_genres = db.Table('VenueGenre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_VenueGenre_genre_id', 'genre_id')
+)
+
+artist_genres = db.Table('ArtistGenre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_ArtistGenre_genre_id', 'genre_id')
+)
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
 # Venue has many Show
 class Venue(db.Model):
     __tablename__ = 'Venue'
@@ -48,9 +102,15 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
     shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete-orphan')
-    genres = db.Column(db.String)
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name', lazy=True)
     city_state_id = db.Column(db.Integer, db.ForeignKey('CityState.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.today())
+    # Maintained by refresh_show_counters()
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Row version for conditional GETs: bumped by every UPDATE of the row
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # UTC
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=db.literal_column('version', db.Integer) + 1)
 
 class CityState(db.Model):
     __tablename__ = 'CityState'
@@ -68,7 +128,7 @@ class Artist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name', lazy=True)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
@@ -77,38 +137,119 @@ class Artist(db.Model):
     shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete-orphan')
     city_state_id = db.Column(db.Integer, db.ForeignKey('CityState.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now())
-    available_time = db.Column(db.String)
+    # Maintained by refresh_show_counters()
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Row version for conditional GETs: bumped by every UPDATE of the row
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # UTC
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=db.literal_column('version', db.Integer) + 1)
+    availability = db.relationship('ArtistAvailability', backref='artist', lazy=True, cascade='all, delete-orphan', order_by='ArtistAvailability.start_time')
+
+# Artist has many ArtistAvailability | [start_time, end_time) ranges the artist can be booked in
+class ArtistAvailability(db.Model):
+    __tablename__ = 'ArtistAvailability'
+    __table_args__ = (
+        db.Index('ix_ArtistAvailability_artist_id_range', 'artist_id', 'start_time', 'end_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
 
 
 # TODO: implement any missing fields, as a database migration using Flask-Migrate (Completed)
 
 # TODO (Completed): Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+# A show occupies its venue during [start_time, end_time). On Postgres the
+# Show_venue_id_tsrange_excl exclusion constraint (see migrations) rejects
+# overlapping shows at the same venue.
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    # Row version for conditional GETs: bumped by every UPDATE of the row
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # UTC
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=db.literal_column('version', db.Integer) + 1)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+# Pages rendered before the variants of an uploaded image existed point at the
+# original; drop them from the page cache once the variants are there
+def image_ready(path):
+    with app.app_context():
+        venue_ids = [venue_id for (venue_id,) in db.session.query(Venue.id).filter(Venue.image_link == path)]
+        artist_ids = [artist_id for (artist_id,) in db.session.query(Artist.id).filter(Artist.image_link == path)]
+        bus.publish(tags=['venue:{}'.format(venue_id) for venue_id in venue_ids] +
+                         ['artist:{}'.format(artist_id) for artist_id in artist_ids])
+
+images.on_ready = image_ready
 
+# See formatting.py; accepts datetimes or date strings
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Row versions.
+#----------------------------------------------------------------------------#
+
+# Helper function to fingerprint the rows of model matching criteria | return
+# subquery of (row count, max id, sum of versions, last update) that changes with
+# any insert, delete or update of those rows, plus the extra aggregate columns.
+def row_stamp(model, *criteria, extra=()):
+    return db.session.query(
+            db.func.count(model.id).label('rows'),
+            db.func.max(model.id).label('max_id'),
+            db.func.sum(model.version).label('versions'),
+            db.func.max(model.updated_at).label('updated_at'),
+            *extra)\
+        .filter(*criteria)\
+        .subquery()
+
+# Helper function to read row stamps in a single query for conditional()
+# | return Tuple(version, last_modified)
+def probe_versions(*stamps):
+    source = stamps[0]
+    for stamp in stamps[1:]:
+        source = source.join(stamp, db.true())
+    columns = [column for stamp in stamps for column in stamp.c]
+    row = db.session.query(*columns).select_from(source).one()
+    updated = [value for column, value in zip(columns, row) if column.name == 'updated_at' and value is not None]
+    return (tuple(row), max(updated, default=None))
+
+def listing_version(*models):
+    return lambda: probe_versions(*[row_stamp(model) for model in models])
+
+# A venue page shows the venue, its shows split by the database clock and the
+# artists playing them; an artist page the other way round.
+def venue_version(venue_id):
+    past = db.func.count(db.case((Show.start_time < db.func.now(), 1))).label('past')
+    return probe_versions(
+        row_stamp(Venue, Venue.id == venue_id),
+        row_stamp(Show, Show.venue_id == venue_id, extra=[past]),
+        row_stamp(Artist, Artist.id.in_(db.session.query(Show.artist_id).filter(Show.venue_id == venue_id))))
+
+def artist_version(artist_id):
+    past = db.func.count(db.case((Show.start_time < db.func.now(), 1))).label('past')
+    return probe_versions(
+        row_stamp(Artist, Artist.id == artist_id),
+        row_stamp(Show, Show.artist_id == artist_id, extra=[past]),
+        row_stamp(Venue, Venue.id.in_(db.session.query(Show.venue_id).filter(Show.artist_id == artist_id))))
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
+@conditional(listing_version(Artist, Venue))
+@page_cache.cached('artists', 'venues')
 def index():
   artists = Artist.query.order_by(db.desc(Artist.created_at)).limit(10)
   venues = Venue.query.order_by(db.desc(Venue.created_at)).limit(10)
@@ -118,67 +259,68 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+# Helper function to build the area listing of venues or artists | return list of areas
+# One query returns every (area, entity) pair together with the number of
+# upcoming shows of the entity; the rows are then grouped per area.
+def get_area_index(model): # model: Venue | Artist
+    key = 'venues' if model is Venue else 'artists'
+    rows = db.session.query(CityState.id, CityState.city, CityState.state, model.id, model.name, model.upcoming_shows_count)\
+        .join(model, model.city_state_id == CityState.id)\
+        .order_by(CityState.state, CityState.city, CityState.id, model.name)\
+        .all()
+
+    data = []
+    for (_, city, state), entities in itertools.groupby(rows, key=lambda row: row[:3]):
+        data.append({
+          "city": city.title(),
+          "state": state.upper(),
+          key: [{
+            "id": entity_id,
+            "name": name,
+            "num_upcoming_shows": upcoming
+          } for _, _, _, entity_id, name, upcoming in entities]
+        })
+    return data
+
 @app.route('/venues')
+@conditional(listing_version(Venue))
+@page_cache.cached('venues')
 def venues():
   # TODO: replace with real venues data. (Completed)
-  city_state = CityState.query.all()
-
-  data = []
-  for c in city_state:
-      if c.venues:
-          ven_list = [{
-            "id": venue.id,
-            "name": venue.name
-          } for venue in c.venues]
-          data.append({
-            "city": c.city.title(),
-            "state": c.state.upper(),
-            "venues": ven_list
-          })
-
-  return render_template('pages/venues.html', areas=data);
+  return render_template('pages/venues.html', areas=get_area_index(Venue))
+
+# Helper function to shape search backend rows for the search templates | return dict
+def search_response(rows):
+    return {
+      "count": len(rows),
+      "data": [{
+          "id": row.id,
+          "name": row.name
+      } for row in rows]
+    }
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: (Completed) implement search on artists with partial string search. Ensure it is case-insensitive.
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.genres.ilike('%{}%'.format(search_term))).all()
-  print(venues)
-  response = {
-    "count": len(venues),
-    "data": [{
-        "id": venue.id,
-        "name": venue.name
-    } for venue in venues]
-  }
+  response = search_response(search.search('venues', search_term))
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/search_by_city', methods=['POST'])
 def search_venues_by_city():
     search_term = request.form.get('search_term', '')
-    city_state = CityState.query.filter(CityState.city.ilike('%{}%'.format(search_term))).all()
-    venues = []
-    for c in city_state:
-        for venue in c.venues:
-            venues.append(venue)
-
-    print(venues)
-    response = {
-      "count": len(venues),
-      "data": [{
-          "id": venue.id,
-          "name": venue.name
-      } for venue in venues]
-    }
+    response = search_response(search.search('venues_by_city', search_term))
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_version)
+@page_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
   # TODO: replace with real venue data from the venues table, using venue_id (Completed)
   venue = Venue.query.get(venue_id)
-  past_shows, upcoming_shows = get_past_upcom_shows(venue.shows, 0)
-  genres = venue.genres.split(',')[:-1]
+  past_shows, upcoming_shows = get_past_upcom_shows(venue.id, 0)
+  genres = [genre.name for genre in venue.genres]
   city_state = CityState.query.get(venue.city_state_id)
   data = {
     "id": venue.id,
@@ -198,46 +340,37 @@ def show_venue(venue_id):
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows)
   }
+  page_cache.tag(*['artist:{}'.format(show['artist_id']) for show in past_shows + upcoming_shows])
   return render_template('pages/show_venue.html', venue=data)
 
 # Helper function to get Past_Shows and Upcoming_Shows | return Tuple(p_shows, u_shows)
-def get_past_upcom_shows(shows, category): # Category:  0 => Venue | 1 => Artist
-    past_shows = []
-    upcoming_shows = []
+# Loads the shows of a venue/artist together with the joined artist/venue columns
+# in a single query. The past/upcoming split is computed by the database clock.
+def get_past_upcom_shows(owner_id, category): # Category:  0 => Venue | 1 => Artist
     if category: # Get shows for Artist
-        for show in shows:
-            venue = Venue.query.get(show.venue_id)
-            if show.start_time < datetime.today():
-                past_shows.append({
-                    "venue_id": show.venue_id,
-                    "venue_name": venue.name,
-                    "venue_image_link": venue.image_link,
-                    "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-                })
-            else:
-                upcoming_shows.append({
-                    "venue_id": show.venue_id,
-                    "venue_name": venue.name,
-                    "venue_image_link": venue.image_link,
-                    "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-                })
+        other, owner_column, prefix = Venue, Show.artist_id, 'venue'
     else: # Get shows for Venue
-        for show in shows:
-            artist = Artist.query.get(show.artist_id)
-            if show.start_time < datetime.today():
-                past_shows.append({
-                    "artist_id": show.artist_id,
-                    "artist_name": artist.name,
-                    "artist_image_link": artist.image_link,
-                    "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-                })
-            else:
-                upcoming_shows.append({
-                    "artist_id": show.artist_id,
-                    "artist_name": Artist.query.get(show.artist_id).name,
-                    "artist_image_link": Artist.query.get(show.artist_id).image_link,
-                    "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-                })
+        other, owner_column, prefix = Artist, Show.venue_id, 'artist'
+    is_past = (Show.start_time < db.func.now()).label('is_past')
+    rows = db.session.query(other.id, other.name, other.image_link, other.version, Show.id, Show.version, Show.start_time, is_past)\
+        .join(other, other.id == getattr(Show, prefix + '_id'))\
+        .filter(owner_column == owner_id)\
+        .order_by(Show.start_time)\
+        .all()
+
+    past_shows = []
+    upcoming_shows = []
+    for other_id, other_name, other_image_link, other_version, show_id, show_version, start_time, past in rows:
+        show = {
+            "show_id": show_id,
+            "show_version": show_version,
+            prefix + "_id": other_id,
+            prefix + "_name": other_name,
+            prefix + "_image_link": other_image_link,
+            prefix + "_version": other_version,
+            "start_time": start_time
+        }
+        (past_shows if past else upcoming_shows).append(show)
     return (past_shows, upcoming_shows)
 
 #  Create Venue
@@ -245,27 +378,38 @@ def get_past_upcom_shows(shows, category): # Category:  0 => Venue | 1 => Artist
 
 @app.route('/venues/create', methods=['GET'])
 def create_venue_form():
-  form = VenueForm()
+  form = set_genre_choices(VenueForm())
   return render_template('forms/new_venue.html', form=form)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def create_setup(request, form): # return Tuple(file, genres_list, cityState obj)
+# Helper function to set the genre choices of a form from the Genre table | return form
+def set_genre_choices(form):
+    names = [name for (name,) in db.session.query(Genre.name).order_by(Genre.name)]
+    if names:
+        form.genres.choices = [(name, name) for name in names]
+    return form
+
+# Helper function to resolve genre names to Genre rows in one indexed lookup,
+# creating the missing ones | return list of Genre
+def get_genres(names):
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    existing = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))}
+    return [existing.get(name) or Genre(name=name) for name in names]
+
+def create_setup(request, form): # return Tuple(file, genres, cityState obj)
     error=False
-    genres_list = ''
+    genres = []
     filepath = ''
     city_state = None
     try:
         # Get image_link
         file = request.files['image_link']
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            for g in form.genres.data:
-                genres_list += '{},'.format(g)
+            filepath = images.save(file, file.filename.rsplit('.', 1)[1])
+            genres = get_genres(form.genres.data)
             # Check if City and State Already exists
             city = form.city.data.strip().title()
             state = form.state.data
@@ -279,25 +423,24 @@ def create_setup(request, form): # return Tuple(file, genres_list, cityState obj
         error=True
         form.errors['image_link'] = ['Invalid image extension']
     finally:
-        return (filepath, genres_list, city_state) if not error else None
+        return (filepath, genres, city_state) if not error else None
 
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # TODO: insert form data as a new Venue record in the db, instead (Completed)
   # TODO: on unsuccessful db insert, flash an error instead. (Completed)
   # TODO: modify data to be the data object returned from db insertion (Completed)
-  form = VenueForm()
+  form = set_genre_choices(VenueForm())
   error = False
-  genres_list = ''
   if form.validate():
       try:
           # Get image_link
-          filepath, genres_list, city_state = create_setup(request, form)
+          filepath, genres, city_state = create_setup(request, form)
           venue = Venue(
             name=form.name.data.strip(),
             address=form.address.data.strip(),
             phone=form.phone.data.strip(),
-            genres=genres_list,
+            genres=genres,
             image_link=filepath,
             seeking_talent=form.seeking_talent.data,
             seeking_description=form.seeking_description.data.strip(),
@@ -306,6 +449,7 @@ def create_venue_submission():
           city_state.venues.append(venue)
           db.session.add(venue)
           db.session.commit()
+          bus.publish(tags=['venues'], entities=[('Venue', venue.id, 'update')])
           print('File : {}'.format(filepath))
       except Exception as e:
           db.session.rollback()
@@ -331,8 +475,13 @@ def delete_venue(venue_id):
   error=False
   try:
       venue = Venue.query.get(venue_id)
+      artist_ids = [artist_id for (artist_id,) in db.session.query(Show.artist_id).filter(Show.venue_id == venue.id).distinct()]
       db.session.delete(venue)
+      db.session.flush()
+      refresh_show_counters(artist_ids=artist_ids, venue_ids=[])
       db.session.commit()
+      bus.publish(tags=['venues', 'shows', 'venue:{}'.format(venue_id)] + ['artist:{}'.format(artist_id) for artist_id in artist_ids],
+          entities=[('Venue', int(venue_id), 'remove')])
   except Exception as e:
       error=True
       db.session.rollback()
@@ -354,6 +503,8 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(listing_version(Artist))
+@page_cache.cached('artists')
 def artists():
   # TODO: replace with real data returned from querying the database (Completed)
   artists = Artist.query.all()
@@ -363,50 +514,42 @@ def artists():
   } for artist in artists]
   return render_template('pages/artists.html', artists=data)
 
+@app.route('/artists/areas')
+@conditional(listing_version(Artist))
+@page_cache.cached('artists')
+def artists_by_area():
+  return render_template('pages/artists_by_area.html', areas=get_area_index(Artist))
+
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # TODO: (Completed) implement search on artists with partial string search. Ensure it is case-insensitive.
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike('%{}%'.format(search_term))).all()
-  response={
-    "count": len(artists),
-    "data": [{
-        "id": artist.id,
-        "name": artist.name,
-        "num_upcoming_shows": filter(lambda show: show.start_time >= datetime.today(), artist.shows)
-    } for artist in artists]
-  }
+  response = search_response(search.search('artists', search_term))
+  artist_ids = [artist['id'] for artist in response['data']]
+  num_upcoming_shows = dict(db.session.query(Artist.id, Artist.upcoming_shows_count)
+      .filter(Artist.id.in_(artist_ids)))
+  for artist in response['data']:
+      artist['num_upcoming_shows'] = num_upcoming_shows.get(artist['id'], 0)
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/search_by_city', methods=['POST'])
 def search_artists_by_city():
     search_term = request.form.get('search_term', '')
-    city_state = CityState.query.filter(CityState.city.ilike('%{}%'.format(search_term))).all()
-    artists = []
-    for c in city_state:
-        for artist in c.artists:
-            artists.append(artist)
-
-    print(artists)
-    response = {
-      "count": len(artists),
-      "data": [{
-          "id": artist.id,
-          "name": artist.name
-      } for artist in artists]
-    }
-    return render_template('pages/search_venues.html', results=response, search_term=search_term)
+    response = search_response(search.search('artists_by_city', search_term))
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_version)
+@page_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
   # TODO: (Completed) replace with real artist data from the artists table, using artist_id
   artist = Artist.query.get(artist_id)
-  genres = artist.genres.split(',')[:-1]
+  genres = [genre.name for genre in artist.genres]
   city_state = CityState.query.get(artist.city_state_id)
-  past_shows, upcoming_shows = get_past_upcom_shows(artist.shows, 1)
+  past_shows, upcoming_shows = get_past_upcom_shows(artist.id, 1)
 
-  available_time_list = artist.available_time.split(',')[:] if artist.available_time else []
+  available_time_list = [format_availability(slot) for slot in artist.availability]
   data={
     "id": artist.id,
     "name": artist.name,
@@ -425,6 +568,7 @@ def show_artist(artist_id):
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows),
   }
+  page_cache.tag(*['venue:{}'.format(show['venue_id']) for show in past_shows + upcoming_shows])
   print(data)
   return render_template('pages/show_artist.html', artist=data)
 
@@ -434,7 +578,7 @@ def show_artist(artist_id):
 def edit_artist(artist_id):
   artist = Artist.query.get(artist_id)
   city_state = CityState.query.get(artist.city_state_id)
-  form = ArtistForm(seeking_venue = 1 if artist.seeking_venue else 0, genres=artist.genres.split(',')[:-1], state=city_state.state)
+  form = set_genre_choices(ArtistForm(seeking_venue = 1 if artist.seeking_venue else 0, genres=[genre.name for genre in artist.genres], state=city_state.state))
   artist={
     "id": artist.id,
     "name": artist.name,
@@ -442,7 +586,7 @@ def edit_artist(artist_id):
     "state": city_state.state,
     "phone": artist.phone,
     "website": artist.website,
-    "available_time": artist.available_time,
+    "available_time": ', '.join(format_availability(slot) for slot in artist.availability),
     "facebook_link": artist.facebook_link,
     "seeking_venue": artist.seeking_venue,
     "seeking_description": artist.seeking_description,
@@ -454,19 +598,16 @@ def edit_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing (Completed)
-  form = ArtistForm()
+  form = set_genre_choices(ArtistForm())
   error=False
   is_new_city_state = False
   artist = {}
-  genres_list = ''
   filepath = ''
   try:
       # Get image_link
       file = request.files['image_link']
       if file and allowed_file(file.filename):
-          filename = secure_filename(file.filename)
-          filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-          file.save(filepath)
+          filepath = images.save(file, file.filename.rsplit('.', 1)[1])
           artist = Artist.query.get(artist_id)
           city_state_old = CityState.query.get(artist.city_state_id)
           city_state_new = CityState.query.filter_by(state=form.state.data).first()
@@ -478,23 +619,25 @@ def edit_artist_submission(artist_id):
               if city_state_old.state != city_state_new.state:
                   is_new_city_state=True
 
-          for g in form.genres.data:
-              genres_list += '{},'.format(g)
           artist.name = form.name.data.strip()
           artist.phone = form.phone.data.strip()
-          artist.genres = genres_list
+          artist.genres = get_genres(form.genres.data)
           artist.website = form.website.data.strip()
           artist.facebook_link = form.facebook_link.data.strip()
           artist.seeking_venue = form.seeking_venue.data
-          artist.available_time = form.available_time.data.strip()
+          artist.availability = [ArtistAvailability(start_time=start, end_time=end)
+              for start, end in parse_availability(form.available_time.data)]
           artist.seeking_description = form.seeking_description.data.strip()
           artist.image_link = filepath
+          # Genre and availability changes alone would not update the row
+          artist.updated_at = datetime.utcnow()
           if is_new_city_state:
               db.session.add(artist)
               city_state_new.artists.append(artist)
               # city_state_old.artists.remove(artist)
 
           db.session.commit()
+          bus.publish(tags=['artists', 'artist:{}'.format(artist_id)], entities=[('Artist', artist_id, 'update')])
       else:
           artist = {
             'name': form.name.data,
@@ -503,7 +646,7 @@ def edit_artist_submission(artist_id):
             'city': form.city.data,
             'state': form.state.data,
             'website': form.website.data,
-            'available_time': form.available_time,
+            'available_time': form.available_time.data,
             'facebook_link': form.facebook_link.data,
             'seeking_venue': form.seeking_venue.data,
             'seeking_description': form.seeking_description.data,
@@ -520,7 +663,7 @@ def edit_artist_submission(artist_id):
         'city': form.city.data,
         'state': form.state.data,
         'website': form.website.data,
-        'available_time': form.available_time,
+        'available_time': form.available_time.data,
         'facebook_link': form.facebook_link.data,
         'seeking_venue': form.seeking_venue.data,
         'seeking_description': form.seeking_description.data,
@@ -540,7 +683,7 @@ def edit_artist_submission(artist_id):
 def edit_venue(venue_id):
   venue = Venue.query.get(venue_id)
   city_state = CityState.query.get(venue.city_state_id)
-  form = VenueForm(seeking_talent = 1 if venue.seeking_talent else 0, genres=venue.genres.split(',')[:-1], state=city_state.state)
+  form = set_genre_choices(VenueForm(seeking_talent = 1 if venue.seeking_talent else 0, genres=[genre.name for genre in venue.genres], state=city_state.state))
   venue={
     "id": venue.id,
     "name": venue.name,
@@ -560,19 +703,16 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing (Completed)
-  form = VenueForm()
+  form = set_genre_choices(VenueForm())
   error=False
   is_new_city_state = False
   venue = {}
-  genres_list = ''
   filepath = ''
   try:
       # Get image_link
       file = request.files['image_link']
       if file and allowed_file(file.filename):
-          filename = secure_filename(file.filename)
-          filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-          file.save(filepath)
+          filepath = images.save(file, file.filename.rsplit('.', 1)[1])
           venue = Venue.query.get(venue_id)
           city_state_old = CityState.query.get(venue.city_state_id)
           city_state_new = CityState.query.filter_by(state=form.state.data).first()
@@ -584,22 +724,23 @@ def edit_venue_submission(venue_id):
               if city_state_old.state != city_state_new.state:
                   is_new_city_state=True
 
-          for g in form.genres.data:
-              genres_list += '{},'.format(g)
           venue.name = form.name.data.strip()
           venue.phone = form.phone.data.strip()
-          venue.genres = genres_list
+          venue.genres = get_genres(form.genres.data)
           venue.address = form.address.data.strip()
           venue.website = form.website.data.strip()
           venue.facebook_link = form.facebook_link.data.strip()
           venue.seeking_talent = form.seeking_talent.data
           venue.seeking_description = form.seeking_description.data.strip()
           venue.image_link = filepath
+          # Genre changes alone would not update the row
+          venue.updated_at = datetime.utcnow()
           if is_new_city_state:
               db.session.add(venue)
               city_state_new.venues.append(venue)
 
           db.session.commit()
+          bus.publish(tags=['venues', 'venue:{}'.format(venue_id)], entities=[('Venue', venue_id, 'update')])
       else:
           venue = {
             'name': form.name.data,
@@ -646,7 +787,7 @@ def edit_venue_submission(venue_id):
 
 @app.route('/artists/create', methods=['GET'])
 def create_artist_form():
-  form = ArtistForm()
+  form = set_genre_choices(ArtistForm())
   return render_template('forms/new_artist.html', form=form)
 
 @app.route('/artists/create', methods=['POST'])
@@ -655,15 +796,14 @@ def create_artist_submission():
   # TODO: on unsuccessful db insert, flash an error instead. (Completed)
   # TODO: modify data to be the data object returned from db insertion (Completed)
   error = False
-  form = ArtistForm()
-  genres_list = ''
+  form = set_genre_choices(ArtistForm())
   if form.validate():
       try:
-          filepath, genres_list, city_state = create_setup(request, form)
+          filepath, genres, city_state = create_setup(request, form)
           artist = Artist(
             name = form.name.data.strip(),
             phone = form.phone.data.strip(),
-            genres = genres_list,
+            genres = genres,
             image_link = filepath,
             seeking_venue = form.seeking_venue.data,
             seeking_description = form.seeking_description.data.strip(),
@@ -672,6 +812,7 @@ def create_artist_submission():
           city_state.artists.append(artist)
           db.session.add(artist)
           db.session.commit()
+          bus.publish(tags=['artists'], entities=[('Artist', artist.id, 'update')])
       except Exception as e:
           print(e)
           error=True
@@ -692,34 +833,183 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+# Helper function to build the joined Show -> Artist/Venue listing query | return Query
+def shows_listing_query():
+    return db.session.query(
+            Show.id, Show.version, Show.start_time,
+            Show.venue_id, Venue.name.label('venue_name'), Venue.version.label('venue_version'),
+            Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'),
+            Artist.version.label('artist_version'))\
+        .join(Venue, Venue.id == Show.venue_id)\
+        .join(Artist, Artist.id == Show.artist_id)
+
+# Keyset cursors are "<start_time isoformat>_<show id>" of the last show on a page
+def encode_show_cursor(start_time, show_id):
+    return '{}_{}'.format(start_time.isoformat(), show_id)
+
+def decode_show_cursor(cursor): # return Tuple(start_time, show_id)
+    try:
+        start_time, show_id = cursor.rsplit('_', 1)
+        return (datetime.fromisoformat(start_time), int(show_id))
+    except ValueError:
+        abort(400)
+
+def parse_time_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        abort(400)
+
+# Helper function to filter the shows listing | return Query ordered by (start_time, id)
+def shows_page_query(after=None, start=None, end=None):
+    query = shows_listing_query().filter(Show.start_time.isnot(None))
+    if start:
+        query = query.filter(Show.start_time >= start)
+    if end:
+        query = query.filter(Show.start_time < end)
+    if after:
+        query = query.filter(db.tuple_(Show.start_time, Show.id) > after)
+    return query.order_by(Show.start_time, Show.id)
+
+def show_listing_item(row):
+    return {
+      "show_id": row.id,
+      "show_version": row.version,
+      "venue_id": row.venue_id,
+      "venue_name": row.venue_name,
+      "venue_version": row.venue_version,
+      "artist_id": row.artist_id,
+      "artist_name": row.artist_name,
+      "artist_image_link": row.artist_image_link,
+      "artist_version": row.artist_version,
+      "start_time": row.start_time
+    }
+
+# Helper generator yielding one page of shows ordered by (start_time, id).
+# The query only runs once the generator is consumed, so in streaming mode the
+# layout is already on the wire before the database is hit. page['next_url'] is
+# filled in when a further page exists; it points to endpoint with the other
+# arguments of the request.
+def iter_shows_page(page, after=None, start=None, end=None, limit=None, endpoint='shows'):
+    query = shows_page_query(after, start, end).limit(limit + 1)
+
+    last = None
+    for i, row in enumerate(query):
+        if i == limit:
+            args = {k: v for k, v in request.args.items() if k not in ('after', 'limit')}
+            page['next_url'] = url_for(endpoint,
+                after=encode_show_cursor(last.start_time, last.id),
+                limit=limit,
+                **args)
+            break
+        last = row
+        yield show_listing_item(row)
+
 @app.route('/shows')
+@conditional(listing_version(Show, Artist, Venue))
+@page_cache.cached('shows')
 def shows():
   # TODO: replace with real venues data. (Completed)
-  shows = Show.query.all()
-  data = []
-  for show in shows:
-      artist = Artist.query.get(show.artist_id)
-      data.append({
-          "venue_id": show.venue_id,
-          "venue_name": Venue.query.get(show.venue_id).name,
-          "artist_id": show.artist_id,
-          "artist_name": artist.name,
-          "artist_image_link": artist.image_link,
-          "start_time": show.start_time.strftime('%m/%d/%Y, %H:%M:%S')
-      })
-  return render_template('pages/shows.html', shows=data)
+  limit = request.args.get('limit', app.config['SHOWS_PER_PAGE'], type=int)
+  limit = max(1, min(limit, app.config['SHOWS_MAX_PER_PAGE']))
+  after = request.args.get('after')
+  after = decode_show_cursor(after) if after else None
+  page = {'next_url': None}
+  data = iter_shows_page(page, after, parse_time_arg('from'), parse_time_arg('to'), limit)
+  if request.args.get('stream'):
+      return Response(stream_with_context(stream_template('pages/shows.html', shows=data, page=page)))
+  data = list(data)
+  page_cache.tag(*['artist:{}'.format(show['artist_id']) for show in data])
+  page_cache.tag(*['venue:{}'.format(show['venue_id']) for show in data])
+  return render_template('pages/shows.html', shows=data, page=page)
 
 @app.route('/shows/create')
 def create_shows():
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-def get_available_time(available_time):
-    available_time_list = []
-    for avatime in available_time.split(',')[:]:
-        print('available_time: {}'.format(avatime))
-        available_time_list.append(avatime)
-    return available_time_list
+# Availability text is a comma separated list of "start/end" ranges; a bare start
+# time stands for a slot of SHOW_DURATION_MINUTES, the default show length, so a
+# default show starting then fits in it | return list of Tuple(start, end)
+def parse_availability(text):
+    slots = []
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        start, _, end = item.partition('/')
+        start = dateutil.parser.parse(start)
+        end = dateutil.parser.parse(end) if end.strip() else start + timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+        if end <= start:
+            raise ValueError('Availability ends before it starts: {}'.format(item.strip()))
+        slots.append((start, end))
+    return slots
+
+def format_availability(slot):
+    return '{}/{}'.format(slot.start_time.strftime('%Y-%m-%d %H:%M:%S'), slot.end_time.strftime('%Y-%m-%d %H:%M:%S'))
+
+# Helper function to check a booking against the availability of an artist. An
+# artist without any availability can always be booked, otherwise the whole
+# show [start_time, end_time) has to fit in one of the ranges. Both checks are
+# EXISTS probes on the (artist_id, start_time, end_time) index | return bool
+def artist_is_available(artist_id, start_time, end_time):
+    slots = ArtistAvailability.query.filter(ArtistAvailability.artist_id == artist_id)
+    has_slots, is_covered = db.session.query(
+        slots.exists(),
+        slots.filter(ArtistAvailability.start_time <= start_time, ArtistAvailability.end_time >= end_time).exists()
+    ).one()
+    return is_covered or not has_slots
+
+# Venue double-booking guard for databases without the exclusion constraint
+def load_venue_bookings(venue_id):
+    return db.session.query(Show.start_time, Show.end_time)\
+        .filter(Show.venue_id == venue_id, Show.start_time.isnot(None), Show.end_time.isnot(None))\
+        .all()
+
+bookings = VenueBookings(load_venue_bookings, app.config['VENUE_BOOKINGS_MAX_VENUES'])
+
+# Applies an entity-change event of the invalidation bus to the caches of this
+# worker: page cache tags, the in-process search index, venue bookings and
+# the files known to the image store.
+# 'booked' events come from other workers' new shows; the publishing worker
+# already recorded the booking itself. 'reload' (entity id None) follows bulk
+# changes to a whole table and drops everything.
+@bus.subscribe
+def apply_invalidation(event):
+    page_cache.invalidate(*event['tags'])
+    local = event['origin'] == bus.origin
+    for table, entity_id, change in event['entities']:
+        if change == 'update':
+            search.update(table, entity_id)
+        elif change == 'remove' and table == 'Image':
+            images.forget(entity_id)
+        elif change == 'remove':
+            search.remove(table, entity_id)
+            if table == 'Venue':
+                bookings.forget(entity_id)
+        elif change == 'booked' and not local:
+            bookings.forget(entity_id)
+        elif change == 'reload':
+            page_cache.clear()
+            search.reset()
+            bookings.clear()
+        elif change == 'assets':
+            bundles.load()
+            page_cache.clear()
+
+# Helper function to hold a venue for [start_time, end_time) while a show is
+# inserted | return context manager yielding whether the venue is free.
+# Postgres enforces this itself through the exclusion constraint at commit.
+def venue_booking(venue_id, start_time, end_time):
+    if db.engine.dialect.name == 'postgresql':
+        return nullcontext(True)
+    return bookings.reserve(venue_id, start_time, end_time)
+
+def is_exclusion_violation(error):
+    return isinstance(error, IntegrityError) and \
+        (getattr(error.orig, 'pgcode', None) or getattr(error.orig, 'sqlstate', None)) == '23P01'
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
@@ -729,25 +1019,37 @@ def create_show_submission():
   form = ShowForm(request.form)
   if form.validate():
       try:
-          artist = Artist.query.get(form.artist_id.data)
           venue_id = form.venue_id.data
           artist_id = form.artist_id.data
           start_time = form.start_time.data
-          if start_time.strftime('%Y-%m-%d %H:%M:%S') not in get_available_time(artist.available_time):
-              show = Show(
-                venue_id = venue_id,
-                artist_id = artist_id,
-                start_time = start_time
-              )
-              db.session.add(show)
-              db.session.commit()
-          else:
+          end_time = start_time + timedelta(minutes=form.duration.data)
+          if not artist_is_available(artist_id, start_time, end_time):
               error= True
               form.errors['Show Time'] = ['The Artist is not Available at this time']
+          else:
+              with venue_booking(venue_id, start_time, end_time) as free:
+                  if free:
+                      show = Show(
+                        venue_id = venue_id,
+                        artist_id = artist_id,
+                        start_time = start_time,
+                        end_time = end_time
+                      )
+                      db.session.add(show)
+                      db.session.flush()
+                      refresh_show_counters(artist_ids=[artist_id], venue_ids=[venue_id])
+                      db.session.commit()
+                      bus.publish(tags=['shows', 'artist:{}'.format(artist_id), 'venue:{}'.format(venue_id)],
+                          entities=[('Venue', venue_id, 'booked')])
+                  else:
+                      error= True
+                      form.errors['Show Time'] = ['The Venue is already booked at this time']
       except Exception as e:
           db.session.rollback()
           print(e)
           error=True
+          if is_exclusion_violation(e):
+              form.errors['Show Time'] = ['The Venue is already booked at this time']
       finally:
           db.session.close()
           if not error:
@@ -759,12 +1061,580 @@ def create_show_submission():
   else:
       return render_template('forms/new_show.html', form=form, errors=form.errors)
 
+#  Show counters
+#  ----------------------------------------------------------------
+
+# Helper function to recount the upcoming/past show counters of the given
+# artists and venues (None = all of them) with one UPDATE per table. Only rows
+# whose counts differ are written, so unchanged rows keep their version (and
+# their pages' ETags and fragments). Runs in the caller's transaction
+# | return Tuple(artist ids, venue ids) of the updated rows
+def refresh_show_counters(artist_ids=None, venue_ids=None):
+    changed = []
+    for model, show_column, ids in ((Artist, Show.artist_id, artist_ids), (Venue, Show.venue_id, venue_ids)):
+        if ids is not None and not ids:
+            changed.append([])
+            continue
+        counts = db.session.query(db.func.count(Show.id)).filter(show_column == model.id)
+        upcoming = counts.filter(Show.start_time >= db.func.now()).scalar_subquery()
+        past = counts.filter(Show.start_time < db.func.now()).scalar_subquery()
+        statement = db.update(model)\
+            .where(db.or_(model.upcoming_shows_count != upcoming, model.past_shows_count != past))\
+            .values(upcoming_shows_count=upcoming, past_shows_count=past)\
+            .returning(model.id)
+        if ids is not None:
+            statement = statement.where(model.id.in_(ids))
+        changed.append([id for (id,) in db.session.execute(statement, execution_options={'synchronize_session': False})])
+    return tuple(changed)
+
+# Helper function to read the time of the last roll-show-counters run
+# | return datetime or None
+def read_watermark(path):
+    try:
+        with open(path) as f:
+            return datetime.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def write_watermark(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(value.isoformat())
+    os.replace(tmp, path)
+
+# Periodic job (cron): shows that started since the last run move from
+# upcoming to past. Times come from the database clock, like the counters, and
+# the end of each run is kept in the SHOW_COUNTERS_WATERMARK file, so a missed
+# run is caught up by the next one; without the file (first run) the job looks
+# back --window minutes. Counts are recomputed, not shifted, so overlapping
+# runs are harmless; --all recounts every artist and venue. Run it on one host.
+@app.cli.command('roll-show-counters')
+@click.option('--window', default=15, help='Minutes to look back for shows that started, without a watermark.')
+@click.option('--all', 'everything', is_flag=True, help='Recount every artist and venue.')
+def roll_show_counters(window, everything):
+  watermark = app.config['SHOW_COUNTERS_WATERMARK']
+  now = db.session.scalar(db.select(db.func.now()))
+  if everything:
+      artist_ids, venue_ids = refresh_show_counters()
+  else:
+      since = read_watermark(watermark) or now - timedelta(minutes=window)
+      started = db.session.query(Show.artist_id, Show.venue_id)\
+          .filter(Show.start_time >= since, Show.start_time < db.func.now())\
+          .all()
+      artist_ids, venue_ids = refresh_show_counters(artist_ids=set(artist_id for artist_id, _ in started),
+                                                    venue_ids=set(venue_id for _, venue_id in started))
+  db.session.commit()
+  write_watermark(watermark, now)
+  # The listings show the counters, the detail pages the past/upcoming split
+  if artist_ids or venue_ids:
+      bus.publish(tags=['artists', 'venues'] + ['artist:{}'.format(artist_id) for artist_id in artist_ids] +
+                       ['venue:{}'.format(venue_id) for venue_id in venue_ids])
+  click.echo('Show counters refreshed: {} artists, {} venues changed'.format(len(artist_ids), len(venue_ids)))
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+# Helper function to apply the rules of create_show_submission to an imported
+# show: the artist's availability and, without the Postgres exclusion
+# constraint, the venue's bookings, which then include the shows imported
+# before it. Costs one availability probe per show.
+def validate_record(kind, row):
+    if kind != 'shows':
+        return
+    if not artist_is_available(row['artist_id'], row['start_time'], row['end_time']):
+        raise RecordError('artist {} is not available at this time'.format(row['artist_id']))
+    with venue_booking(row['venue_id'], row['start_time'], row['end_time']) as free:
+        if not free:
+            raise RecordError('venue {} is already booked at this time'.format(row['venue_id']))
+
+# flask import venues|artists|shows FILE imports a CSV (header row) or JSON
+# lines file with the fields of the create forms (shows: artist_id, venue_id,
+# start_time and end_time or duration in minutes), shows checked like the
+# show form (validate_record). Progress is checkpointed after every batch and
+# an interrupted import resumes from its checkpoint.
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path')
+@click.option('--format', 'format', type=click.Choice(['csv', 'jsonl']), help='Input format, from the file extension by default.')
+@click.option('--batch-size', default=1000, show_default=True, help='Records per transaction.')
+@click.option('--checkpoint', help='Checkpoint file, PATH.checkpoint by default.')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint.')
+def import_records(kind, path, format, batch_size, checkpoint, restart):
+  if checkpoint is None and path != '-':
+      checkpoint = path + '.checkpoint'
+  checkpoint = Checkpoint(checkpoint, kind, path) if checkpoint else None
+  try:
+      skip = 0 if restart or checkpoint is None else checkpoint.load()
+  except RecordError as e:
+      raise click.ClickException('{} (--restart ignores it)'.format(e))
+  if skip:
+      click.echo('Resuming after {} records'.format(skip))
+  importer = BulkImporter(db, batch_size, timedelta(minutes=app.config['SHOW_DURATION_MINUTES']), validate_record)
+
+  def after_batch(kind, ids, rows):
+      if kind == 'shows':
+          refresh_show_counters(artist_ids=set(row['artist_id'] for row in rows),
+                                venue_ids=set(row['venue_id'] for row in rows))
+          db.session.commit()
+
+  def progress(done, rate):
+      if checkpoint:
+          checkpoint.save(done)
+      click.echo('{}: {} records, {:.0f} rows/s'.format(kind, done, rate))
+
+  started = time.time()
+  try:
+      done = importer.run(kind, read_records(path, format), skip, after_batch, progress)
+  except (RecordError, DBAPIError) as e:
+      raise click.ClickException('{} (resume with the same command)'.format(e))
+  finally:
+      table = {'venues': 'Venue', 'artists': 'Artist', 'shows': 'Show'}[kind]
+      bus.publish(tags=[kind], entities=[(table, None, 'reload')])
+  if checkpoint:
+      checkpoint.clear()
+  click.echo('Imported {} {} in {:.1f}s'.format(done - skip, kind, time.time() - started))
+
+#  Bulk export
+#  ----------------------------------------------------------------
+
+# flask export shows|artists|venues writes every record as CSV, NDJSON or
+# Parquet (with pyarrow) in constant memory; see exporter.py. The file only
+# takes its name once the export is complete.
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson', 'parquet']), default='csv', show_default=True)
+@click.option('--output', '-o', default='-', help='Output file, - for stdout.')
+@click.option('--batch-size', default=None, type=int, help='Rows fetched per round trip.')
+def export_records(kind, format, output, batch_size):
+  if format not in writers():
+      raise click.ClickException('The parquet format needs pyarrow')
+  stats = {}
+  started = time.time()
+  chunks = export(db, kind, format, batch_size or app.config['EXPORT_BATCH_SIZE'], stats)
+  if output == '-':
+      out = click.get_binary_stream('stdout')
+      for chunk in chunks:
+          out.write(chunk)
+      out.flush()
+  else:
+      tmp = output + '.tmp'
+      with open(tmp, 'wb') as f:
+          for chunk in chunks:
+              f.write(chunk)
+      os.replace(tmp, output)
+  click.echo('Exported {} {} in {:.1f}s'.format(stats['rows'], kind, time.time() - started), err=True)
+
+# Helper function to guard an endpoint with "Authorization: Bearer <token>",
+# the token from config[key]; the endpoint does not exist while it is unset
+def require_token(key):
+    token = app.config.get(key)
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), 'Bearer {}'.format(token).encode('utf-8')):
+        abort(401)
+
+# Same exports over HTTP for the analytics jobs, with
+# "Authorization: Bearer <EXPORT_TOKEN>"; disabled while EXPORT_TOKEN is unset
+@app.route('/export/<kind>.<format>')
+def export_download(kind, format):
+  require_token('EXPORT_TOKEN')
+  writer = writers().get(format)
+  if kind not in KINDS or writer is None:
+      abort(404)
+  chunks = export(db, kind, format, app.config['EXPORT_BATCH_SIZE'])
+  return Response(stream_with_context(chunks), mimetype=writer.mimetype, headers={
+    'Content-Disposition': 'attachment; filename={}.{}'.format(kind, writer.extension)
+  })
+
+#  Status
+#  ----------------------------------------------------------------
+
+# Connection pool counters of this worker process (pool.py), to size
+# DB_POOL_SIZE/DB_MAX_OVERFLOW against the worker count: sustained waits or
+# overflows mean too few connections, idle checked_in ones too many
+@app.route('/status/pool')
+def pool_status():
+  require_token('STATUS_TOKEN')
+  return json_response(pool_stats.snapshot())
+
+# Per-endpoint request, SQL and render timings of this worker (metrics.py) and
+# the pool counters, in the Prometheus text format; scrape with the
+# STATUS_TOKEN as bearer token
+@app.route('/metrics')
+def prometheus_metrics():
+  require_token('STATUS_TOKEN')
+  if metrics is None:
+      abort(404)
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+if metrics is not None:
+    @metrics.collect
+    def pool_metrics():
+        snapshot = pool_stats.snapshot()
+        for key, help in (('checkouts', 'Connections checked out of the pool.'),
+                          ('connects', 'Database connections opened.'),
+                          ('invalidations', 'Pooled connections invalidated.'),
+                          ('timeouts', 'Checkouts that timed out waiting for a connection.'),
+                          ('overflows', 'Checkouts that opened an overflow connection.')):
+            name = 'fyyur_db_pool_{}_total'.format(key)
+            yield from family(name, 'counter', help)
+            yield '{} {}'.format(name, snapshot[key])
+        wait = snapshot['wait']
+        yield from family('fyyur_db_pool_wait_seconds', 'histogram', 'Time a checkout waited for a connection.')
+        yield from histogram_samples('fyyur_db_pool_wait_seconds', [bound for bound, _ in wait['buckets'][:-1]],
+            [count for _, count in wait['buckets']], wait['sum'])
+        for key, help in (('size', 'Connections kept in the pool (pool_size).'),
+                          ('checked_in', 'Idle connections in the pool.'),
+                          ('checked_out', 'Connections in use.'),
+                          ('overflow', 'Overflow connections open.'),
+                          ('max_overflow', 'Overflow connections allowed.')):
+            if 'pool' in snapshot:
+                name = 'fyyur_db_pool_{}'.format(key)
+                yield from family(name, 'gauge', help)
+                yield '{} {}'.format(name, snapshot['pool'][key])
+
+#  Static assets
+#  ----------------------------------------------------------------
+
+# Deploy step: flask assets build writes the ASSET_BUNDLES (minified,
+# fingerprinted, precompressed) and their manifest; see assets.py. Running
+# workers pick the new manifest up through the bus. Earlier bundles are kept
+# for pages still cached by browsers.
+@app.cli.group('assets')
+def assets_cli():
+  pass
+
+@assets_cli.command('build')
+def build_assets():
+  for name, filename in sorted(bundles.build().items()):
+      click.echo('{} -> {}'.format(name, filename))
+  bus.publish(entities=[(None, None, 'assets')])
+
+#  Image garbage collection
+#  ----------------------------------------------------------------
+
+# Helper function to drop deleted files from the image store of every worker,
+# which would otherwise keep pointing image_url and image_srcset at them
+def forget_images(paths):
+    if paths:
+        bus.publish(entities=[('Image', path, 'remove') for path in paths])
+
+# Periodic job (cron), e.g. nightly: flask gc-images deletes the files of the
+# image store that no Artist or Venue image_link points at any more (replaced
+# or deleted entities), variants included. The store is walked with scandir
+# and the references come from one streamed query, so memory grows with the
+# number of entities, not of files. Files younger than --min-age are kept:
+# their upload may not be committed yet. --legacy also considers the images
+# saved directly in UPLOAD_FOLDER before the store, except IMAGE_GC_KEEP.
+@app.cli.command('gc-images')
+@click.option('--dry-run', is_flag=True, help='Only report the orphans and the bytes they take.')
+@click.option('--quarantine', metavar='DIR', help='Move orphans under DIR instead of deleting them.')
+@click.option('--min-age', default=None, type=int, help='Seconds an orphan must be old, IMAGE_GC_MIN_AGE by default.')
+@click.option('--legacy', is_flag=True, help='Also collect the images at the top of UPLOAD_FOLDER.')
+@click.option('--verbose', '-v', is_flag=True, help='List every orphan.')
+def gc_images(dry_run, quarantine, min_age, legacy, verbose):
+  referenced = set(app.config['IMAGE_GC_KEEP'])
+  for model in (Artist, Venue):
+      query = db.session.query(model.image_link).filter(model.image_link.isnot(None))
+      referenced.update(link for (link,) in query.execution_options(yield_per=1000))
+  roots = [(app.config['IMAGE_STORE_DIR'], True)]
+  if legacy:
+      roots.append((app.config['UPLOAD_FOLDER'], False))
+  if min_age is None:
+      min_age = app.config['IMAGE_GC_MIN_AGE']
+  files = 0
+  size = 0
+  removed = []
+  for path, nbytes in find_orphans(roots, referenced, min_age, time.time(), ALLOWED_EXTENSIONS):
+      if verbose or dry_run:
+          click.echo('{} {}'.format(nbytes, path))
+      if not dry_run:
+          try:
+              if quarantine:
+                  target = os.path.join(quarantine, os.path.relpath(path))
+                  os.makedirs(os.path.dirname(target), exist_ok=True)
+                  shutil.move(path, target)
+              else:
+                  os.remove(path)
+          except FileNotFoundError:
+              continue
+          removed.append(path)
+          if len(removed) == 50: # pg_notify payloads stay under 8000 bytes
+              forget_images(removed)
+              removed = []
+      files += 1
+      size += nbytes
+  forget_images(removed)
+  action = 'Would reclaim' if dry_run else 'Quarantined' if quarantine else 'Reclaimed'
+  click.echo('{} {} bytes in {} files'.format(action, size, files))
+
+#  Scheduling
+#  ----------------------------------------------------------------
+
+# Helper function to load everything the free slot finder needs for a set of
+# artists and venues with three queries, whatever the number of ids
+# | return Tuple({artist_id: (available, busy)}, {venue_id: busy})
+def load_schedules(artist_ids, venue_ids, start, end):
+    restricted = set(artist_id for (artist_id,) in db.session.query(ArtistAvailability.artist_id)
+        .filter(ArtistAvailability.artist_id.in_(artist_ids))
+        .distinct())
+    artists = dict((artist_id, ([] if artist_id in restricted else None, [])) for artist_id in artist_ids)
+    venues = dict((venue_id, []) for venue_id in venue_ids)
+
+    slots = db.session.query(ArtistAvailability.artist_id, ArtistAvailability.start_time, ArtistAvailability.end_time)\
+        .filter(ArtistAvailability.artist_id.in_(artist_ids),
+                ArtistAvailability.start_time < end,
+                ArtistAvailability.end_time > start)
+    for artist_id, slot_start, slot_end in slots:
+        artists[artist_id][0].append((slot_start, slot_end))
+
+    # Shows created before end_time existed are assumed to last SHOW_DURATION_MINUTES
+    default_duration = timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+    shows = db.session.query(Show.artist_id, Show.venue_id, Show.start_time, Show.end_time)\
+        .filter(db.or_(Show.artist_id.in_(artist_ids), Show.venue_id.in_(venue_ids)),
+                Show.start_time < end,
+                db.or_(Show.end_time > start,
+                       db.and_(Show.end_time.is_(None), Show.start_time > start - default_duration)))
+    for artist_id, venue_id, show_start, show_end in shows:
+        booked = (show_start, show_end or show_start + default_duration)
+        if artist_id in artists:
+            artists[artist_id][1].append(booked)
+        if venue_id in venues:
+            venues[venue_id].append(booked)
+    return (artists, venues)
+
+def parse_schedule_query(query): # return dict or abort(400)
+    try:
+        artist_ids = [int(artist_id) for artist_id in query.get('artist_ids', [])]
+        venue_ids = [int(venue_id) for venue_id in query.get('venue_ids', [])]
+        start = dateutil.parser.parse(query['from']) if query.get('from') else datetime.now().replace(second=0, microsecond=0)
+        days = int(query.get('days', app.config['SCHEDULE_DEFAULT_DAYS']))
+        min_minutes = int(query.get('min_minutes', 0))
+    except (TypeError, ValueError, OverflowError):
+        abort(400)
+    if not (artist_ids or venue_ids) or not 0 < days <= app.config['SCHEDULE_MAX_DAYS'] or min_minutes < 0:
+        abort(400)
+    return {
+      "artist_ids": artist_ids,
+      "venue_ids": venue_ids,
+      "start": start,
+      "end": start + timedelta(days=days),
+      "min_length": timedelta(minutes=min_minutes)
+    }
+
+# Helper function to answer free slot queries, loading the schedules of all of
+# them together | return list of results
+def find_free_slots(queries):
+    artist_ids = set(artist_id for query in queries for artist_id in query['artist_ids'])
+    venue_ids = set(venue_id for query in queries for venue_id in query['venue_ids'])
+    artists, venues = load_schedules(artist_ids, venue_ids,
+        min(query['start'] for query in queries), max(query['end'] for query in queries))
+    results = []
+    for query in queries:
+        participants = [artists[artist_id] for artist_id in query['artist_ids']]
+        participants += [(None, venues[venue_id]) for venue_id in query['venue_ids']]
+        slots = common_free_slots((query['start'], query['end']), participants, query['min_length'])
+        results.append({
+          "artist_ids": query['artist_ids'],
+          "venue_ids": query['venue_ids'],
+          "from": query['start'].isoformat(),
+          "to": query['end'].isoformat(),
+          "slots": [{"start": start.isoformat(), "end": end.isoformat()} for start, end in slots]
+        })
+    return results
+
+# GET /schedule/free?artist_id=1&artist_id=2&venue_id=3&days=90&min_minutes=120
+@app.route('/schedule/free')
+def free_slots():
+  query = parse_schedule_query({
+    "artist_ids": request.args.getlist('artist_id'),
+    "venue_ids": request.args.getlist('venue_id'),
+    "from": request.args.get('from'),
+    "days": request.args.get('days', app.config['SCHEDULE_DEFAULT_DAYS']),
+    "min_minutes": request.args.get('min_minutes', 0)
+  })
+  return jsonify(find_free_slots([query])[0])
+
+# Batch mode: POST {"queries": [{"artist_ids": [...], "venue_ids": [...], "from": ..., "days": ..., "min_minutes": ...}, ...]}
+@app.route('/schedule/free', methods=['POST'])
+@csrf.exempt
+def free_slots_batch():
+  body = request.get_json(silent=True) or {}
+  queries = body.get('queries')
+  if not isinstance(queries, list) or not queries or len(queries) > app.config['SCHEDULE_MAX_QUERIES']:
+      abort(400)
+  queries = [parse_schedule_query(query) if isinstance(query, dict) else abort(400) for query in queries]
+  return jsonify({"results": find_free_slots(queries)})
+
+# Page cache counters of this worker, with the STATUS_TOKEN as bearer token
+@app.route('/cache/stats')
+def cache_stats():
+  require_token('STATUS_TOKEN')
+  return jsonify(page_cache.stats())
+
+#  API
+#  ----------------------------------------------------------------
+
+# Read-only JSON API under /api/v1. Lists are keyset paginated (?after=&limit=)
+# and ?fields=a,b selects the fields of each item.
+API_FIELDS = {
+  Venue: ('id', 'name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link', 'image_link',
+          'seeking_talent', 'seeking_description', 'upcoming_shows_count', 'past_shows_count', 'genres'),
+  Artist: ('id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link', 'image_link',
+           'seeking_venue', 'seeking_description', 'upcoming_shows_count', 'past_shows_count', 'genres'),
+  Show: ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link')
+}
+API_DETAIL_FIELDS = ('past_shows', 'upcoming_shows')
+API_SEARCHES = ('artists', 'venues', 'artists_by_city', 'venues_by_city')
+
+def parse_api_fields(allowed): # return list or abort(400)
+    fields = request.args.get('fields')
+    if not fields:
+        return list(allowed)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not fields or any(field not in allowed for field in fields):
+        abort(400)
+    return fields
+
+def parse_api_limit():
+    limit = request.args.get('limit', app.config['API_PER_PAGE'], type=int)
+    return max(1, min(limit, app.config['API_MAX_PER_PAGE']))
+
+# Helper function to load the genre names of many venues/artists in one query
+# | return dict {id: [names]}
+def load_genre_names(model, ids):
+    table, column = (venue_genres, venue_genres.c.venue_id) if model is Venue else (artist_genres, artist_genres.c.artist_id)
+    rows = db.session.query(column, Genre.name)\
+        .join(Genre, Genre.id == table.c.genre_id)\
+        .filter(column.in_(ids))\
+        .order_by(column, Genre.name)
+    names = {entity_id: [] for entity_id in ids}
+    for entity_id, name in rows:
+        names[entity_id].append(name)
+    return names
+
+# Helper function to load venues/artists with only the selected columns
+# | return list of dict
+def api_entities(model, fields, *criteria, after=None, limit=None):
+    columns = [model.id] + [getattr(CityState, field) if field in ('city', 'state') else getattr(model, field)
+        for field in fields if field not in ('id', 'genres') + API_DETAIL_FIELDS]
+    query = db.session.query(*columns).filter(*criteria)
+    if 'city' in fields or 'state' in fields:
+        query = query.join(CityState, CityState.id == model.city_state_id)
+    if after is not None:
+        query = query.filter(model.id > after)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    items = [row._asdict() for row in query]
+    if 'genres' in fields:
+        genres = load_genre_names(model, [item['id'] for item in items])
+        for item in items:
+            item['genres'] = genres[item['id']]
+    return [{field: item[field] for field in fields if field in item} for item in items]
+
+# Show dicts of the views without the versions kept for the fragment cache
+def api_show(show, fields=None):
+    show = {("id" if key == "show_id" else key): value for key, value in show.items() if not key.endswith('_version')}
+    return show if fields is None else {field: show[field] for field in fields}
+
+def api_list(model, endpoint):
+    fields = parse_api_fields(API_FIELDS[model])
+    limit = parse_api_limit()
+    after = request.args.get('after')
+    if after is not None and not after.isdigit():
+        abort(400)
+    columns = fields if 'id' in fields else fields + ['id']
+    data = api_entities(model, columns, after=int(after) if after else None, limit=limit + 1)
+    next_url = None
+    if len(data) > limit:
+        data = data[:limit]
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'limit')}
+        next_url = url_for(endpoint, after=data[-1]['id'], limit=limit, **args)
+    if columns is not fields:
+        for item in data:
+            del item['id']
+    return json_response({"data": data, "next": next_url})
+
+def api_detail(model, entity_id):
+    fields = parse_api_fields(API_FIELDS[model] + API_DETAIL_FIELDS)
+    data = api_entities(model, fields + ['id'], model.id == entity_id)
+    if not data:
+        abort(404)
+    data = data[0]
+    if any(field in fields for field in API_DETAIL_FIELDS):
+        past_shows, upcoming_shows = get_past_upcom_shows(entity_id, 0 if model is Venue else 1)
+        data['past_shows'] = [api_show(show) for show in past_shows]
+        data['upcoming_shows'] = [api_show(show) for show in upcoming_shows]
+    return json_response({field: data[field] for field in fields})
+
+@app.route('/api/v1/venues')
+@conditional(listing_version(Venue))
+def api_venues():
+  return api_list(Venue, 'api_venues')
+
+@app.route('/api/v1/venues/<int:venue_id>')
+@conditional(venue_version)
+def api_venue(venue_id):
+  return api_detail(Venue, venue_id)
+
+@app.route('/api/v1/artists')
+@conditional(listing_version(Artist))
+def api_artists():
+  return api_list(Artist, 'api_artists')
+
+@app.route('/api/v1/artists/<int:artist_id>')
+@conditional(artist_version)
+def api_artist(artist_id):
+  return api_detail(Artist, artist_id)
+
+# ?format=ndjson streams every matching show, one per line, without a page
+# limit unless ?limit= is given
+@app.route('/api/v1/shows')
+@conditional(listing_version(Show, Artist, Venue))
+def api_shows():
+  fields = parse_api_fields(API_FIELDS[Show])
+  after = request.args.get('after')
+  after = decode_show_cursor(after) if after else None
+  start, end = parse_time_arg('from'), parse_time_arg('to')
+  if request.args.get('format') == 'ndjson':
+      query = shows_page_query(after, start, end)
+      if request.args.get('limit'):
+          query = query.limit(parse_api_limit())
+      return ndjson_response(api_show(show_listing_item(row), fields) for row in query.yield_per(1000))
+  page = {'next_url': None}
+  data = [api_show(show, fields) for show in iter_shows_page(page, after, start, end, parse_api_limit(), 'api_shows')]
+  return json_response({"data": data, "next": page['next_url']})
+
+@app.route('/api/v1/search')
+def api_search():
+  kind = request.args.get('type', 'artists')
+  if kind not in API_SEARCHES:
+      abort(400)
+  data = [{"id": row.id, "name": row.name} for row in search.search(kind, request.args.get('q', ''))]
+  return json_response({"count": len(data), "data": data})
+
+def api_error(error):
+    return json_response({"error": error.name, "status": error.code}, error.code)
+
+@app.errorhandler(400)
+def bad_request_error(error):
+    if request.path.startswith('/api/'):
+        return api_error(error)
+    return error
+
 @app.errorhandler(404)
 def not_found_error(error):
+    if request.path.startswith('/api/'):
+        return api_error(error)
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
 def server_error(error):
+    if request.path.startswith('/api/'):
+        return api_error(error)
     return render_template('errors/500.html'), 500
 
 
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory, url_for
+
+# The minifiers and brotli are optional; without them CSS goes through
+# minify_css below, JS is only concatenated and no .br files are written
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#----------------------------------------------------------------------------#
+# Minification.
+#----------------------------------------------------------------------------#
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+# Innermost braces: declaration blocks, where a colon separates property and
+# value; in a selector the space before one is a descendant combinator
+CSS_DECLARATIONS = re.compile(r'\{[^{}]*\}')
+CSS_COLON = re.compile(r'\s*:\s*')
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# Comments and redundant whitespace out, good enough for our own stylesheets
+def minify_css(source):
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    source = CSS_COMMENT.sub('', source)
+    source = CSS_SPACE.sub(' ', source)
+    source = CSS_PUNCTUATION.sub(r'\1', source)
+    source = CSS_DECLARATIONS.sub(lambda match: CSS_COLON.sub(':', match.group(0)), source)
+    return source.replace(';}', '}').strip()
+
+def minify_js(source):
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    return source.strip()
+
+# Relative url(...) of a stylesheet under static/<source> rewritten for the
+# bundle under static/<target>, both paths relative to the static folder
+def rebase_urls(source, path, target):
+    def rebase(match):
+        url = match.group(2)
+        if url.startswith(('/', 'data:', '#')) or '://' in url:
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(path), url))
+        return 'url("{}")'.format(posixpath.relpath(resolved, posixpath.dirname(target)))
+    return CSS_URL.sub(rebase, source)
+
+
+#----------------------------------------------------------------------------#
+# Bundles.
+#----------------------------------------------------------------------------#
+
+# Bundles of ASSET_BUNDLES ({name: [paths under static/]}) are built by
+# `flask assets build` into static/<ASSETS_DIR>/<stem>.<hash>.<ext>, with .gz
+# and .br copies, and listed in the manifest.json next to them. Templates ask
+# asset_urls(name) for the URLs to load: the bundle once built, the source
+# files until then.
+#
+# The built files never change under a name, so they are served with
+# "Cache-Control: immutable" and the precompressed copy the client accepts.
+class AssetBundles(object):
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.static = app.static_folder
+        self.directory = app.config['ASSETS_DIR']
+        self.bundles = app.config['ASSET_BUNDLES']
+        self.manifest_path = os.path.join(self.static, self.directory, 'manifest.json')
+        self.load()
+        app.extensions['assets'] = self
+        app.jinja_env.globals['asset_urls'] = self.urls
+        app.add_url_rule('{}/{}/<path:filename>'.format(app.static_url_path, self.directory),
+            'asset', self.send)
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    # Bundle name | return list of URLs
+    def urls(self, name):
+        built = self.manifest.get(name)
+        if built is not None:
+            return [url_for('asset', filename=built)]
+        return [url_for('static', filename=path) for path in self.bundles[name]]
+
+    # Builds every bundle and writes the manifest | return dict name: file
+    def build(self):
+        out = os.path.join(self.static, self.directory)
+        os.makedirs(out, exist_ok=True)
+        manifest = {}
+        for name, paths in self.bundles.items():
+            stem, ext = os.path.splitext(name)
+            target = posixpath.join(self.directory, name)
+            parts = []
+            for path in paths:
+                with open(os.path.join(self.static, path), encoding='utf-8') as f:
+                    source = f.read()
+                if ext == '.css':
+                    parts.append(minify_css(rebase_urls(source, path, target)))
+                elif path.endswith('.min.js'):
+                    parts.append(source.strip())
+                else:
+                    parts.append(minify_js(source))
+            # ';' keeps a script without a trailing semicolon from running on
+            # into the next one
+            data = ('\n' if ext == '.css' else ';\n').join(parts).encode('utf-8')
+            filename = '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:12], ext)
+            self.write(os.path.join(out, filename), data)
+            self.write(os.path.join(out, filename + '.gz'), gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                self.write(os.path.join(out, filename + '.br'), brotli.compress(data, quality=11))
+            manifest[name] = filename
+        self.write(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        self.manifest = manifest
+        return manifest
+
+    def write(self, path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def send(self, filename):
+        directory = os.path.join(self.static, self.directory)
+        accepted = request.accept_encodings
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[candidate] and os.path.isfile(os.path.join(directory, filename + suffix)):
+                encoding = candidate
+                break
+        if encoding is None:
+            response = send_from_directory(directory, filename, max_age=self.app.config['ASSETS_MAX_AGE'])
+        else:
+            response = send_from_directory(directory, filename + ('.br' if encoding == 'br' else '.gz'),
+                max_age=self.app.config['ASSETS_MAX_AGE'], mimetype=guess_mimetype(filename))
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def guess_mimetype(filename):
+    return {'.css': 'text/css', '.js': 'text/javascript'}.get(os.path.splitext(filename)[1], 'application/octet-stream')
@@ -0,0 +1,62 @@
+# Bytes saved against CPU spent by compression.py, per route, at a few gzip
+# levels and brotli qualities. Pages are fetched uncompressed from a running
+# instance and pushed through CompressionMiddleware in 8 KiB chunks, as a
+# streamed response would be.
+#
+#   python benchmarks/bench_compression.py [base url] [runs]
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from compression import CompressionMiddleware, brotli
+
+ROUTES = ['/', '/venues', '/artists', '/shows', '/venues/1', '/artists/1',
+          '/api/v1/venues', '/api/v1/shows', '/api/v1/shows?format=ndjson']
+CHUNK = 8 * 1024
+
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={'Accept-Encoding': 'identity'})
+    with urllib.request.urlopen(request) as response:
+        return response.read(), response.headers.get('Content-Type', 'text/html')
+
+
+def compressed_size(body, content_type, encoding, level, runs):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', content_type)])
+        return [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)]
+
+    if encoding == 'br':
+        middleware = CompressionMiddleware(app, brotli_quality=level)
+    else:
+        middleware = CompressionMiddleware(app, level=level)
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': encoding}
+    started = time.thread_time()
+    for _ in range(runs):
+        size = sum(len(chunk) for chunk in middleware(environ, lambda status, headers, exc_info=None: None))
+    return size, (time.thread_time() - started) / runs
+
+
+def main(base='http://127.0.0.1:5000', runs=20):
+    runs = int(runs)
+    settings = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        settings += [('br', 4), ('br', 11)]
+    print('{:<28} {:>9} {:>8} {:>10} {:>9} {:>9}'.format('route', 'bytes', 'encoding', 'saved', 'ratio', 'cpu ms'))
+    for route in ROUTES:
+        try:
+            body, content_type = fetch(base.rstrip('/') + route)
+        except OSError as e:
+            print('{:<28} {}'.format(route, e))
+            continue
+        for encoding, level in settings:
+            size, cpu = compressed_size(body, content_type, encoding, level, runs)
+            print('{:<28} {:>9} {:>8} {:>10} {:>8.1f}x {:>9.2f}'.format(
+                route, len(body), '{}-{}'.format(encoding, level), len(body) - size,
+                len(body) / max(size, 1), cpu * 1000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
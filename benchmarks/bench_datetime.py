@@ -0,0 +1,51 @@
+# Cost of the `datetime` template filter on a page of shows: the previous filter
+# (strftime in the view, dateutil parse + babel format_datetime in the template)
+# against formatting.py with strings and native datetimes.
+#
+#   python benchmarks/bench_datetime.py [shows]
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from formatting import format_datetime
+
+
+def previous_filter(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def main(shows=500):
+    rng = random.Random(3)
+    start = datetime(2030, 1, 1)
+    # Shows start on the hour or half hour, so a page repeats some start times
+    times = [start + timedelta(days=rng.randint(0, 90), minutes=30 * rng.randint(36, 46)) for _ in range(shows)]
+    texts = [time.strftime('%m/%d/%Y, %H:%M:%S') for time in times]
+
+    assert [previous_filter(text, 'full') for text in texts] == [format_datetime(time, 'full') for time in times]
+
+    runs = 20
+    cases = [
+      ('previous filter', lambda: [previous_filter(text, 'full') for text in texts]),
+      ('filter, strings', lambda: [format_datetime(text, 'full') for text in texts]),
+      ('filter, datetimes', lambda: [format_datetime(time, 'full') for time in times]),
+    ]
+    print('{} shows, {} distinct start times'.format(shows, len(set(times))))
+    print('{:<20} {:>12} {:>10}'.format('', 'ms/page', 'us/show'))
+    for name, run in cases:
+        elapsed = timeit.timeit(run, number=runs) / runs
+        print('{:<20} {:>12.2f} {:>10.1f}'.format(name, elapsed * 1000, elapsed / shows * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,46 @@
+# Latency of the free slot finder of scheduling.py as the number of artists and
+# the horizon grow. Every artist gets a show every other day on average and
+# half of them declare evening availability ranges; one venue is included.
+#
+#   python benchmarks/bench_scheduling.py
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scheduling import common_free_slots
+
+
+def make_participant(rng, start, days, restricted):
+    busy = []
+    for day in range(days):
+        if rng.random() < 0.5:
+            show_start = start + timedelta(days=day, hours=rng.randint(12, 22))
+            busy.append((show_start, show_start + timedelta(minutes=rng.choice([60, 90, 120, 180]))))
+    available = None
+    if restricted:
+        available = [(start + timedelta(days=day, hours=17), start + timedelta(days=day, hours=23))
+                     for day in range(days) if rng.random() < 0.8]
+    return (available, busy)
+
+
+def main():
+    rng = random.Random(7)
+    start = datetime(2030, 1, 1)
+    print('{:>8} {:>6} {:>12} {:>8}'.format('artists', 'days', 'ms/query', 'slots'))
+    for days in (30, 90, 365):
+        for artists in (1, 5, 20, 50, 100):
+            participants = [make_participant(rng, start, days, restricted=i % 2 == 0) for i in range(artists)]
+            participants.append(make_participant(rng, start, days, restricted=False))
+            horizon = (start, start + timedelta(days=days))
+            runs = 20
+            elapsed = timeit.timeit(
+                lambda: common_free_slots(horizon, participants, timedelta(minutes=60)), number=runs)
+            slots = common_free_slots(horizon, participants, timedelta(minutes=60))
+            print('{:>8} {:>6} {:>12.3f} {:>8}'.format(artists, days, elapsed / runs * 1000, len(slots)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Compares the leading-wildcard ILIKE search path with the in-process trigram
+# index of search.py (SEARCH_BACKEND = 'memory').
+#
+#   python benchmarks/bench_search.py [entities] [queries]
+#
+# The ILIKE path runs against an in-memory SQLite table (SQLite LIKE is
+# case-insensitive like Postgres ILIKE and also cannot use an index for it).
+import os
+import random
+import sys
+import timeit
+from array import array
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search import TrigramIndex
+
+SYLLABLES = [c + v for c in 'bcdfghjklmnprstvwz' for v in 'aeiou'] + ['sh', 'th', 'ng', 'rk', 'st']
+
+
+def make_name(rng):
+    return ' '.join(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+                    for _ in range(rng.randint(1, 3)))
+
+
+def main(entities=200000, queries=200):
+    rng = random.Random(42)
+    names = [make_name(rng) for _ in range(entities)]
+    terms = []
+    for _ in range(queries):
+        name = rng.choice(names).lower()
+        start = rng.randint(0, max(0, len(name) - 4))
+        terms.append(name[start:start + rng.randint(3, 6)])
+
+    engine = sa.create_engine('sqlite://')
+    metadata = sa.MetaData()
+    artist = sa.Table('Artist', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(artist.insert(), [{'id': i + 1, 'name': name} for i, name in enumerate(names)])
+
+    index = TrigramIndex()
+    build = timeit.timeit(lambda: index.build((i + 1, name) for i, name in enumerate(names)), number=1)
+    postings = sum(len(p) for p in index.postings.values())
+    posting_bytes = postings * array('I').itemsize
+
+    with engine.connect() as conn:
+        query = sa.select(artist.c.id).where(artist.c.name.like(sa.bindparam('pattern')))
+        ilike = timeit.timeit(
+            lambda: [conn.execute(query, {'pattern': '%' + term + '%'}).all() for term in terms], number=1)
+        # Same answers from both paths
+        for term in terms[:20]:
+            expected = sorted(row[0] for row in conn.execute(query, {'pattern': '%' + term + '%'}))
+            assert sorted(index.search(term)) == expected, term
+    memory = timeit.timeit(lambda: [index.search(term) for term in terms], number=1)
+
+    print('entities: {}  queries: {}'.format(entities, queries))
+    print('index build: {:.2f}s  trigrams: {}  postings: {} ({:.1f} MiB)'.format(
+        build, len(index.postings), postings, posting_bytes / 1024.0 / 1024.0))
+    print('ILIKE   : {:9.1f} us/query'.format(ilike / queries * 1e6))
+    print('trigram : {:9.1f} us/query  ({:.0f}x)'.format(memory / queries * 1e6, ilike / memory))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,234 @@
+import json
+import os
+import select
+import threading
+import time
+import uuid
+
+#----------------------------------------------------------------------------#
+# Transports.
+#----------------------------------------------------------------------------#
+
+# A transport sends JSON payloads to every worker and calls receive(payload)
+# in a listener thread for payloads sent by any worker, including itself.
+
+# Postgres LISTEN/NOTIFY on a dedicated psycopg2 connection
+class PostgresTransport(object):
+    def __init__(self, engine, channel):
+        self.engine = engine
+        self.channel = channel
+
+    def send(self, payload):
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.exec_driver_sql('SELECT pg_notify(%s, %s)', (self.channel, payload))
+
+    def listen(self, receive, stopped):
+        connection = self.engine.raw_connection()
+        try:
+            raw = connection.dbapi_connection
+            raw.autocommit = True
+            cursor = raw.cursor()
+            cursor.execute('LISTEN "{}"'.format(self.channel))
+            while not stopped.is_set():
+                if select.select([raw], [], [], 1.0) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    receive(raw.notifies.pop(0).payload)
+        finally:
+            connection.invalidate()
+
+
+# Stand-in for tests and single-host setups: a log file that every worker
+# tails. Each payload is written with one O_APPEND write. Past max_bytes the
+# sender renames the log to <path>.1 (replacing the previous one) and the next
+# write starts a new file; readers finish the renamed file through the handle
+# they hold and then follow the path to the new one. Only a reader falling a
+# whole file behind (max_bytes of events within one poll) would skip one.
+# max_bytes None keeps a single growing log.
+class FileTransport(object):
+    def __init__(self, path, poll_interval=0.01, max_bytes=1024 * 1024):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        open(path, 'ab').close()
+
+    def send(self, payload):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, payload.encode('utf-8') + b'\n')
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if self.max_bytes and size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        try:
+            os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            return # rotated by another worker
+        open(self.path, 'ab').close()
+
+    # True once the path names another file than the open log
+    def rotated(self, log):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(log.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def listen(self, receive, stopped):
+        log = open(self.path, 'rb')
+        try:
+            log.seek(0, os.SEEK_END)
+            pending = b''
+            while not stopped.is_set():
+                chunk = log.read()
+                if not chunk and self.rotated(log):
+                    # Whatever reached the renamed file before the check, then
+                    # the new file from its start
+                    chunk = log.read()
+                    try:
+                        log, old = open(self.path, 'rb'), log
+                        old.close()
+                    except FileNotFoundError:
+                        pass # between the rename and the new file; next round
+                if not chunk:
+                    time.sleep(self.poll_interval)
+                    continue
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    if line:
+                        receive(line.decode('utf-8'))
+        finally:
+            log.close()
+
+
+#----------------------------------------------------------------------------#
+# Flask extension.
+#----------------------------------------------------------------------------#
+
+# Entity-change events published by the write handlers after commit:
+#   bus.publish(tags=['venues', 'venue:3'], entities=[('Venue', 3, 'update')])
+# Subscribers run at once in the publishing worker, and in every other worker
+# when the event arrives through the transport (INVALIDATION_BUS config:
+# 'postgresql', 'file' or None for a single process).
+class InvalidationBus(object):
+    def __init__(self, app=None, db=None):
+        self.handlers = []
+        self.transport = None
+        self.pid = None
+        self.fork_check()
+        if app is not None:
+            self.init_app(app, db)
+
+    # The origin and the listener thread belong to one process. A worker forked
+    # from a preloaded app (gunicorn --preload) inherits them from its parent,
+    # so they are made again whenever the pid changes: sharing an origin, the
+    # workers would drop each other's events as their own.
+    def fork_check(self):
+        pid = os.getpid()
+        if self.pid != pid:
+            self.lock = threading.Lock()
+            self.thread = None
+            self.stopped = threading.Event()
+            self._origin = uuid.uuid4().hex
+            self.pid = pid
+
+    @property
+    def origin(self):
+        self.fork_check()
+        return self._origin
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        app.extensions['invalidation_bus'] = self
+        app.before_request(self.start)
+
+    def get_transport(self):
+        kind = self.app.config.get('INVALIDATION_BUS')
+        if kind == 'postgresql':
+            return PostgresTransport(self.db.engine, self.app.config.get('INVALIDATION_BUS_CHANNEL', 'fyyur_invalidation'))
+        if kind == 'file':
+            return FileTransport(self.app.config['INVALIDATION_BUS_FILE'], self.app.config.get('INVALIDATION_BUS_POLL_INTERVAL', 0.01),
+                                 self.app.config.get('INVALIDATION_BUS_MAX_BYTES', 1024 * 1024))
+        if kind:
+            raise ValueError('Unknown invalidation bus: {}'.format(kind))
+        return None
+
+    # The transport is created on first use, in the worker that uses it
+    def connect(self):
+        if self.transport is None:
+            with self.lock:
+                if self.transport is None:
+                    self.transport = self.get_transport() or False
+        return self.transport or None
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+        return handler
+
+    # Starts the listener thread of this worker; runs before every request and
+    # only does work the first time in each process (threads do not survive a
+    # fork, so workers must not start it at import time)
+    def start(self):
+        self.fork_check()
+        if self.thread is not None:
+            return
+        transport = self.connect()
+        with self.lock:
+            if self.thread is not None:
+                return
+            if transport is None:
+                self.thread = False
+                return
+            self.thread = threading.Thread(target=self.listen, name='invalidation-bus', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def listen(self):
+        while not self.stopped.is_set():
+            try:
+                self.transport.listen(self.receive, self.stopped)
+            except Exception as e:
+                self.app.logger.error('Invalidation bus listener failed: {}'.format(e))
+                self.stopped.wait(1.0)
+
+    def receive(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get('origin') == self.origin:
+            return
+        with self.app.app_context():
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                self.app.logger.error('Invalidation handler failed: {}'.format(e))
+
+    def publish(self, tags=(), entities=()):
+        event = {
+          "origin": self.origin,
+          "tags": list(tags),
+          "entities": [list(entity) for entity in entities]
+        }
+        self.dispatch(event)
+        transport = self.connect()
+        if transport is not None:
+            try:
+                transport.send(json.dumps(event))
+            except Exception as e:
+                self.app.logger.error('Invalidation bus publish failed: {}'.format(e))
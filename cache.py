@@ -0,0 +1,354 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, session, make_response
+from flask_wtf.csrf import generate_csrf
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+#----------------------------------------------------------------------------#
+# Cache backends.
+#----------------------------------------------------------------------------#
+
+# Entries are invalidated through tag versions: an entry remembers the version
+# of each of its tags when it was stored, and bumping a tag makes every entry
+# stored under an older version a miss. Both backends implement
+#   get(key) / set(key, value) / delete(key)
+#   tag_versions(tags) -> list / bump(tags)
+# and count their evictions.
+
+# In-process LRU bounded by number of entries
+class MemoryCacheBackend(object):
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def tag_versions(self, tags):
+        return [self.tags.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.tags[tag] = self.tags.get(tag, 0) + 1
+
+
+# Stand-in for a shared cache server: one pickle file per entry and per tag in a
+# directory every worker of the host can reach. Tag versions are random tokens
+# so concurrent bumps from different workers cannot cancel each other out.
+class FileSystemCacheBackend(object):
+    def __init__(self, directory, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, prefix, key):
+        return os.path.join(self.directory, prefix + hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def write(self, path, value):
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        entry = self.read(self.path('e-', key))
+        return entry[1] if entry is not None and entry[0] == key else None
+
+    def set(self, key, value):
+        self.write(self.path('e-', key), (key, value))
+        self.writes += 1
+        if self.writes % 64 == 0:
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path('e-', key))
+        except OSError:
+            pass
+
+    # Drops the least recently written entries beyond max_entries
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('e-') and not entry.name.endswith('.tmp'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('e-'):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def tag_versions(self, tags):
+        return [self.read(self.path('t-', tag)) for tag in tags]
+
+    def bump(self, tags):
+        for tag in tags:
+            self.write(self.path('t-', tag), uuid.uuid4().hex)
+
+
+#----------------------------------------------------------------------------#
+# Flask extension.
+#----------------------------------------------------------------------------#
+
+# Every page embeds the session's CSRF token (search forms of the layout), so
+# the token is swapped for this placeholder before a page is stored and a fresh
+# token for the current session is put back when it is served.
+CSRF_PLACEHOLDER = b'__PAGE_CACHE_CSRF_TOKEN__'
+
+# Caches whole GET responses keyed by path and query string, tagged by the
+# entities they show:
+#
+#   @app.route('/venues/<int:venue_id>')
+#   @page_cache.cached('venues', 'venue:{venue_id}')
+#   def show_venue(venue_id):
+#       page_cache.tag('artist:3')  # tags only known while rendering
+#
+# and dropped by page_cache.invalidate('venue:1') from the write handlers.
+# Requests carrying flashed messages bypass the cache in both directions.
+class ResponseCache(object):
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('PAGE_CACHE_BACKEND')
+        max_entries = app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024)
+        if kind == 'memory':
+            self.backend = MemoryCacheBackend(max_entries)
+        elif kind == 'filesystem':
+            self.backend = FileSystemCacheBackend(app.config['PAGE_CACHE_DIR'], max_entries)
+        elif kind:
+            raise ValueError('Unknown page cache backend: {}'.format(kind))
+        app.extensions['page_cache'] = self
+
+    # Under @conditional the key also carries the version its probe read, so an
+    # entry is only served for the data it was rendered from: pages that split
+    # shows by the clock change version (and key) when a show starts, without
+    # any write to invalidate them.
+    def key(self):
+        args = sorted(request.args.items(multi=True))
+        key = 'page:{}?{}'.format(request.path, '&'.join('{}={}'.format(k, v) for k, v in args))
+        if 'page_version' in g:
+            key += '#' + hashlib.sha1(repr(g.page_version).encode('utf-8')).hexdigest()
+        return key
+
+    def tag(self, *tags):
+        if 'page_cache_tags' in g:
+            g.page_cache_tags.update(tags)
+
+    def invalidate(self, *tags):
+        if self.backend is not None and tags:
+            self.backend.bump(tags)
+            self.invalidations += len(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        return {
+          "backend": type(self.backend).__name__ if self.backend is not None else None,
+          "hits": self.hits,
+          "misses": self.misses,
+          "evictions": self.backend.evictions if self.backend is not None else 0,
+          "invalidations": self.invalidations
+        }
+
+    def cached(self, *tags):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.method != 'GET' or '_flashes' in session:
+                    return view(*args, **kwargs)
+                key = self.key()
+                entry = self.backend.get(key)
+                if entry is not None:
+                    body, status, headers, entry_tags, versions = entry
+                    if self.backend.tag_versions(entry_tags) == versions:
+                        self.hits += 1
+                        response = make_response(body.replace(CSRF_PLACEHOLDER, generate_csrf().encode('ascii')), status, headers)
+                        response.headers['X-Page-Cache'] = 'hit'
+                        return response
+                    self.backend.delete(key)
+                self.misses += 1
+
+                static_tags = [tag.format(**kwargs) for tag in tags]
+                static_versions = self.backend.tag_versions(static_tags)
+                g.page_cache_tags = set()
+                response = make_response(view(*args, **kwargs))
+                dynamic_tags = sorted(g.pop('page_cache_tags') - set(static_tags))
+                if response.status_code == 200 and not response.is_streamed:
+                    body = response.get_data()
+                    token = g.get('csrf_token')
+                    if token:
+                        body = body.replace(token.encode('ascii'), CSRF_PLACEHOLDER)
+                    headers = [(k, v) for k, v in response.headers.items() if k.lower() in ('content-type',)]
+                    self.backend.set(key, (body, response.status_code, headers,
+                        static_tags + dynamic_tags, static_versions + self.backend.tag_versions(dynamic_tags)))
+                response.headers['X-Page-Cache'] = 'miss'
+                return response
+            return wrapper
+        return decorator
+
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+# Answers If-None-Match / If-Modified-Since with 304 before the view runs:
+#
+#   @app.route('/venues/<int:venue_id>')
+#   @conditional(venue_version)
+#   def show_venue(venue_id):
+#
+# probe(**view_args) returns (version, last_modified) from a cheap query, or
+# None to leave the request to the view. version is any value whose repr()
+# changes with the page; last_modified is a naive UTC datetime or None.
+# Pages embed the session's CSRF token, so the ETag also covers the session and
+# the half of WTF_CSRF_TIME_LIMIT the token was signed in: a revalidated page
+# never carries a token that is about to expire. The version is left in
+# g.page_version for the page cache key.
+# last_modified misses deletes and changes of the clock (a show turning past),
+# so each Last-Modified sent is remembered with the version it was sent with,
+# and If-Modified-Since only answers 304 while that version still holds. The
+# record is per worker: another worker answers the same request with a 200.
+def conditional(probe):
+    sent = MemoryCacheBackend(max_entries=4096)
+
+    def etag(version):
+        limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+        epoch = int(time.time() // (limit / 2)) if limit else None
+        token = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+        return hashlib.sha1(repr((version, token, epoch)).encode('utf-8')).hexdigest()
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            stamp = probe(**kwargs)
+            if stamp is None:
+                return view(*args, **kwargs)
+            version, last_modified = stamp
+            g.page_version = version
+            digest = hashlib.sha1(repr(version).encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag(version))
+            else:
+                since = request.if_modified_since
+                fresh = since is not None and last_modified is not None and \
+                    since.replace(tzinfo=None) >= last_modified and \
+                    sent.get((request.full_path, since.replace(tzinfo=None))) == digest
+            response = make_response('', 304) if fresh else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag(version), weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                    sent.set((request.full_path, last_modified), digest)
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+#----------------------------------------------------------------------------#
+# Fragment cache.
+#----------------------------------------------------------------------------#
+
+# Jinja extension caching the rendered output of a block under a key built from
+# the tag arguments:
+#
+#   {% cache 'shows/tile', show.show_id, show.show_version, show.venue_version %}
+#     ...
+#   {% endcache %}
+#
+# Keys carry the versions of the rows the fragment shows, so a changed row
+# renders a new fragment and the stale one ages out of the LRU; nothing has to
+# be invalidated. The cache is environment.fragment_cache (a MemoryCacheBackend),
+# None renders every block.
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', [nodes.List(args)]), [], [], body)\
+            .set_lineno(lineno)
+
+    def _cache_support(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = repr(key)
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, value)
+        return value
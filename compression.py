@@ -0,0 +1,207 @@
+import threading
+import time
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+# brotli is optional; without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#----------------------------------------------------------------------------#
+# Encoders.
+#----------------------------------------------------------------------------#
+
+# Each encoder takes chunks of the body: compress(data), flush() and finish()
+# | return bytes
+
+class GzipEncoder(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+#----------------------------------------------------------------------------#
+# Middleware.
+#----------------------------------------------------------------------------#
+
+COMPRESSIBLE_MIMETYPES = ('text/', 'application/json', 'application/x-ndjson',
+    'application/javascript', 'application/xml', 'image/svg+xml')
+
+# WSGI middleware compressing responses with the best encoding the client
+# accepts (br, then gzip). Skipped: HEAD requests, 204/206/304, bodies already
+# encoded, types that are not text-like and bodies with a Content-Length below
+# min_size. Bodies without a Content-Length (streamed pages and exports) are
+# compressed as they go: the first chunk and then every flush_size bytes are
+# flushed, so the browser still gets the page head early.
+#
+# cpu_budget caps the CPU seconds spent compressing per second of wall time in
+# this process; past it responses go out uncompressed until the next second.
+# Responses of a compressible type carry Vary: Accept-Encoding either way, so
+# shared caches keep the identity and the encoded bodies apart.
+class CompressionMiddleware(object):
+    def __init__(self, app, level=6, brotli_quality=4, min_size=1024, flush_size=16 * 1024,
+                 cpu_budget=None, mimetypes=COMPRESSIBLE_MIMETYPES):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.flush_size = flush_size
+        self.cpu_budget = cpu_budget
+        self.mimetypes = tuple(mimetypes)
+        self.lock = threading.Lock()
+        self.window = 0
+        self.spent = 0.0
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        chosen = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            if encoding is not None and self.should_compress(status, headers):
+                headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                headers.append(('Content-Encoding', encoding))
+                vary(headers)
+                weaken_etag(headers)
+                chosen.append(encoding)
+            elif self.compressible(headers):
+                headers = list(headers)
+                vary(headers)
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, compressing_start_response)
+        if not chosen:
+            return body
+        return self.compress(body, chosen[0])
+
+    def negotiate(self, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not self.within_budget():
+            return None
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def should_compress(self, status, headers):
+        if status[:3] in ('204', '206', '304'):
+            return False
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-encoding' or name == 'content-range':
+                return False
+            if name == 'content-length':
+                # A malformed length is left for the server to deal with
+                try:
+                    if int(value) < self.min_size:
+                        return False
+                except ValueError:
+                    return False
+        return self.compressible(headers)
+
+    def compressible(self, headers):
+        for name, value in headers:
+            if name.lower() == 'content-type':
+                return value.lower().startswith(self.mimetypes)
+        return False
+
+    def encoder(self, encoding):
+        if encoding == 'br':
+            return BrotliEncoder(self.brotli_quality)
+        return GzipEncoder(self.level)
+
+    def compress(self, body, encoding):
+        return CompressedBody(self, body, self.encoder(encoding))
+
+    def within_budget(self):
+        if self.cpu_budget is None:
+            return True
+        with self.lock:
+            now = int(time.monotonic())
+            if now != self.window:
+                self.window = now
+                self.spent = 0.0
+            return self.spent < self.cpu_budget
+
+    def charge(self, seconds):
+        if self.cpu_budget is None:
+            return
+        with self.lock:
+            self.spent += seconds
+
+
+# Response iterable compressing the chunks of body. A class rather than a
+# generator: the server calls close() even when the client went away before
+# the first chunk, and close() must reach body (streamed pages hold a database
+# cursor until then).
+class CompressedBody(object):
+    def __init__(self, middleware, body, encoder):
+        self.middleware = middleware
+        self.body = body
+        self.encoder = encoder
+
+    def __iter__(self):
+        middleware = self.middleware
+        flushed = False
+        pending = 0
+        for chunk in self.body:
+            if not chunk:
+                continue
+            started = time.thread_time()
+            data = self.encoder.compress(chunk)
+            pending += len(chunk)
+            if not flushed or pending >= middleware.flush_size:
+                data += self.encoder.flush()
+                flushed = True
+                pending = 0
+            middleware.charge(time.thread_time() - started)
+            if data:
+                yield data
+        started = time.thread_time()
+        data = self.encoder.finish()
+        middleware.charge(time.thread_time() - started)
+        yield data
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def vary(headers):
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == 'vary':
+            if 'accept-encoding' not in value.lower():
+                headers[index] = (name, value + ', Accept-Encoding')
+            return
+    headers.append(('Vary', 'Accept-Encoding'))
+
+# A strong ETag names the exact bytes; the compressed body only keeps its meaning
+def weaken_etag(headers):
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == 'etag' and not value.startswith('W/'):
+            headers[index] = (name, 'W/' + value)
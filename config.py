@@ -9,7 +9,151 @@ DEBUG = True
 # Upload folder
 UPLOAD_FOLDER = 'static/img'
 
+# Content-addressed image store (images.py) and the widths of the resized
+# variants made in the background (needs Pillow)
+IMAGE_STORE_DIR = os.path.join(UPLOAD_FOLDER, 'store')
+IMAGE_VARIANTS = {'tile': 320, 'detail': 960}
+IMAGE_SRCSET_WIDTHS = (320, 640, 960, 1280)
+# 'thread' | 'process'
+IMAGE_POOL = 'thread'
+IMAGE_WORKERS = 2
+# flask gc-images: orphans younger than this (seconds) are kept, and these
+# files are never collected
+IMAGE_GC_MIN_AGE = 3600
+IMAGE_GC_KEEP = [os.path.join(UPLOAD_FOLDER, 'front-splash.jpg')]
+
+# CSS/JS bundles built by `flask assets build` into static/<ASSETS_DIR>, in
+# load order; the built files are cached by browsers for ASSETS_MAX_AGE
+ASSETS_DIR = 'dist'
+ASSET_BUNDLES = {
+  'main.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+               'css/main.responsive.css', 'css/main.quickfix.css'],
+  'head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+  'main.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js']
+}
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+# Response compression (compression.py): gzip level 1-9, brotli quality
+# 0-11, smallest body worth compressing, and the seconds per second this
+# process may spend compressing (None = no limit)
+COMPRESSION_ENABLED = True
+COMPRESSION_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CPU_BUDGET = 0.5
+
+# Keyset pagination of the /shows listing
+SHOWS_PER_PAGE = 50
+SHOWS_MAX_PER_PAGE = 200
+
+# Bulk exports: rows per server-side cursor fetch; /export/<kind>.<format> is
+# only served with this bearer token set
+EXPORT_BATCH_SIZE = 1000
+EXPORT_TOKEN = os.environ.get('FYYUR_EXPORT_TOKEN')
+
+# JSON API (/api/v1) page size
+API_PER_PAGE = 50
+API_MAX_PER_PAGE = 500
+
 # TODO IMPLEMENT DATABASE URL (Completed)
 # Connect to the database
 SQLALCHEMY_DATABASE_URI = 'postgres:///fyyur'
 SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+# Connection pool per process (pool.py), FYYUR_DB_* in the environment. Size
+# it so workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under the server's
+# max_connections; /status/pool shows checkout waits and overflows.
+DB_POOL_SIZE = int(os.environ.get('FYYUR_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('FYYUR_DB_MAX_OVERFLOW', 10))
+# Seconds a checkout waits for a connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get('FYYUR_DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced, below server/proxy idle timeouts
+DB_POOL_RECYCLE = int(os.environ.get('FYYUR_DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('FYYUR_DB_POOL_PRE_PING', '1') != '0'
+# Behind PgBouncer in transaction mode: no app-side pool (PgBouncer pools).
+# INVALIDATION_BUS = 'postgres' needs a direct connection then (LISTEN).
+DB_PGBOUNCER = os.environ.get('FYYUR_DB_PGBOUNCER', '0') == '1'
+
+# /status/*, /cache/stats and /metrics are only served with this bearer token set
+STATUS_TOKEN = os.environ.get('FYYUR_STATUS_TOKEN')
+# Per-request SQL, render and wall timings exported at /metrics
+METRICS_ENABLED = True
+
+# Query budget: SQL statements a request of an endpoint may run, checked by
+# test_query_budget.py and, with METRICS_ENABLED, by the guard in metrics.py
+# ('log' | 'raise' | None). Budgets hold for any amount of data.
+QUERY_BUDGET_DEFAULT = 10
+QUERY_BUDGETS = {
+  'index': 3,
+  'venues': 2,
+  'show_venue': 5,
+  'edit_venue': 4,
+  'create_venue_form': 1,
+  'artists': 2,
+  'artists_by_area': 2,
+  'show_artist': 6,
+  'edit_artist': 5,
+  'create_artist_form': 1,
+  'shows': 2,
+  'create_shows': 0,
+  'search_artists': 2,
+  'search_artists_by_city': 1,
+  'search_venues': 1,
+  'search_venues_by_city': 1,
+  'free_slots': 3,
+  'free_slots_batch': 3,
+  'api_venues': 3,
+  'api_venue': 4,
+  'api_artists': 3,
+  'api_artist': 4,
+  'api_shows': 2,
+  'api_search': 1,
+  'export_download': 1,
+  'cache_stats': 0,
+  'pool_status': 0,
+  'prometheus_metrics': 0,
+  'create_artist_submission': 7,
+  'create_venue_submission': 7,
+  'create_show_submission': 5,
+  'edit_artist_submission': 14,
+  'edit_venue_submission': 10,
+  'delete_venue': 8
+}
+QUERY_BUDGET_MODE = 'log' if DEBUG else None
+
+# Search backend: 'postgresql' | 'sqlite' | 'memory' | None to pick from the database dialect
+# 'memory' serves searches from an in-process trigram index (read-heavy nodes)
+SEARCH_BACKEND = None
+
+# Venues whose bookings the in-process double-booking guard keeps (not used
+# on Postgres, where the exclusion constraint guards them)
+VENUE_BOOKINGS_MAX_VENUES = 1024
+
+# Database time of the last `flask roll-show-counters` run
+SHOW_COUNTERS_WATERMARK = os.path.join(basedir, 'cache', 'show-counters.watermark')
+
+# Free slot finder (/schedule/free)
+# Assumed length of shows stored without an end_time, and of artist
+# availability given only by its start time
+SHOW_DURATION_MINUTES = 120
+SCHEDULE_DEFAULT_DAYS = 90
+SCHEDULE_MAX_DAYS = 366
+SCHEDULE_MAX_QUERIES = 50
+
+# Page cache: 'memory' (per-process LRU) | 'filesystem' (shared by the workers of a host) | None to disable
+PAGE_CACHE_BACKEND = 'memory'
+PAGE_CACHE_MAX_ENTRIES = 2048
+PAGE_CACHE_DIR = os.path.join(basedir, 'cache', 'pages')
+
+# Rendered {% cache %} template fragments kept per process, 0 to disable
+FRAGMENT_CACHE_MAX_ENTRIES = 4096
+
+# Invalidation bus carrying entity changes to the other workers:
+# 'postgresql' (LISTEN/NOTIFY) | 'file' (log tailed by the workers of a host) | None for a single process
+INVALIDATION_BUS = None
+INVALIDATION_BUS_CHANNEL = 'fyyur_invalidation'
+INVALIDATION_BUS_FILE = os.path.join(basedir, 'cache', 'invalidation.log')
+# Seconds between reads of the log by the 'file' bus
+INVALIDATION_BUS_POLL_INTERVAL = 0.01
+# Size at which the 'file' bus log is rotated to INVALIDATION_BUS_FILE + '.1'
+INVALIDATION_BUS_MAX_BYTES = 1024 * 1024
@@ -0,0 +1,47 @@
+# Settings of the test runs, applied before any test module imports app.py:
+# a throwaway SQLite database and image store, CSRF off, the page and fragment
+# caches and the invalidation bus off (tests that need a cache build their
+# own), the status and export endpoints behind TOKEN.
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import config
+
+TOKEN = 'test-token'
+DATA_DIR = tempfile.mkdtemp(prefix='fyyur-tests-')
+
+config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(DATA_DIR, 'fyyur.sqlite')
+config.WTF_CSRF_ENABLED = False
+config.PAGE_CACHE_BACKEND = None
+config.FRAGMENT_CACHE_MAX_ENTRIES = 0
+config.INVALIDATION_BUS = None
+config.IMAGE_STORE_DIR = os.path.join(DATA_DIR, 'images')
+config.EXPORT_TOKEN = config.STATUS_TOKEN = TOKEN
+config.QUERY_BUDGET_MODE = None
+
+
+# Empty tables for one test, in an app context | yield db
+# app.py is imported here, after the settings above.
+@pytest.fixture
+def database():
+    import app as fyyur
+    from search import SQLiteSearchBackend
+    db = fyyur.db
+    with fyyur.app.app_context():
+        db.drop_all()
+        # The FTS tables of search.py are not models; they go with their tables
+        with db.engine.begin() as conn:
+            for table, _ in SQLiteSearchBackend.indexed:
+                conn.exec_driver_sql('DROP TABLE IF EXISTS "{}_fts"'.format(table))
+        db.create_all()
+        fyyur.search.reset()
+        fyyur.bookings.clear()
+        yield db
+        db.session.remove()
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -0,0 +1,229 @@
+import csv
+import io
+
+import sqlalchemy as sa
+
+from serialization import dumps
+
+# pyarrow is optional; without it the parquet format is unavailable
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#----------------------------------------------------------------------------#
+# Export queries.
+#----------------------------------------------------------------------------#
+
+# Selects of the Core tables of db.metadata, one row per exported record. Shows
+# come joined with their artist and venue, and entities with their genres
+# aggregated per row, so every export is a single pass over one cursor.
+class ExportQueries(object):
+    def __init__(self, db, dialect):
+        tables = db.metadata.tables
+        self.show = tables['Show']
+        self.artist = tables['Artist']
+        self.venue = tables['Venue']
+        self.city_state = tables['CityState']
+        self.genre = tables['Genre']
+        self.venue_genre = tables['VenueGenre']
+        self.artist_genre = tables['ArtistGenre']
+        self.dialect = dialect
+
+    def genre_list(self, link, owner_column, owner_id):
+        if self.dialect == 'postgresql':
+            names = sa.func.string_agg(self.genre.c.name, sa.literal_column("';'"))
+        else:
+            names = sa.func.group_concat(self.genre.c.name, ';')
+        return sa.select(names)\
+            .select_from(link.join(self.genre, self.genre.c.id == link.c.genre_id))\
+            .where(owner_column == owner_id)\
+            .scalar_subquery()\
+            .label('genres')
+
+    def shows(self):
+        show, artist, venue, city_state = self.show, self.artist, self.venue, self.city_state
+        return sa.select(
+                show.c.id, show.c.start_time, show.c.end_time,
+                show.c.artist_id, artist.c.name.label('artist_name'),
+                show.c.venue_id, venue.c.name.label('venue_name'),
+                city_state.c.city.label('venue_city'), city_state.c.state.label('venue_state'))\
+            .select_from(show
+                .join(artist, artist.c.id == show.c.artist_id)
+                .join(venue, venue.c.id == show.c.venue_id)
+                .join(city_state, city_state.c.id == venue.c.city_state_id))\
+            .order_by(show.c.id)
+
+    def artists(self):
+        artist, city_state = self.artist, self.city_state
+        return sa.select(
+                artist.c.id, artist.c.name, city_state.c.city, city_state.c.state, artist.c.phone,
+                artist.c.website, artist.c.facebook_link, artist.c.image_link,
+                artist.c.seeking_venue, artist.c.seeking_description,
+                artist.c.upcoming_shows_count, artist.c.past_shows_count,
+                self.genre_list(self.artist_genre, self.artist_genre.c.artist_id, artist.c.id))\
+            .select_from(artist.join(city_state, city_state.c.id == artist.c.city_state_id))\
+            .order_by(artist.c.id)
+
+    def venues(self):
+        venue, city_state = self.venue, self.city_state
+        return sa.select(
+                venue.c.id, venue.c.name, city_state.c.city, city_state.c.state, venue.c.address,
+                venue.c.phone, venue.c.website, venue.c.facebook_link, venue.c.image_link,
+                venue.c.seeking_talent, venue.c.seeking_description,
+                venue.c.upcoming_shows_count, venue.c.past_shows_count,
+                self.genre_list(self.venue_genre, self.venue_genre.c.venue_id, venue.c.id))\
+            .select_from(venue.join(city_state, city_state.c.id == venue.c.city_state_id))\
+            .order_by(venue.c.id)
+
+
+#----------------------------------------------------------------------------#
+# Writers.
+#----------------------------------------------------------------------------#
+
+# Each writer turns batches of rows into chunks of bytes: header(), batch(rows)
+# and footer() | return bytes
+
+class CSVWriter(object):
+    mimetype = 'text/csv'
+    extension = 'csv'
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def take(self):
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def header(self):
+        self.writer.writerow([column.name for column in self.columns])
+        return self.take()
+
+    def batch(self, rows):
+        self.writer.writerows(rows)
+        return self.take()
+
+    def footer(self):
+        return b''
+
+
+class NDJSONWriter(object):
+    mimetype = 'application/x-ndjson'
+    extension = 'ndjson'
+
+    def __init__(self, columns):
+        self.names = [column.name for column in columns]
+
+    def header(self):
+        return b''
+
+    def batch(self, rows):
+        return b''.join(dumps(dict(zip(self.names, row))) + b'\n' for row in rows)
+
+    def footer(self):
+        return b''
+
+
+# File-like target of pyarrow's ParquetWriter that hands back what was written
+class ChunkSink(object):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# One row group per batch; the footer is written when the export ends
+class ParquetWriter(object):
+    mimetype = 'application/vnd.apache.parquet'
+    extension = 'parquet'
+
+    def __init__(self, columns):
+        self.schema = pyarrow.schema([(column.name, arrow_type(column.type)) for column in columns])
+        self.sink = ChunkSink()
+        self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+
+    def header(self):
+        return self.sink.take()
+
+    def batch(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=self.schema.field(i).type) for i, values in enumerate(columns)],
+            schema=self.schema))
+        return self.sink.take()
+
+    def footer(self):
+        self.writer.close()
+        return self.sink.take()
+
+
+def arrow_type(type):
+    if isinstance(type, sa.Boolean):
+        return pyarrow.bool_()
+    if isinstance(type, sa.Integer):
+        return pyarrow.int64()
+    if isinstance(type, sa.DateTime):
+        return pyarrow.timestamp('us')
+    return pyarrow.string()
+
+
+def writers():
+    available = {'csv': CSVWriter, 'ndjson': NDJSONWriter}
+    if pyarrow is not None:
+        available['parquet'] = ParquetWriter
+    return available
+
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+KINDS = ('shows', 'artists', 'venues')
+
+# Streams an export as chunks of bytes in constant memory: the rows come from a
+# server-side cursor (stream_results) batch_size at a time and every batch is
+# encoded and handed on before the next one is fetched. stats['rows'] counts
+# the exported rows.
+def export(db, kind, format, batch_size=1000, stats=None):
+    if kind not in KINDS:
+        raise ValueError('Unknown export: {}'.format(kind))
+    writer_class = writers().get(format)
+    if writer_class is None:
+        raise ValueError('Unavailable export format: {}'.format(format))
+    engine = db.engine
+    query = getattr(ExportQueries(db, engine.dialect.name), kind)()
+    writer = writer_class(list(query.selected_columns))
+    stats = stats if stats is not None else {}
+    stats['rows'] = 0
+    yield writer.header()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        for rows in result.partitions():
+            stats['rows'] += len(rows)
+            yield writer.batch([tuple(row) for row in rows])
+    yield writer.footer()
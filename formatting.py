@@ -0,0 +1,47 @@
+import threading
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#----------------------------------------------------------------------------#
+
+# Format names used by the templates, as babel patterns
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# babel's own named formats, combined from the locale's date and time formats
+BABEL_FORMATS = ('long', 'short')
+
+_patterns = {}
+_patterns_lock = threading.Lock()
+
+# Helper function to compile a format once per (format, locale)
+# | return Tuple(DateTimePattern, Locale)
+def compiled_pattern(format, locale=None):
+    key = (format, locale)
+    compiled = _patterns.get(key)
+    if compiled is None:
+        with _patterns_lock:
+            compiled = _patterns.get(key)
+            if compiled is None:
+                pattern = DATETIME_FORMATS.get(format, format)
+                compiled = _patterns[key] = (babel.dates.parse_pattern(pattern), Locale.parse(locale or babel.dates.LC_TIME))
+    return compiled
+
+# Same output as babel.dates.format_datetime(value, format) for the formats
+# above and custom patterns. value may be a datetime or a string dateutil can
+# parse; naive datetimes are taken as UTC, as babel does.
+def format_datetime(value, format='medium', locale=None):
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    if format in BABEL_FORMATS:
+        return babel.dates.format_datetime(value, format, locale=locale or babel.dates.LC_TIME)
+    pattern, locale = compiled_pattern(format, locale)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=babel.dates.UTC)
+    return pattern.apply(value, locale)
@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Pillow is optional; without it no variants are made and pages use originals
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#----------------------------------------------------------------------------#
+# Variants.
+#----------------------------------------------------------------------------#
+
+# <hash>.<ext> | return <hash>-<width>w.<ext>
+def variant_path(path, width):
+    base, ext = os.path.splitext(path)
+    return '{}-{}w{}'.format(base, width, ext)
+
+# Writes the resized copies of an original, at most width pixels wide, next to
+# it; originals are never upscaled, so a variant may be narrower than its name
+# says. Module level so it also runs in a process pool | return path
+def make_variants(path, widths):
+    with Image.open(path) as original:
+        original.load()
+        for width in widths:
+            target = variant_path(path, width)
+            if os.path.exists(target):
+                continue
+            image = original.copy()
+            image.thumbnail((width, width * 4))
+            options = {'optimize': True}
+            if original.format == 'JPEG':
+                options['quality'] = 82
+                options['progressive'] = True
+                image = image.convert('RGB')
+            tmp = '{}.{}.tmp'.format(target, uuid.uuid4().hex)
+            image.save(tmp, format=original.format, **options)
+            os.replace(tmp, target)
+    return path
+
+
+#----------------------------------------------------------------------------#
+# Flask extension.
+#----------------------------------------------------------------------------#
+
+# Uploads are stored once per content under IMAGE_STORE_DIR/<ab>/<sha256>.<ext>
+# (the two-character shard keeps directories small), so identical uploads share
+# a file and different ones never overwrite each other. Resized variants
+# (IMAGE_VARIANTS and IMAGE_SRCSET_WIDTHS) are made in a thread or process pool
+# after the upload; on_ready(path) runs once they exist.
+#
+# Templates pick a variant with the image_url and image_srcset filters, which
+# fall back to the original until the variant is there.
+class ImageStore(object):
+    def __init__(self, app=None, on_ready=None):
+        self.on_ready = on_ready
+        self.pool = None
+        self.lock = threading.Lock()
+        self.ready = set()
+        self.real_widths = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config['IMAGE_STORE_DIR']
+        self.variants = app.config['IMAGE_VARIANTS']
+        self.widths = sorted(set(self.variants.values()) | set(app.config['IMAGE_SRCSET_WIDTHS']))
+        app.extensions['images'] = self
+        app.jinja_env.filters['image_url'] = self.url
+        app.jinja_env.filters['image_srcset'] = self.srcset
+
+    def get_pool(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    workers = self.app.config.get('IMAGE_WORKERS', 2)
+                    if self.app.config.get('IMAGE_POOL') == 'process':
+                        self.pool = ProcessPoolExecutor(workers)
+                    else:
+                        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='image-variants')
+        return self.pool
+
+    # Streams a FileStorage into the store while hashing it | return path
+    def save(self, file, extension):
+        extension = 'jpg' if extension.lower() == 'jpeg' else extension.lower()
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        tmp = os.path.join(self.directory, '.upload-{}.tmp'.format(uuid.uuid4().hex))
+        with open(tmp, 'wb') as out:
+            while True:
+                chunk = file.stream.read(64 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        name = digest.hexdigest()
+        path = os.path.join(self.directory, name[:2], '{}.{}'.format(name, extension))
+        try:
+            # A new reference to the file: gc-images takes the fresh mtime for
+            # an upload whose commit may still be on its way
+            os.utime(path)
+            os.remove(tmp)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        self.schedule(path)
+        return path
+
+    # Looks at the files, not at ready: the variants of an upload seen before
+    # may have been collected since (gc-images)
+    def schedule(self, path):
+        if Image is None or all(os.path.exists(variant_path(path, width)) for width in self.widths):
+            return
+        future = self.get_pool().submit(make_variants, path, self.widths)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        try:
+            path = future.result()
+        except Exception as e:
+            self.app.logger.error('Image variants failed: {}'.format(e))
+            return
+        if self.on_ready is not None:
+            self.on_ready(path)
+
+    # Existing files are remembered in ready, so pages do not stat them on
+    # every render; forget() drops the ones deleted since
+    def has(self, path):
+        if path in self.ready:
+            return True
+        if os.path.exists(path):
+            self.ready.add(path)
+            return True
+        return False
+
+    def forget(self, *paths):
+        self.ready.difference_update(paths)
+        for path in paths:
+            self.real_widths.pop(path, None)
+
+    # Width in pixels of an existing variant, read once from its header
+    # | return int
+    def real_width(self, path, width):
+        if path not in self.real_widths:
+            if Image is None:
+                return width
+            try:
+                with Image.open(path) as image:
+                    self.real_widths[path] = image.width
+            except OSError:
+                return width
+        return self.real_widths[path]
+
+    def in_store(self, path):
+        return os.path.normpath(path).startswith(os.path.normpath(self.directory) + os.sep)
+
+    # image_link | return URL of the variant (tile, detail) or of the original
+    def url(self, path, variant='tile'):
+        if not path or '://' in path:
+            return path
+        if self.in_store(path):
+            candidate = variant_path(path, self.variants[variant])
+            if self.has(candidate):
+                path = candidate
+        return '/' + path.lstrip('/')
+
+    # image_link | return srcset attribute value of the existing variants, by
+    # their real width; variants of a small original may share one
+    def srcset(self, path):
+        if not path or '://' in path or not self.in_store(path):
+            return ''
+        candidates = []
+        seen = set()
+        for width in self.widths:
+            variant = variant_path(path, width)
+            if not self.has(variant):
+                continue
+            real = self.real_width(variant, width)
+            if real not in seen:
+                seen.add(real)
+                candidates.append('/{} {}w'.format(variant.lstrip('/'), real))
+        return ', '.join(candidates)
+
+
+#----------------------------------------------------------------------------#
+# Garbage collection.
+#----------------------------------------------------------------------------#
+
+# Files under directory, depth first, one directory listing open at a time so
+# huge stores are never listed whole | yield os.DirEntry
+def scan_files(directory, recursive=True):
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from scan_files(entry.path, recursive)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+# <hash>-<width>w.<ext> | return <hash>.<ext>, other paths unchanged
+def original_path(path):
+    base, ext = os.path.splitext(path)
+    stem, _, width = base.rpartition('-')
+    if stem and width.endswith('w') and width[:-1].isdigit():
+        return stem + ext
+    return path
+
+# Files of the given (directory, recursive) roots that no image_link in
+# referenced points at, directly or as a variant of a referenced original.
+# Files younger than min_age seconds are left alone: their upload may not be
+# committed yet | yield Tuple(path, size)
+def find_orphans(roots, referenced, min_age, now, extensions):
+    referenced = set(os.path.normpath(path.lstrip('/')) for path in referenced if path)
+    for directory, recursive in roots:
+        for entry in scan_files(directory, recursive):
+            path = os.path.normpath(entry.path)
+            if not entry.name.startswith('.upload-') and \
+                    os.path.splitext(entry.name)[1].lstrip('.').lower() not in extensions:
+                continue
+            if original_path(path) in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if now - stat.st_mtime < min_age:
+                continue
+            yield (path, stat.st_size)
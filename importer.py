@@ -0,0 +1,307 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import dateutil.parser
+import sqlalchemy as sa
+
+#----------------------------------------------------------------------------#
+# Input.
+#----------------------------------------------------------------------------#
+
+class RecordError(ValueError):
+    pass
+
+
+# Streams the records of a CSV file (header row) or JSON lines file, '-' for
+# stdin | yield Tuple(line number, dict)
+# A line that does not parse raises RecordError like an invalid field.
+def read_records(path, format=None):
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if format == 'csv':
+            reader = csv.DictReader(source)
+            try:
+                for record in reader:
+                    yield (reader.line_num, record)
+            except csv.Error as e:
+                raise RecordError('line {}: {}'.format(reader.line_num, e))
+        else:
+            for number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise RecordError('line {}: invalid JSON: {}'.format(number, e))
+                if not isinstance(record, dict):
+                    raise RecordError('line {}: not a JSON object'.format(number))
+                yield (number, record)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def text(record, key, required=False):
+    value = record.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise RecordError('missing {}'.format(key))
+        return None
+    return str(value).strip()
+
+def flag(record, key):
+    value = record.get(key)
+    if isinstance(value, bool):
+        return value
+    return (value or '').strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+def integer(record, key):
+    value = text(record, key, required=True)
+    try:
+        return int(value)
+    except ValueError:
+        raise RecordError('invalid {}'.format(key))
+
+def timestamp(record, key):
+    value = text(record, key, required=True)
+    try:
+        return dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise RecordError('invalid {}'.format(key))
+
+# Genres are a list in JSON lines and a ';' or ',' separated string in CSV
+def genre_names(record):
+    value = record.get('genres') or []
+    if isinstance(value, str):
+        value = value.replace(';', ',').split(',')
+    return list(dict.fromkeys(name.strip() for name in value if name and name.strip()))
+
+
+#----------------------------------------------------------------------------#
+# Bulk importer.
+#----------------------------------------------------------------------------#
+
+ENTITY_COLUMNS = {
+  'Venue': ('name', 'address', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_talent', 'seeking_description'),
+  'Artist': ('name', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_venue', 'seeking_description')
+}
+
+# Imports venues, artists or shows in batches, each in its own transaction:
+# CityState and Genre rows of a batch are resolved with one lookup, new rows
+# get their ids up front and go in with COPY on Postgres or executemany
+# elsewhere. Works on the Core tables of db.metadata like search.py.
+#
+# validate(kind, row) runs for every converted record and raises RecordError
+# to reject it, e.g. the booking rules of the show form. after_batch(kind, ids,
+# rows) and progress(done, rows_per_second) run after each batch commits.
+class BulkImporter(object):
+    def __init__(self, db, batch_size=1000, show_duration=timedelta(minutes=120), validate=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.show_duration = show_duration
+        self.validate = validate
+        self.tables = db.metadata.tables
+        self.city_states = {}
+        self.genres = {}
+
+    def run(self, kind, records, skip=0, after_batch=None, progress=None):
+        convert = {'venues': self.entity_row, 'artists': self.entity_row, 'shows': self.show_row}[kind]
+        done = skip
+        imported = 0
+        started = time.time()
+        batch = []
+        for index, (number, record) in enumerate(records):
+            if index < skip:
+                continue
+            try:
+                row = convert(kind, record)
+                if self.validate is not None:
+                    self.validate(kind, row)
+                batch.append(row)
+            except RecordError as e:
+                raise RecordError('line {}: {}'.format(number, e))
+            if len(batch) == self.batch_size:
+                self.insert_batch(kind, batch, after_batch)
+                done += len(batch)
+                imported += len(batch)
+                batch = []
+                if progress:
+                    progress(done, imported / max(time.time() - started, 1e-6))
+        if batch:
+            self.insert_batch(kind, batch, after_batch)
+            done += len(batch)
+            imported += len(batch)
+            if progress:
+                progress(done, imported / max(time.time() - started, 1e-6))
+        return done
+
+    def entity_row(self, kind, record):
+        row = {
+          'name': text(record, 'name', required=True),
+          'city': text(record, 'city', required=True).title(),
+          'state': text(record, 'state', required=True),
+          'genres': genre_names(record)
+        }
+        for column in ENTITY_COLUMNS['Venue' if kind == 'venues' else 'Artist'][1:]:
+            row[column] = flag(record, column) if column in ('seeking_talent', 'seeking_venue') else text(record, column)
+        return row
+
+    def show_row(self, kind, record):
+        start_time = timestamp(record, 'start_time')
+        if text(record, 'end_time'):
+            end_time = timestamp(record, 'end_time')
+        elif text(record, 'duration'):
+            end_time = start_time + timedelta(minutes=integer(record, 'duration'))
+        else:
+            end_time = start_time + self.show_duration
+        if end_time <= start_time:
+            raise RecordError('end_time before start_time')
+        return {
+          'artist_id': integer(record, 'artist_id'),
+          'venue_id': integer(record, 'venue_id'),
+          'start_time': start_time,
+          'end_time': end_time
+        }
+
+    def insert_batch(self, kind, rows, after_batch):
+        with self.db.engine.begin() as conn:
+            now = datetime.utcnow()
+            if kind == 'shows':
+                table = self.tables['Show']
+                ids = self.allocate_ids(conn, table, len(rows))
+                self.copy(conn, table, [dict(row, id=id, updated_at=now, version=1) for id, row in zip(ids, rows)])
+            else:
+                table = self.tables['Venue' if kind == 'venues' else 'Artist']
+                city_states = self.resolve_city_states(conn, rows)
+                genres = self.resolve_genres(conn, rows)
+                ids = self.allocate_ids(conn, table, len(rows))
+                entities = []
+                links = []
+                for id, row in zip(ids, rows):
+                    entity = {column: row[column] for column in ENTITY_COLUMNS[table.name]}
+                    entity.update(id=id, city_state_id=city_states[row['state']], created_at=datetime.now(),
+                        updated_at=now, version=1, upcoming_shows_count=0, past_shows_count=0)
+                    entities.append(entity)
+                    links.extend((id, genres[name]) for name in row['genres'])
+                self.copy(conn, table, entities)
+                link_table = self.tables['VenueGenre' if kind == 'venues' else 'ArtistGenre']
+                owner = 'venue_id' if kind == 'venues' else 'artist_id'
+                self.copy(conn, link_table, [{owner: id, 'genre_id': genre_id} for id, genre_id in links])
+        if after_batch:
+            after_batch(kind, ids, rows)
+
+    # Ids for n new rows: from the sequence on Postgres, after the current
+    # maximum elsewhere (SQLite test databases with a single writer)
+    def allocate_ids(self, conn, table, n):
+        if conn.dialect.name == 'postgresql':
+            sequence = '"{}_id_seq"'.format(table.name)
+            return [id for (id,) in conn.execute(
+                sa.text('SELECT nextval(:sequence) FROM generate_series(1, :n)'), {'sequence': sequence, 'n': n})]
+        start = conn.execute(sa.select(sa.func.coalesce(sa.func.max(table.c.id), 0))).scalar() + 1
+        return list(range(start, start + n))
+
+    # CityState rows are looked up by state like create_setup() in app.py; the
+    # missing ones are created with the first city seen for them
+    def resolve_city_states(self, conn, rows):
+        city_state = self.tables['CityState']
+        wanted = {}
+        for row in rows:
+            if row['state'] not in self.city_states:
+                wanted.setdefault(row['state'], row['city'])
+        if wanted:
+            self.city_states.update(conn.execute(
+                sa.select(city_state.c.state, city_state.c.id).where(city_state.c.state.in_(list(wanted)))).all())
+            missing = [{'city': city, 'state': state} for state, city in wanted.items() if state not in self.city_states]
+            if missing:
+                conn.execute(city_state.insert(), missing)
+                self.city_states.update(conn.execute(
+                    sa.select(city_state.c.state, city_state.c.id)
+                    .where(city_state.c.state.in_([row['state'] for row in missing]))).all())
+        return self.city_states
+
+    def resolve_genres(self, conn, rows):
+        genre = self.tables['Genre']
+        wanted = set(name for row in rows for name in row['genres'] if name not in self.genres)
+        if wanted:
+            self.genres.update(conn.execute(sa.select(genre.c.name, genre.c.id).where(genre.c.name.in_(wanted))).all())
+            missing = [{'name': name} for name in wanted if name not in self.genres]
+            if missing:
+                conn.execute(genre.insert(), missing)
+                self.genres.update(conn.execute(
+                    sa.select(genre.c.name, genre.c.id).where(genre.c.name.in_([row['name'] for row in missing]))).all())
+        return self.genres
+
+    def copy(self, conn, table, rows):
+        if not rows:
+            return
+        if conn.dialect.name != 'postgresql':
+            conn.execute(table.insert(), rows)
+            return
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(row[column]) for column in columns))
+            buffer.write('\n')
+        buffer.seek(0)
+        statement = 'COPY "{}" ({}) FROM STDIN'.format(table.name, ', '.join('"{}"'.format(c) for c in columns))
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        except conn.dialect.loaded_dbapi.Error as e:
+            # Raw DBAPI errors as SQLAlchemy's (IntegrityError, DataError, ...),
+            # the same as executemany raises elsewhere
+            raise sa.exc.DBAPIError.instance(statement, None, e, conn.dialect.loaded_dbapi.Error, dialect=conn.dialect) from e
+
+
+# COPY text format: tab separated, \N for NULL, backslash escapes
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+#----------------------------------------------------------------------------#
+# Checkpoints.
+#----------------------------------------------------------------------------#
+
+# A checkpoint records how many records of an input have been committed so an
+# interrupted import resumes after them. It is written after each batch commits;
+# a crash between the two repeats at most that one batch.
+class Checkpoint(object):
+    def __init__(self, path, kind, source):
+        self.path = path
+        self.kind = kind
+        self.source = os.path.abspath(source) if source != '-' else source
+
+    def load(self): # return number of committed records
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if state.get('kind') != self.kind or state.get('source') != self.source:
+            raise RecordError('checkpoint {} belongs to another import'.format(self.path))
+        return state.get('done', 0)
+
+    def save(self, done):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'kind': self.kind, 'source': self.source, 'done': done}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
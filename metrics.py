@@ -0,0 +1,224 @@
+import bisect
+import threading
+import time
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+#----------------------------------------------------------------------------#
+# Prometheus text format.
+#----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+def bound_text(bound):
+    return '+Inf' if bound is None else repr(float(bound))
+
+# Header of a metric family | return list of lines
+def family(name, type, help):
+    return ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, type)]
+
+# Samples of one histogram from per-bucket (not cumulative) counts, the last
+# count being the +Inf bucket | return list of lines
+def histogram_samples(name, buckets, counts, sum, labels=''):
+    base = labels[1:-1] + ',' if labels else ''
+    lines = []
+    total = 0
+    for bound, count in zip(tuple(buckets) + (None,), counts):
+        total += count
+        lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, base, bound_text(bound), total))
+    lines.append('{}_sum{} {}'.format(name, labels, repr(float(sum))))
+    lines.append('{}_count{} {}'.format(name, labels, total))
+    return lines
+
+
+class Counter(object):
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = family(self.name, 'counter', self.help)
+        lines.extend('{}{} {}'.format(self.name, label_text(self.labels, labels), value) for labels, value in values)
+        return lines
+
+
+class Histogram(object):
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self.lock:
+            series = sorted((labels, list(counts), sum) for labels, (counts, sum) in self.series.items())
+        lines = family(self.name, 'histogram', self.help)
+        for labels, counts, sum in series:
+            lines.extend(histogram_samples(self.name, self.buckets, counts, sum, label_text(self.labels, labels)))
+        return lines
+
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#----------------------------------------------------------------------------#
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+# Per request: SQL statements and the time spent in them (engine cursor
+# events), template rendering time (render signals; lazy loads from templates
+# count in both) and wall time, recorded per endpoint when the request ends,
+# after a streamed body too. The cost is a few perf_counter() calls and one
+# lock per histogram per request.
+#
+# Metrics live in the worker process; with several workers each one is a
+# scrape target, or its numbers only cover the requests it served.
+# collect(function) adds lines of other metrics (function() | yield str) to
+# render(); usable as a decorator.
+#
+# Query budgets: a request running more SQL statements than QUERY_BUDGETS
+# allows its endpoint (QUERY_BUDGET_DEFAULT otherwise) is logged when it ends
+# (QUERY_BUDGET_MODE = 'log'), or fails on the first statement over budget
+# ('raise'), so the traceback points at the loop doing it. A view catching
+# every exception would still answer normally; its response is failed again.
+class RequestMetrics(object):
+    def __init__(self, app=None, db=None, prefix='fyyur'):
+        self.prefix = prefix
+        self.collectors = []
+        self.requests = Counter(prefix + '_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+        self.duration = Histogram(prefix + '_request_duration_seconds', 'Wall time of a request.',
+            LATENCY_BUCKETS, ('endpoint',))
+        self.db_time = Histogram(prefix + '_request_db_seconds', 'Time a request spent in SQL statements.',
+            LATENCY_BUCKETS, ('endpoint',))
+        self.render_time = Histogram(prefix + '_request_render_seconds', 'Time a request spent rendering templates.',
+            LATENCY_BUCKETS, ('endpoint',))
+        self.queries = Histogram(prefix + '_request_queries', 'SQL statements run by a request.',
+            QUERY_BUCKETS, ('endpoint',))
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        app.extensions['metrics'] = self
+        self.budgets = app.config.get('QUERY_BUDGETS', {})
+        self.default_budget = app.config.get('QUERY_BUDGET_DEFAULT')
+        self.budget_mode = app.config.get('QUERY_BUDGET_MODE')
+        app.before_request(self.begin)
+        app.after_request(self.record_status)
+        app.teardown_request(self.end)
+        before_render_template.connect(self.render_started, app)
+        template_rendered.connect(self.render_finished, app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self.query_started)
+            event.listen(db.engine, 'after_cursor_execute', self.query_finished)
+
+    def collect(self, function):
+        self.collectors.append(function)
+        return function
+
+    # The counters of the request being served, None outside of one
+    # | return dict(queries, db_time, render_time, started, status)
+    def current(self):
+        if not has_request_context():
+            return None
+        return g.get('request_metrics')
+
+    def begin(self):
+        g.request_metrics = {'queries': 0, 'db_time': 0.0, 'render_time': 0.0,
+                             'started': time.perf_counter(), 'status': None}
+
+    def record_status(self, response):
+        current = self.current()
+        if current is not None:
+            if current.get('over_budget') and self.budget_mode == 'raise':
+                raise QueryBudgetExceeded('{} ran {} queries, budget {}'.format(
+                    request.endpoint, current['queries'], self.budget(request.endpoint)))
+            current['status'] = response.status_code
+        return response
+
+    def end(self, exc=None):
+        current = self.current()
+        if current is None:
+            return
+        g.pop('request_metrics')
+        endpoint = request.endpoint or 'unmatched'
+        status = current['status'] or 500
+        self.requests.inc((endpoint, request.method, str(status)))
+        self.duration.observe((endpoint,), time.perf_counter() - current['started'])
+        self.db_time.observe((endpoint,), current['db_time'])
+        self.render_time.observe((endpoint,), current['render_time'])
+        self.queries.observe((endpoint,), current['queries'])
+        if current.get('over_budget') and self.budget_mode == 'log':
+            self.app.logger.warning('Query budget exceeded: {} {} ran {} queries, budget {}'.format(
+                request.method, request.full_path.rstrip('?'), current['queries'], self.budget(request.endpoint)))
+
+    def query_started(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    def query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        current = self.current()
+        if current is None or context is None:
+            return
+        current['queries'] += 1
+        current['db_time'] += time.perf_counter() - getattr(context, '_metrics_started', time.perf_counter())
+        if self.budget_mode and not current.get('over_budget'):
+            budget = self.budget(request.endpoint)
+            if budget is not None and current['queries'] > budget:
+                current['over_budget'] = True
+                if self.budget_mode == 'raise':
+                    raise QueryBudgetExceeded('{} ran more than {} queries'.format(request.endpoint, budget))
+
+    def budget(self, endpoint): # return int or None
+        return self.budgets.get(endpoint, self.default_budget)
+
+    def render_started(self, sender, template, context, **extra):
+        current = self.current()
+        if current is not None:
+            current['render_started'] = time.perf_counter()
+
+    def render_finished(self, sender, template, context, **extra):
+        current = self.current()
+        if current is not None and 'render_started' in current:
+            current['render_time'] += time.perf_counter() - current.pop('render_started')
+
+    # Everything in the Prometheus text exposition format | return str
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.duration, self.db_time, self.render_time, self.queries):
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
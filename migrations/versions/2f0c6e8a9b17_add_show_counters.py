@@ -0,0 +1,47 @@
+"""add upcoming/past show counters to Artist and Venue
+
+Revision ID: 2f0c6e8a9b17
+Revises: b71d4e93c0a8
+Create Date: 2026-10-18 18:40:27.615530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f0c6e8a9b17'
+down_revision = 'b71d4e93c0a8'
+branch_labels = None
+depends_on = None
+
+show = sa.table('Show',
+    sa.column('id', sa.Integer),
+    sa.column('artist_id', sa.Integer),
+    sa.column('venue_id', sa.Integer),
+    sa.column('start_time', sa.DateTime))
+
+
+def upgrade():
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    for table in ('Artist', 'Venue'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Initial counts, same statement as refresh_show_counters() in app.py
+    for table, owner_column in (('Artist', show.c.artist_id), ('Venue', show.c.venue_id)):
+        owner = sa.table(table,
+            sa.column('id', sa.Integer),
+            sa.column('upcoming_shows_count', sa.Integer),
+            sa.column('past_shows_count', sa.Integer))
+        counts = sa.select(sa.func.count(show.c.id)).where(owner_column == owner.c.id)
+        op.execute(owner.update().values(
+            upcoming_shows_count=counts.where(show.c.start_time >= sa.func.now()).scalar_subquery(),
+            past_shows_count=counts.where(show.c.start_time < sa.func.now()).scalar_subquery()))
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
@@ -0,0 +1,134 @@
+"""normalize genres into Genre, VenueGenre and ArtistGenre tables
+
+Revision ID: 4c6161adbc6f
+Revises: 98d650b1f984
+Create Date: 2026-10-18 09:12:31.502114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c6161adbc6f'
+down_revision = '98d650b1f984'
+branch_labels = None
+depends_on = None
+
+# Rows read from Venue/Artist per backfill round trip
+BATCH_SIZE = 1000
+
+genre = sa.table('Genre',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String))
+
+
+def owner_tables(owner):
+    owner_table = sa.table(owner,
+        sa.column('id', sa.Integer),
+        sa.column('genres', sa.String))
+    link_table = sa.table(owner + 'Genre',
+        sa.column(owner.lower() + '_id', sa.Integer),
+        sa.column('genre_id', sa.Integer))
+    return owner_table, link_table
+
+
+def iter_batches(conn, query, id_column):
+    # Keyset over the primary key so every batch is an index range scan
+    last_id = 0
+    while True:
+        rows = conn.execute(query.where(id_column > last_id).order_by(id_column).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def backfill(conn, owner, genre_ids):
+    owner_table, link_table = owner_tables(owner)
+    owner_key = owner.lower() + '_id'
+    query = sa.select(owner_table.c.id, owner_table.c.genres)
+    for rows in iter_batches(conn, query, owner_table.c.id):
+        links = []
+        for owner_id, genres in rows:
+            names = dict.fromkeys(g.strip() for g in (genres or '').split(',') if g.strip())
+            missing = [name for name in names if name not in genre_ids]
+            if missing:
+                conn.execute(genre.insert(), [{'name': name} for name in missing])
+                genre_ids.update(conn.execute(
+                    sa.select(genre.c.name, genre.c.id).where(genre.c.name.in_(missing))).fetchall())
+            links.extend({owner_key: owner_id, 'genre_id': genre_ids[name]} for name in names)
+        if links:
+            conn.execute(link_table.insert(), links)
+
+
+def restore(conn, owner):
+    owner_table, link_table = owner_tables(owner)
+    owner_key = getattr(link_table.c, owner.lower() + '_id')
+    query = sa.select(owner_table.c.id)
+    for rows in iter_batches(conn, query, owner_table.c.id):
+        ids = [row[0] for row in rows]
+        genres = dict.fromkeys(ids, '')
+        links = conn.execute(
+            sa.select(owner_key, genre.c.name)
+            .select_from(link_table.join(genre, genre.c.id == link_table.c.genre_id))
+            .where(owner_key.in_(ids))
+            .order_by(owner_key, genre.c.name)).fetchall()
+        for owner_id, name in links:
+            genres[owner_id] += '{},'.format(name)
+        conn.execute(
+            owner_table.update().where(owner_table.c.id == sa.bindparam('owner_id')),
+            [{'owner_id': owner_id, 'genres': value} for owner_id, value in genres.items()])
+
+
+def upgrade():
+    op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('VenueGenre',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_VenueGenre_genre_id', 'VenueGenre', ['genre_id'], unique=False)
+    op.create_table('ArtistGenre',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_ArtistGenre_genre_id', 'ArtistGenre', ['genre_id'], unique=False)
+
+    conn = op.get_bind()
+    op.bulk_insert(genre, [{'name': name} for name in (
+        'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+        'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+        'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+        'Soul', 'Other')])
+    genre_ids = dict(conn.execute(sa.select(genre.c.name, genre.c.id)).fetchall())
+    backfill(conn, 'Venue', genre_ids)
+    backfill(conn, 'Artist', genre_ids)
+
+    op.drop_column('Venue', 'genres')
+    op.drop_column('Artist', 'genres')
+
+
+def downgrade():
+    op.add_column('Artist', sa.Column('genres', sa.String(length=120), nullable=True))
+    op.add_column('Venue', sa.Column('genres', sa.String(), nullable=True))
+
+    conn = op.get_bind()
+    restore(conn, 'Venue')
+    restore(conn, 'Artist')
+
+    op.drop_index('ix_ArtistGenre_genre_id', table_name='ArtistGenre')
+    op.drop_table('ArtistGenre')
+    op.drop_index('ix_VenueGenre_genre_id', table_name='VenueGenre')
+    op.drop_table('VenueGenre')
+    op.drop_table('Genre')
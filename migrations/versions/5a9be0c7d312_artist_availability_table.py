@@ -0,0 +1,92 @@
+"""move Artist.available_time into the ArtistAvailability table
+
+Revision ID: 5a9be0c7d312
+Revises: e83a0d5f21c4
+Create Date: 2026-10-18 14:03:52.771940
+
+"""
+from datetime import timedelta
+
+from alembic import op
+import dateutil.parser
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9be0c7d312'
+down_revision = 'e83a0d5f21c4'
+branch_labels = None
+depends_on = None
+
+# Rows read from Artist per conversion round trip
+BATCH_SIZE = 1000
+# The old strings held single start times; each becomes a slot long enough for
+# a show of the default length (SHOW_DURATION_MINUTES in config.py)
+SLOT = timedelta(minutes=120)
+
+artist = sa.table('Artist',
+    sa.column('id', sa.Integer),
+    sa.column('available_time', sa.String))
+
+availability = sa.table('ArtistAvailability',
+    sa.column('artist_id', sa.Integer),
+    sa.column('start_time', sa.DateTime),
+    sa.column('end_time', sa.DateTime))
+
+
+def iter_artist_batches(conn, *columns):
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select(artist.c.id, *columns)
+            .where(artist.c.id > last_id).order_by(artist.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.create_table('ArtistAvailability',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ArtistAvailability_artist_id_range', 'ArtistAvailability', ['artist_id', 'start_time', 'end_time'], unique=False)
+
+    conn = op.get_bind()
+    for rows in iter_artist_batches(conn, artist.c.available_time):
+        slots = []
+        for artist_id, available_time in rows:
+            for item in (available_time or '').split(','):
+                try:
+                    start = dateutil.parser.parse(item)
+                except (ValueError, OverflowError):
+                    continue
+                slots.append({'artist_id': artist_id, 'start_time': start, 'end_time': start + SLOT})
+        if slots:
+            conn.execute(availability.insert(), slots)
+
+    op.drop_column('Artist', 'available_time')
+
+
+def downgrade():
+    op.add_column('Artist', sa.Column('available_time', sa.String(), nullable=True))
+
+    conn = op.get_bind()
+    for rows in iter_artist_batches(conn):
+        ids = [row[0] for row in rows]
+        times = dict((artist_id, []) for artist_id in ids)
+        for artist_id, start in conn.execute(
+                sa.select(availability.c.artist_id, availability.c.start_time)
+                .where(availability.c.artist_id.in_(ids))
+                .order_by(availability.c.artist_id, availability.c.start_time)):
+            times[artist_id].append(start.strftime('%Y-%m-%d %H:%M:%S'))
+        values = [{'artist_id': artist_id, 'available_time': ','.join(value)} for artist_id, value in times.items() if value]
+        if values:
+            conn.execute(artist.update().where(artist.c.id == sa.bindparam('artist_id')), values)
+
+    op.drop_index('ix_ArtistAvailability_artist_id_range', table_name='ArtistAvailability')
+    op.drop_table('ArtistAvailability')
@@ -0,0 +1,34 @@
+"""add updated_at and version to Venue, Artist and Show
+
+Revision ID: 6d1e3f7a2c95
+Revises: 2f0c6e8a9b17
+Create Date: 2026-10-18 19:52:08.204113
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d1e3f7a2c95'
+down_revision = '2f0c6e8a9b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = datetime.utcnow()
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        rows = sa.table(table, sa.column('updated_at', sa.DateTime))
+        op.execute(rows.update().values(updated_at=now))
+        op.alter_column(table, 'updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_column(table, 'version')
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,81 @@
+"""add Show.end_time and the venue double-booking exclusion constraint
+
+Revision ID: b71d4e93c0a8
+Revises: 5a9be0c7d312
+Create Date: 2026-10-18 16:25:14.090327
+
+"""
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d4e93c0a8'
+down_revision = '5a9be0c7d312'
+branch_labels = None
+depends_on = None
+
+# Existing shows get the default ShowForm duration
+DURATION = timedelta(minutes=120)
+BATCH_SIZE = 1000
+
+show = sa.table('Show',
+    sa.column('id', sa.Integer),
+    sa.column('venue_id', sa.Integer),
+    sa.column('start_time', sa.DateTime),
+    sa.column('end_time', sa.DateTime))
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+
+    # Shows that were booked on top of each other are cut short at the start of
+    # the next show of their venue, so the constraint below can be created
+    conn = op.get_bind()
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.select(show.c.id, show.c.venue_id, show.c.start_time)
+        .where(show.c.start_time.isnot(None))
+        .order_by(show.c.venue_id, show.c.start_time, show.c.id))
+    updates = []
+    previous = None
+    for row in rows:
+        if previous is not None:
+            updates.append(end_of(previous, row))
+        previous = row
+        if len(updates) >= BATCH_SIZE:
+            write_end_times(updates)
+            updates = []
+    if previous is not None:
+        updates.append(end_of(previous, None))
+    write_end_times(updates)
+
+    if conn.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute(
+            'ALTER TABLE "Show" ADD CONSTRAINT "Show_venue_id_tsrange_excl" '
+            'EXCLUDE USING gist (venue_id WITH =, tsrange(start_time, end_time) WITH &&) '
+            'WHERE (start_time IS NOT NULL AND end_time IS NOT NULL)')
+
+
+def end_of(row, following):
+    end_time = row.start_time + DURATION
+    if following is not None and following.venue_id == row.venue_id:
+        end_time = min(end_time, following.start_time)
+    return {'show_id': row.id, 'end_time': end_time}
+
+
+def write_end_times(updates):
+    if updates:
+        op.get_bind().execute(
+            show.update().where(show.c.id == sa.bindparam('show_id')).values(end_time=sa.bindparam('end_time')),
+            updates)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE "Show" DROP CONSTRAINT "Show_venue_id_tsrange_excl"')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.drop_column('Show', 'end_time')
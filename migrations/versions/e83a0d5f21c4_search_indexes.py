@@ -0,0 +1,42 @@
+"""add full-text and trigram search indexes
+
+Revision ID: e83a0d5f21c4
+Revises: 4c6161adbc6f
+Create Date: 2026-10-18 11:47:05.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83a0d5f21c4'
+down_revision = '4c6161adbc6f'
+branch_labels = None
+depends_on = None
+
+# (table, column) pairs served by PostgresSearchBackend in search.py. The
+# SQLite backend builds its FTS5 tables at runtime instead.
+indexed = (('Artist', 'name'), ('Venue', 'name'), ('CityState', 'city'))
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in indexed:
+        op.create_index('ix_{}_{}_tsv'.format(table, column), table,
+            [sa.text("to_tsvector('simple', {})".format(column))],
+            postgresql_using='gin')
+        op.create_index('ix_{}_{}_trgm'.format(table, column), table,
+            [column],
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, column in indexed:
+        op.drop_index('ix_{}_{}_trgm'.format(table, column), table_name=table)
+        op.drop_index('ix_{}_{}_tsv'.format(table, column), table_name=table)
@@ -0,0 +1,134 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import NullPool, QueuePool
+
+#----------------------------------------------------------------------------#
+# Statistics.
+#----------------------------------------------------------------------------#
+
+# Upper bounds (seconds) of the checkout wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Counters of one process' connection pool: checkouts and the time each one
+# waited for a connection (a new connection's connect time included),
+# connections opened, invalidated and timed out, and how often a checkout had
+# to go past pool_size into the overflow.
+class PoolStats(object):
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.pool = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.overflows = 0
+            self.wait_counts = [0] * (len(self.buckets) + 1)
+            self.wait_sum = 0.0
+            self.wait_max = 0.0
+
+    def checked_out(self, wait, overflowed):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_counts[bisect.bisect_left(self.buckets, wait)] += 1
+            self.wait_sum += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflowed:
+                self.overflows += 1
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # Counters and the current state of the pool | return dict
+    def snapshot(self):
+        with self.lock:
+            data = {
+              'checkouts': self.checkouts,
+              'checkins': self.checkins,
+              'connects': self.connects,
+              'invalidations': self.invalidations,
+              'timeouts': self.timeouts,
+              'overflows': self.overflows,
+              'wait': {
+                'buckets': [[bound, count] for bound, count in zip(self.buckets + (None,), self.wait_counts)],
+                'sum': self.wait_sum,
+                'max': self.wait_max
+              }
+            }
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            data['pool'] = {
+              'size': pool.size(),
+              'checked_in': pool.checkedin(),
+              'checked_out': pool.checkedout(),
+              'overflow': max(pool.overflow(), 0),
+              'max_overflow': pool._max_overflow,
+              'timeout': pool.timeout()
+            }
+        return data
+
+
+# Subclass of a pool class that times _do_get(), where a checkout waits for a
+# free connection (or opens one) | return class
+def timed_pool(base, stats):
+    class TimedPool(base):
+        def __init__(self, *args, **kwargs):
+            super(TimedPool, self).__init__(*args, **kwargs)
+            stats.pool = self
+
+        def _do_get(self):
+            overflow = self.overflow() if isinstance(self, QueuePool) else 0
+            started = time.perf_counter()
+            try:
+                connection = super(TimedPool, self)._do_get()
+            except PoolTimeout:
+                stats.count('timeouts')
+                raise
+            overflowed = isinstance(self, QueuePool) and self.overflow() > max(overflow, 0)
+            stats.checked_out(time.perf_counter() - started, overflowed)
+            return connection
+
+    TimedPool.__name__ = TimedPool.__qualname__ = 'Timed' + base.__name__
+    event.listen(TimedPool, 'checkin', lambda *args: stats.count('checkins'))
+    event.listen(TimedPool, 'connect', lambda *args: stats.count('connects'))
+    event.listen(TimedPool, 'invalidate', lambda *args: stats.count('invalidations'))
+    return TimedPool
+
+
+#----------------------------------------------------------------------------#
+# Engine options.
+#----------------------------------------------------------------------------#
+
+# SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings | return dict
+# With DB_PGBOUNCER the app keeps no connections of its own (NullPool) and
+# PgBouncer in transaction mode does the pooling; pre-ping still guards
+# against connections PgBouncer dropped. In-memory SQLite keeps the
+# single-connection pool Flask-SQLAlchemy gives it.
+def engine_options(config, stats=None):
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+        return options
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    if config['DB_PGBOUNCER']:
+        base = NullPool
+    else:
+        base = QueuePool
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_use_lifo', True)
+    if config['DB_POOL_RECYCLE'] is not None:
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('poolclass', timed_pool(base, stats) if stats is not None else base)
+    return options
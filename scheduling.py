@@ -0,0 +1,196 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+
+#----------------------------------------------------------------------------#
+# Interval index.
+#----------------------------------------------------------------------------#
+
+# Half-open [start, end) intervals sorted by start. Any interval overlapping
+# [start, end) starts after start - longest, so an overlap probe is a binary
+# search plus a scan of the few intervals in that window, O(log n + k).
+class IntervalIndex(object):
+    def __init__(self, intervals=()):
+        self.intervals = sorted((start, end) for start, end in intervals if start < end)
+        self.longest = max((end - start for start, end in self.intervals), default=None)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start, end):
+        if not start < end:
+            return
+        insort(self.intervals, (start, end))
+        if self.longest is None or end - start > self.longest:
+            self.longest = end - start
+
+    # longest is left as it is: an upper bound still finds every overlap
+    def remove(self, start, end):
+        index = bisect_left(self.intervals, (start, end))
+        if index < len(self.intervals) and self.intervals[index] == (start, end):
+            del self.intervals[index]
+
+    def overlapping(self, start, end): # return list of (start, end)
+        if self.longest is None:
+            return []
+        lo = bisect_right(self.intervals, (start - self.longest,))
+        hi = bisect_left(self.intervals, (end,))
+        return [(s, e) for s, e in self.intervals[lo:hi] if e > start]
+
+    def overlaps(self, start, end):
+        return bool(self.overlapping(start, end))
+
+
+#----------------------------------------------------------------------------#
+# Venue bookings.
+#----------------------------------------------------------------------------#
+
+# In-process double-booking guard for databases without exclusion constraints
+# (SQLite test runs). The interval index of a venue is loaded once through
+# load(venue_id) -> iterable of (start, end) and kept current by reserve().
+# It only sees this worker's bookings and those announced to it (app.py forgets
+# a venue on other workers' 'booked' events); the real guard is the exclusion
+# constraint of Postgres, where app.py does not use this class at all.
+# At most max_venues indexes are kept, least recently used out first.
+class VenueBookings(object):
+    def __init__(self, load, max_venues=1024):
+        self.load = load
+        self.max_venues = max_venues
+        self.lock = threading.Lock()
+        self.venues = OrderedDict()
+
+    # with bookings.reserve(venue_id, start, end) as free:
+    #     if free: insert and commit the show
+    # The check records the interval under the venue's own lock, which is let
+    # go before the block runs; other venues never wait for it, and a booking
+    # of the same venue racing this one sees the interval taken. It is dropped
+    # again when the block raises.
+    @contextmanager
+    def reserve(self, venue_id, start, end):
+        venue = self.acquire(venue_id)
+        try:
+            with venue.lock:
+                if venue.index is None:
+                    venue.index = IntervalIndex(self.load(venue_id))
+                free = not venue.index.overlaps(start, end)
+                if free:
+                    venue.index.add(start, end)
+            try:
+                yield free
+            except BaseException:
+                if free:
+                    with venue.lock:
+                        venue.index.remove(start, end)
+                raise
+        finally:
+            with self.lock:
+                venue.pending -= 1
+
+    # Venue in use by a reservation, not evicted until released | return VenueIndex
+    def acquire(self, venue_id):
+        with self.lock:
+            venue = self.venues.get(venue_id)
+            if venue is None:
+                venue = self.venues[venue_id] = VenueIndex()
+            self.venues.move_to_end(venue_id)
+            venue.pending += 1
+            while len(self.venues) > self.max_venues:
+                idle = next((id for id, other in self.venues.items() if not other.pending), None)
+                if idle is None:
+                    break
+                del self.venues[idle]
+            return venue
+
+    def forget(self, venue_id):
+        with self.lock:
+            self.venues.pop(venue_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.venues.clear()
+
+
+class VenueIndex(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.pending = 0
+
+
+#----------------------------------------------------------------------------#
+# Free slot finder.
+#----------------------------------------------------------------------------#
+
+# Union of [start, end) intervals | return sorted, non-overlapping list
+def merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+# Parts of the sorted, non-overlapping free intervals not covered by busy
+def subtract(free, busy):
+    busy = merge(busy)
+    result = []
+    i = 0
+    for start, end in free:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > start:
+                result.append((start, busy[j][0]))
+            start = max(start, busy[j][1])
+            j += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+# Sweep line over the sorted interval lists of every participant: the depth
+# counts how many participants are free, and the windows where all of them are
+# free are emitted. Ends sort before starts at the same instant (half-open).
+def intersect_all(lists):
+    if not lists:
+        return []
+    events = []
+    for intervals in lists:
+        for start, end in intervals:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort(key=lambda event: (event[0], event[1]))
+    result = []
+    depth = 0
+    opened = None
+    for time, delta in events:
+        depth += delta
+        if depth == len(lists) and delta == 1:
+            opened = time
+        elif opened is not None and depth < len(lists):
+            if time > opened:
+                result.append((opened, time))
+            opened = None
+    return result
+
+# Windows inside horizon = (start, end) where every participant is free and
+# that last at least min_length. A participant is a pair (available, busy):
+# available is None when it has no availability restriction, otherwise the
+# ranges it may be booked in; busy are the ranges it is already booked.
+def common_free_slots(horizon, participants, min_length=None):
+    lists = []
+    for available, busy in participants:
+        if available is None:
+            free = [horizon]
+        else:
+            free = intersect_all([[horizon], merge(available)])
+        lists.append(subtract(free, busy))
+    slots = intersect_all(lists) if lists else [horizon]
+    if min_length:
+        slots = [(start, end) for start, end in slots if end - start >= min_length]
+    return slots
@@ -0,0 +1,364 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+import sqlalchemy as sa
+
+#----------------------------------------------------------------------------#
+# Search backends.
+#----------------------------------------------------------------------------#
+
+# Every backend answers the same four searches used by the search routes:
+#   'artists'         -> artists by name
+#   'venues'          -> venues by name or genre
+#   'artists_by_city' -> artists located in a matching city
+#   'venues_by_city'  -> venues located in a matching city
+# and returns a list of (id, name) rows, best match first.
+# Backends work on the Core tables of db.metadata so they do not import app.py.
+# The SQL backends provide matches(table, column, term): a select of (id, rank)
+# for the rows of table whose column matches term, a higher rank being a better
+# match. The memory backend answers search() itself.
+class SearchBackend(object):
+    name = None
+
+    def __init__(self, db):
+        self.db = db
+        tables = db.metadata.tables
+        self.artist = tables['Artist']
+        self.venue = tables['Venue']
+        self.city_state = tables['CityState']
+        self.genre = tables['Genre']
+        self.venue_genre = tables['VenueGenre']
+
+    # Called once before the first search; creates what the backend needs at runtime
+    def setup(self):
+        pass
+
+    # Called by the write handlers after commit; only in-process backends need them
+    def update(self, table, id):
+        pass
+
+    def remove(self, table, id):
+        pass
+
+    def all_rows(self, table):
+        return sa.select(table.c.id, sa.literal(0.0).label('rank'))
+
+    def search(self, kind, term):
+        term = (term or '').strip()
+        if kind == 'artists':
+            entity, hits = self.artist, self.match_names(self.artist, term)
+        elif kind == 'venues':
+            entity, hits = self.venue, self.match_venues(term)
+        elif kind in ('artists_by_city', 'venues_by_city'):
+            entity = self.artist if kind == 'artists_by_city' else self.venue
+            hits = self.match_cities(entity, term)
+        else:
+            raise ValueError('Unknown search: {}'.format(kind))
+
+        hits = hits.subquery()
+        query = sa.select(entity.c.id, entity.c.name)\
+            .join(hits, hits.c.id == entity.c.id)\
+            .order_by(hits.c.rank.desc(), entity.c.name, entity.c.id)
+        return self.db.session.execute(query).all()
+
+    def match_names(self, table, term):
+        return self.matches(table, table.c.name, term) if term else self.all_rows(table)
+
+    def match_venues(self, term):
+        if not term:
+            return self.all_rows(self.venue)
+        # Genre matches rank below every name match; like names, any part of a
+        # genre matches (the Genre table is small enough to scan)
+        genre_ids = sa.select(self.genre.c.id).where(self.genre.c.name.ilike('%' + like_escape(term) + '%', escape='\\'))
+        by_genre = sa.select(self.venue_genre.c.venue_id.label('id'), sa.literal(-1.0).label('rank'))\
+            .where(self.venue_genre.c.genre_id.in_(genre_ids))
+        hits = sa.union_all(self.matches(self.venue, self.venue.c.name, term), by_genre).subquery()
+        return sa.select(hits.c.id, sa.func.max(hits.c.rank).label('rank')).group_by(hits.c.id)
+
+    def match_cities(self, entity, term):
+        if not term:
+            return self.all_rows(entity)
+        cities = self.matches(self.city_state, self.city_state.c.city, term).subquery()
+        return sa.select(entity.c.id, cities.c.rank)\
+            .join(cities, cities.c.id == entity.c.city_state_id)
+
+
+# Postgres: GIN indexes on to_tsvector('simple', column) and on
+# column gin_trgm_ops (see the search_indexes migration). Word prefixes hit the
+# tsvector index, arbitrary substrings hit the trigram index.
+class PostgresSearchBackend(SearchBackend):
+    name = 'postgresql'
+
+    def matches(self, table, column, term):
+        document = sa.func.to_tsvector('simple', column)
+        words = re.findall(r'\w+', term)
+        substring = column.ilike('%' + like_escape(term) + '%', escape='\\')
+        if not words:
+            return sa.select(table.c.id, sa.func.similarity(column, term).label('rank')).where(substring)
+        query = sa.func.to_tsquery('simple', ' & '.join('{}:*'.format(word) for word in words))
+        rank = sa.func.ts_rank(document, query) + sa.func.similarity(column, term)
+        return sa.select(table.c.id, rank.label('rank'))\
+            .where(sa.or_(document.op('@@')(query), substring))
+
+
+# SQLite: external-content FTS5 tables kept in sync by triggers. The trigram
+# tokenizer gives ILIKE-style substring matching; older SQLite builds fall back
+# to unicode61 word-prefix matching.
+class SQLiteSearchBackend(SearchBackend):
+    name = 'sqlite'
+    indexed = (('Artist', 'name'), ('Venue', 'name'), ('CityState', 'city'))
+
+    def setup(self):
+        with self.db.engine.begin() as conn:
+            self.tokenizer = 'trigram' if conn.dialect.dbapi.sqlite_version_info >= (3, 34) else 'unicode61'
+            for table, column in self.indexed:
+                fts = '{}_fts'.format(table)
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).scalar()
+                if exists:
+                    continue
+                conn.exec_driver_sql(
+                    'CREATE VIRTUAL TABLE "{fts}" USING fts5({column}, content=\'{table}\', '
+                    'content_rowid=\'id\', tokenize=\'{tokenizer}\')'.format(
+                        fts=fts, table=table, column=column, tokenizer=self.tokenizer))
+                conn.exec_driver_sql(
+                    'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+                    'INSERT INTO "{fts}"(rowid, {column}) VALUES (new.id, new.{column}); END'.format(
+                        fts=fts, table=table, column=column))
+                conn.exec_driver_sql(
+                    'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+                    'INSERT INTO "{fts}"("{fts}", rowid, {column}) VALUES (\'delete\', old.id, old.{column}); END'.format(
+                        fts=fts, table=table, column=column))
+                conn.exec_driver_sql(
+                    'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{table}" BEGIN '
+                    'INSERT INTO "{fts}"("{fts}", rowid, {column}) VALUES (\'delete\', old.id, old.{column}); '
+                    'INSERT INTO "{fts}"(rowid, {column}) VALUES (new.id, new.{column}); END'.format(
+                        fts=fts, table=table, column=column))
+                conn.exec_driver_sql('INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')'.format(fts=fts))
+
+    def matches(self, table, column, term):
+        fts = sa.table('{}_fts'.format(table.name), sa.column('rowid'), sa.column('rank'), sa.column(column.name))
+        fts_name = sa.literal_column('"{}"'.format(fts.name))
+        if self.tokenizer == 'trigram':
+            if len(term) < 3:
+                # Trigram MATCH needs three characters; LIKE still uses the FTS index
+                return sa.select(fts.c.rowid.label('id'), sa.literal(0.0).label('rank'))\
+                    .where(fts.c[column.name].like('%' + like_escape(term) + '%', escape='\\'))
+            expression = '"{}"'.format(term.replace('"', '""'))
+        else:
+            words = re.findall(r'\w+', term)
+            if not words:
+                return sa.select(fts.c.rowid.label('id'), sa.literal(0.0).label('rank')).where(sa.false())
+            expression = ' '.join('"{}"*'.format(word) for word in words)
+        # bm25 rank is lower for better matches
+        return sa.select(fts.c.rowid.label('id'), (-fts.c.rank).label('rank'))\
+            .where(fts_name.op('MATCH')(expression))
+
+
+#----------------------------------------------------------------------------#
+# In-process trigram index.
+#----------------------------------------------------------------------------#
+
+Hit = namedtuple('Hit', 'id name')
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# Case-insensitive substring index. Every trigram maps to a sorted array of
+# unsigned ints (4 bytes per posting); candidates from the rarest trigram of the
+# term are confirmed against the stored text, so results match ILIKE '%term%'.
+class TrigramIndex(object):
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+
+    def build(self, items): # items: iterable of (id, text)
+        grams = defaultdict(list)
+        for id, text in items:
+            text = (text or '').lower()
+            self.texts[id] = text
+            for gram in trigrams(text):
+                grams[gram].append(id)
+        self.postings = {gram: array('I', sorted(ids)) for gram, ids in grams.items()}
+
+    def add(self, id, text):
+        self.remove(id)
+        text = (text or '').lower()
+        self.texts[id] = text
+        for gram in trigrams(text):
+            insort(self.postings.setdefault(gram, array('I')), id)
+
+    def remove(self, id):
+        text = self.texts.pop(id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            postings = self.postings[gram]
+            del postings[bisect_left(postings, id)]
+            if not postings:
+                del self.postings[gram]
+
+    def search(self, term): # return list of ids whose text contains term
+        term = term.lower()
+        grams = trigrams(term)
+        if not grams:
+            return [id for id, text in self.texts.items() if term in text]
+        # Every match is in the shortest postings array; checking those few
+        # candidates directly is cheaper than intersecting the longer arrays
+        candidates = min((self.postings.get(gram, ()) for gram in grams), key=len)
+        return [id for id in candidates if term in self.texts[id]]
+
+
+# Serves every search from memory. Built from the database on first use and
+# kept current by update()/remove() from the write handlers in app.py.
+class MemorySearchBackend(SearchBackend):
+    name = 'memory'
+
+    def setup(self):
+        self.lock = threading.Lock()
+        self.names = {'Artist': TrigramIndex(), 'Venue': TrigramIndex()}
+        self.display = {'Artist': {}, 'Venue': {}}
+        self.cities = TrigramIndex()
+        self.city_of = {'Artist': {}, 'Venue': {}}
+        self.by_city = {'Artist': defaultdict(set), 'Venue': defaultdict(set)}
+        self.genres = {}
+        self.genres_of = {}
+        self.by_genre = defaultdict(set)
+
+        with self.db.engine.connect() as conn:
+            self.cities.build(conn.execute(sa.select(self.city_state.c.id, self.city_state.c.city)))
+            self.genres = dict(conn.execute(sa.select(self.genre.c.id, sa.func.lower(self.genre.c.name))).all())
+            for table in (self.artist, self.venue):
+                rows = conn.execute(sa.select(table.c.id, table.c.name, table.c.city_state_id)).all()
+                self.names[table.name].build((id, name) for id, name, _ in rows)
+                for id, name, city_state_id in rows:
+                    self.display[table.name][id] = name
+                    self.city_of[table.name][id] = city_state_id
+                    self.by_city[table.name][city_state_id].add(id)
+            for venue_id, genre_id in conn.execute(sa.select(self.venue_genre.c.venue_id, self.venue_genre.c.genre_id)):
+                self.genres_of.setdefault(venue_id, set()).add(genre_id)
+                self.by_genre[genre_id].add(venue_id)
+
+    def update(self, table, id):
+        entity = self.artist if table == 'Artist' else self.venue
+        with self.db.engine.connect() as conn:
+            row = conn.execute(sa.select(entity.c.name, entity.c.city_state_id, self.city_state.c.city)
+                .join(self.city_state, self.city_state.c.id == entity.c.city_state_id)
+                .where(entity.c.id == id)).first()
+            genres = []
+            if row is not None and table == 'Venue':
+                genres = conn.execute(sa.select(self.genre.c.id, sa.func.lower(self.genre.c.name))
+                    .join(self.venue_genre, self.venue_genre.c.genre_id == self.genre.c.id)
+                    .where(self.venue_genre.c.venue_id == id)).all()
+        if row is None:
+            return self.remove(table, id)
+        name, city_state_id, city = row
+        with self.lock:
+            self.remove_locked(table, id)
+            self.names[table].add(id, name)
+            self.display[table][id] = name
+            self.city_of[table][id] = city_state_id
+            self.by_city[table][city_state_id].add(id)
+            if city_state_id not in self.cities.texts:
+                self.cities.add(city_state_id, city)
+            if genres:
+                self.genres.update(genres)
+                self.genres_of[id] = set(genre_id for genre_id, _ in genres)
+                for genre_id, _ in genres:
+                    self.by_genre[genre_id].add(id)
+
+    def remove(self, table, id):
+        with self.lock:
+            self.remove_locked(table, id)
+
+    def remove_locked(self, table, id):
+        self.names[table].remove(id)
+        self.display[table].pop(id, None)
+        city_state_id = self.city_of[table].pop(id, None)
+        if city_state_id is not None:
+            self.by_city[table][city_state_id].discard(id)
+        for genre_id in self.genres_of.pop(id, ()) if table == 'Venue' else ():
+            self.by_genre[genre_id].discard(id)
+
+    def search(self, kind, term):
+        term = (term or '').strip().lower()
+        with self.lock:
+            if kind in ('artists', 'venues'):
+                table = 'Artist' if kind == 'artists' else 'Venue'
+                texts = self.names[table].texts
+                ids = self.names[table].search(term)
+                # Name matches by position of the term, then genre-only matches
+                rank = {id: (0, texts[id].find(term)) for id in ids}
+                if kind == 'venues' and term:
+                    for genre_id, genre in self.genres.items():
+                        if term in genre:
+                            for id in self.by_genre[genre_id]:
+                                rank.setdefault(id, (1, 0))
+            elif kind in ('artists_by_city', 'venues_by_city'):
+                table = 'Artist' if kind == 'artists_by_city' else 'Venue'
+                texts = self.names[table].texts
+                rank = {}
+                for city_state_id in self.cities.search(term):
+                    for id in self.by_city[table][city_state_id]:
+                        rank[id] = (0, 0)
+            else:
+                raise ValueError('Unknown search: {}'.format(kind))
+            names = self.display[table]
+            return [Hit(id, names[id]) for id in sorted(rank, key=lambda id: (rank[id], texts[id], id))]
+
+
+backends = {
+    PostgresSearchBackend.name: PostgresSearchBackend,
+    SQLiteSearchBackend.name: SQLiteSearchBackend,
+    MemorySearchBackend.name: MemorySearchBackend,
+}
+
+def like_escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+#----------------------------------------------------------------------------#
+# Flask extension.
+#----------------------------------------------------------------------------#
+
+# The backend is picked from config SEARCH_BACKEND, or from the database dialect,
+# and set up lazily on the first search (the tables must exist by then).
+class Search(object):
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.backend = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        self.app = app
+        app.extensions['search'] = self
+
+    def get_backend(self):
+        if self.backend is None:
+            name = self.app.config.get('SEARCH_BACKEND') or self.db.engine.dialect.name
+            if name not in backends:
+                raise ValueError('No search backend for {}'.format(name))
+            backend = backends[name](self.db)
+            backend.setup()
+            self.backend = backend
+        return self.backend
+
+    def search(self, kind, term):
+        return self.get_backend().search(kind, term)
+
+    # Drops the backend after bulk changes; the next search builds it again
+    def reset(self):
+        self.backend = None
+
+    # Incremental index maintenance; before the first search there is nothing to update
+    def update(self, table, id):
+        if self.backend is not None:
+            self.backend.update(table, int(id))
+
+    def remove(self, table, id):
+        if self.backend is not None:
+            self.backend.remove(table, int(id))
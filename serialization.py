@@ -0,0 +1,38 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+
+# orjson is optional; the stdlib encoder produces the same documents
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#----------------------------------------------------------------------------#
+# JSON encoding.
+#----------------------------------------------------------------------------#
+
+def default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+def dumps(data): # return bytes
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def json_response(data, status=200):
+    return Response(dumps(data), status, mimetype='application/json')
+
+# One JSON document per line, encoded while rows is consumed so the first rows
+# are sent before the last ones are fetched
+def ndjson_response(rows):
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,26 @@
+# assets.py: the fallback minifier used without rcssmin, and url() rebasing.
+import pytest
+
+import assets
+
+
+@pytest.fixture
+def fallback(monkeypatch):
+    monkeypatch.setattr(assets, 'rcssmin', None)
+
+
+@pytest.mark.parametrize('source,expected', [
+  ('a  >  b , c { color : red ; }', 'a>b,c{color:red}'),
+  ('/* note */ a:hover { margin : 0 auto; }', 'a:hover{margin:0 auto}'),
+  # A descendant of any element in the :hover state, not a hovered link
+  ('a :hover { color: red }', 'a :hover{color:red}'),
+  ('@media (min-width: 600px) { .nav :first-child { float : left } }',
+   '@media (min-width: 600px){.nav :first-child{float:left}}'),
+])
+def test_minify_css_fallback(fallback, source, expected):
+    assert assets.minify_css(source) == expected
+
+def test_rebase_urls():
+    source = 'a{background:url(../img/a.png)} b{background:url("/static/b.png")}'
+    assert assets.rebase_urls(source, 'css/main.css', 'dist/app.css') == \
+        'a{background:url("../img/a.png")} b{background:url("/static/b.png")}'
@@ -0,0 +1,220 @@
+# cache.py: the tagged page cache and its invalidation, and conditional GETs.
+import base64
+import io
+from datetime import datetime
+
+import pytest
+from flask import Flask, render_template_string
+from flask_wtf.csrf import generate_csrf
+
+import app as fyyur
+from cache import CSRF_PLACEHOLDER, FileSystemCacheBackend, MemoryCacheBackend, ResponseCache, conditional
+
+# 1x1 PNG
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+PAGE = '<form><input name="csrf_token" value="{{ csrf_token() }}"></form>{{ name }} v{{ version }}'
+
+
+# A page per item of data, cached under 'item:<id>' and, through the probe,
+# keyed by the item's version like the venue and artist pages
+def make_app(backend='memory', directory=None):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', PAGE_CACHE_BACKEND=backend, PAGE_CACHE_DIR=directory)
+    app.jinja_env.globals['csrf_token'] = generate_csrf
+    cache = ResponseCache(app)
+    data = {1: {'name': 'Venue', 'version': 1}, 2: {'name': 'Other', 'version': 1}}
+    renders = []
+
+    @app.route('/items/<int:item_id>')
+    @cache.cached('items', 'item:{item_id}')
+    def item(item_id):
+        renders.append(item_id)
+        return render_template_string(PAGE, **data[item_id])
+
+    @app.route('/versioned/<int:item_id>')
+    @conditional(lambda item_id: (data[item_id]['version'], data[item_id].get('modified')))
+    @cache.cached('item:{item_id}')
+    def versioned(item_id):
+        renders.append(item_id)
+        return render_template_string(PAGE, **data[item_id])
+
+    app.data = data
+    app.renders = renders
+    app.page_cache = cache
+    return app
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+def cached_app(request, tmp_path):
+    return make_app(request.param, str(tmp_path / 'pages'))
+
+def test_hit_after_miss(cached_app):
+    client = cached_app.test_client()
+    assert client.get('/items/1').headers['X-Page-Cache'] == 'miss'
+    response = client.get('/items/1')
+    assert response.headers['X-Page-Cache'] == 'hit'
+    assert b'Venue v1' in response.data
+    assert cached_app.renders == [1]
+
+def test_invalidating_a_tag_drops_only_its_pages(cached_app):
+    client = cached_app.test_client()
+    client.get('/items/1')
+    client.get('/items/2')
+    cached_app.data[1]['name'] = 'Renamed'
+    cached_app.page_cache.invalidate('item:1')
+    response = client.get('/items/1')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'Renamed' in response.data
+    assert client.get('/items/2').headers['X-Page-Cache'] == 'hit'
+    cached_app.page_cache.invalidate('items')
+    assert client.get('/items/2').headers['X-Page-Cache'] == 'miss'
+
+def test_csrf_token_is_per_session(cached_app):
+    first = cached_app.test_client().get('/items/1').data
+    second = cached_app.test_client().get('/items/1').data
+    assert CSRF_PLACEHOLDER not in second
+    assert first != second
+    assert first.split(b'</form>')[1] == second.split(b'</form>')[1]
+
+def test_new_version_is_a_new_entry(cached_app):
+    client = cached_app.test_client()
+    client.get('/versioned/1')
+    assert client.get('/versioned/1').headers['X-Page-Cache'] == 'hit'
+    # No invalidation: the version read by the probe is part of the key
+    cached_app.data[1].update(name='Changed', version=2)
+    response = client.get('/versioned/1')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'Changed v2' in response.data
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+    assert backend.evictions == 1
+
+def test_filesystem_backend_tag_versions(tmp_path):
+    backend = FileSystemCacheBackend(str(tmp_path))
+    assert backend.tag_versions(['venue:1']) == [None]
+    backend.bump(['venue:1'])
+    version = backend.tag_versions(['venue:1'])
+    backend.bump(['venue:1'])
+    assert backend.tag_versions(['venue:1']) != version
+
+
+def test_if_none_match_is_answered_with_304(cached_app):
+    client = cached_app.test_client()
+    client.get('/versioned/1') # starts the session, whose CSRF token is part of the ETag
+    response = client.get('/versioned/1')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    renders = len(cached_app.renders)
+    response = client.get('/versioned/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert len(cached_app.renders) == renders
+
+def test_changed_version_is_a_new_etag(cached_app):
+    client = cached_app.test_client()
+    client.get('/versioned/1')
+    etag = client.get('/versioned/1').headers['ETag']
+    cached_app.data[1].update(name='Changed', version=2)
+    response = client.get('/versioned/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'Changed v2' in response.data
+
+def test_etag_is_per_session(cached_app):
+    first, second = cached_app.test_client(), cached_app.test_client()
+    for client in (first, second):
+        client.get('/versioned/1')
+    etag = first.get('/versioned/1').headers['ETag']
+    assert second.get('/versioned/1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_if_modified_since(cached_app):
+    cached_app.data[1]['modified'] = datetime(2030, 1, 1, 12, 0, 0, 500000)
+    client = cached_app.test_client()
+    response = client.get('/versioned/1')
+    assert response.headers['Last-Modified'] == 'Tue, 01 Jan 2030 12:00:00 GMT'
+    response = client.get('/versioned/1', headers={'If-Modified-Since': 'Tue, 01 Jan 2030 12:00:00 GMT'})
+    assert response.status_code == 304
+    response = client.get('/versioned/1', headers={'If-Modified-Since': 'Tue, 01 Jan 2030 11:59:59 GMT'})
+    assert response.status_code == 200
+
+def test_if_modified_since_checks_the_version(cached_app):
+    cached_app.data[1]['modified'] = datetime(2030, 1, 1, 12, 0, 0)
+    client = cached_app.test_client()
+    since = client.get('/versioned/1').headers['Last-Modified']
+    assert client.get('/versioned/1', headers={'If-Modified-Since': since}).status_code == 304
+    # A change that leaves the modification time alone, like a delete
+    cached_app.data[1]['version'] = 2
+    assert client.get('/versioned/1', headers={'If-Modified-Since': since}).status_code == 200
+    assert client.get('/versioned/1', headers={'If-Modified-Since': since}).status_code == 304
+
+
+# The venue page of app.py with the page cache on
+@pytest.fixture
+def venue_page(database):
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    database.session.add(city_state)
+    database.session.flush()
+    database.session.add_all([fyyur.Venue(name='Cached Venue', address='1 Main St', city_state_id=city_state.id),
+                              fyyur.Artist(name='Cached Artist', city_state_id=city_state.id)])
+    database.session.commit()
+    fyyur.page_cache.backend = MemoryCacheBackend()
+    yield fyyur.app.test_client()
+    fyyur.page_cache.backend = None
+
+def test_venue_page_is_invalidated_by_an_edit(venue_page, database):
+    client = venue_page
+    assert client.get('/venues/1').headers['X-Page-Cache'] == 'miss'
+    assert client.get('/venues/1').headers['X-Page-Cache'] == 'hit'
+    response = client.post('/venues/1/edit', data={'name': 'Edited Venue', 'city': 'San Francisco', 'state': 'CA',
+        'address': '1 Main St', 'phone': '123-123-1234', 'genres': ['Jazz'], 'facebook_link': '', 'website': '',
+        'seeking_description': '', 'image_link': (io.BytesIO(PNG), 'image.png')})
+    assert response.status_code == 302
+    client.get('/') # consumes the flashed message, which bypasses the cache
+    response = client.get('/venues/1')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'Edited Venue' in response.data
+
+def test_venue_page_is_invalidated_by_a_new_show(venue_page, database):
+    client = venue_page
+    client.get('/venues/1')
+    response = client.post('/shows/create', data={'artist_id': '1', 'venue_id': '1',
+        'start_time': '2030-01-01 20:00:00', 'duration': '120'})
+    assert response.status_code == 302
+    client.get('/')
+    response = client.get('/venues/1')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'Cached Artist' in response.data
+
+def test_venue_list_is_modified_by_a_delete(venue_page, database):
+    city_state = database.session.get(fyyur.CityState, 1)
+    database.session.add(fyyur.Venue(name='Other Venue', address='2 Main St', city_state_id=city_state.id))
+    database.session.commit()
+    client = venue_page
+    since = client.get('/venues').headers['Last-Modified']
+    assert client.get('/venues', headers={'If-Modified-Since': since}).status_code == 304
+    # The newest row stays, so the latest updated_at does too
+    database.session.delete(database.session.get(fyyur.Venue, 1))
+    database.session.commit()
+    response = client.get('/venues', headers={'If-Modified-Since': since})
+    assert response.status_code == 200
+    assert b'Cached Venue' not in response.data
+
+def test_venue_page_revalidates_until_an_edit(venue_page, database):
+    client = venue_page
+    client.get('/venues/1')
+    etag = client.get('/venues/1').headers['ETag']
+    assert client.get('/venues/1', headers={'If-None-Match': etag}).status_code == 304
+    venue = database.session.get(fyyur.Venue, 1)
+    venue.name = 'Renamed Venue'
+    database.session.commit()
+    response = client.get('/venues/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Renamed Venue' in response.data
@@ -0,0 +1,145 @@
+# compression.py: Accept-Encoding negotiation, the headers of compressed
+# responses, streaming flushes and closing the wrapped body.
+import zlib
+
+import pytest
+
+from compression import CompressionMiddleware, brotli
+
+PAGE = b'<p>Fyyur</p>\n' * 200
+
+
+class Body(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def wsgi_app(chunks=(PAGE,), headers=(('Content-Type', 'text/html; charset=utf-8'),), status='200 OK'):
+    def app(environ, start_response):
+        start_response(status, list(headers))
+        app.body = Body(list(chunks))
+        return app.body
+    return app
+
+def call(middleware, accept_encoding='gzip', method='GET'):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = status
+        started['headers'] = headers
+
+    body = middleware({'REQUEST_METHOD': method, 'HTTP_ACCEPT_ENCODING': accept_encoding}, start_response)
+    return body, started['headers']
+
+def header(headers, name):
+    values = [value for key, value in headers if key.lower() == name.lower()]
+    return values[0] if values else None
+
+
+@pytest.mark.parametrize('accept_encoding,expected', [
+  ('gzip', 'gzip'),
+  ('gzip, deflate', 'gzip'),
+  ('deflate, gzip;q=0.5', 'gzip'),
+  ('gzip;q=0', None),
+  ('identity', None),
+  ('', None),
+])
+def test_negotiate_gzip(accept_encoding, expected):
+    middleware = CompressionMiddleware(wsgi_app())
+    assert middleware.negotiate({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept_encoding}) == expected
+
+def test_negotiate_prefers_brotli_when_available():
+    middleware = CompressionMiddleware(wsgi_app())
+    chosen = middleware.negotiate({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip, br'})
+    assert chosen == ('br' if brotli is not None else 'gzip')
+    assert middleware.negotiate({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip;q=0, br;q=0'}) is None
+
+def test_head_requests_are_left_alone():
+    middleware = CompressionMiddleware(wsgi_app())
+    assert middleware.negotiate({'REQUEST_METHOD': 'HEAD', 'HTTP_ACCEPT_ENCODING': 'gzip'}) is None
+
+
+def test_gzip_response_headers_and_body():
+    app = wsgi_app(headers=[('Content-Type', 'text/html'), ('Content-Length', str(len(PAGE))),
+                            ('Vary', 'Cookie'), ('ETag', '"abc"')])
+    body, headers = call(CompressionMiddleware(app), 'gzip')
+    assert header(headers, 'Content-Encoding') == 'gzip'
+    assert header(headers, 'Content-Length') is None
+    assert header(headers, 'Vary') == 'Cookie, Accept-Encoding'
+    assert header(headers, 'ETag') == 'W/"abc"'
+    assert zlib.decompress(b''.join(body), 16 + zlib.MAX_WBITS) == PAGE
+
+def test_vary_is_added_once():
+    app = wsgi_app(headers=[('Content-Type', 'text/html'), ('Vary', 'Accept-Encoding')])
+    _, headers = call(CompressionMiddleware(app), 'gzip')
+    assert [value for key, value in headers if key == 'Vary'] == ['Accept-Encoding']
+
+@pytest.mark.parametrize('headers,status', [
+  ([('Content-Type', 'image/png')], '200 OK'),
+  ([('Content-Type', 'text/html'), ('Content-Length', '10')], '200 OK'),
+  ([('Content-Type', 'text/html'), ('Content-Encoding', 'br')], '200 OK'),
+  ([('Content-Type', 'text/html')], '304 Not Modified'),
+])
+def test_uncompressed_responses(headers, status):
+    app = wsgi_app(headers=headers, status=status)
+    body, sent = call(CompressionMiddleware(app), 'gzip')
+    assert body is app.body
+    assert header(sent, 'Content-Encoding') == dict(headers).get('Content-Encoding')
+
+def test_malformed_content_length_is_left_alone():
+    app = wsgi_app(headers=[('Content-Type', 'text/html'), ('Content-Length', 'many')])
+    body, headers = call(CompressionMiddleware(app), 'gzip')
+    assert body is app.body
+    assert header(headers, 'Content-Encoding') is None
+
+@pytest.mark.parametrize('accept_encoding,cpu_budget', [('identity', None), ('gzip', 0.001)])
+def test_uncompressed_text_varies_on_accept_encoding(accept_encoding, cpu_budget):
+    middleware = CompressionMiddleware(wsgi_app(headers=[('Content-Type', 'text/html'), ('Vary', 'Cookie')]),
+                                       cpu_budget=cpu_budget)
+    middleware.within_budget()
+    middleware.charge(1.0)
+    body, headers = call(middleware, accept_encoding)
+    assert header(headers, 'Content-Encoding') is None
+    assert header(headers, 'Vary') == 'Cookie, Accept-Encoding'
+    assert b''.join(body) == PAGE
+
+def test_other_types_do_not_vary():
+    _, headers = call(CompressionMiddleware(wsgi_app(headers=[('Content-Type', 'image/png')])), 'identity')
+    assert header(headers, 'Vary') is None
+
+
+def test_streamed_body_flushes_the_first_chunk():
+    chunks = [b'<head>' + b'x' * 100, b'<body>' + b'y' * 100000]
+    body, _ = call(CompressionMiddleware(wsgi_app(chunks)), 'gzip')
+    parts = iter(body)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(next(parts)) == chunks[0]
+    rest = b''.join(decompressor.decompress(part) for part in parts)
+    assert rest + decompressor.flush() == chunks[1]
+
+def test_body_is_closed_without_iteration():
+    app = wsgi_app()
+    body, _ = call(CompressionMiddleware(app), 'gzip')
+    body.close()
+    assert app.body.closed
+
+def test_body_is_closed_after_iteration():
+    app = wsgi_app()
+    body, _ = call(CompressionMiddleware(app), 'gzip')
+    b''.join(body)
+    body.close()
+    assert app.body.closed
+
+
+def test_over_cpu_budget_responses_go_out_uncompressed():
+    middleware = CompressionMiddleware(wsgi_app(), cpu_budget=0.001)
+    middleware.within_budget()
+    middleware.charge(1.0)
+    assert middleware.negotiate({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}) is None
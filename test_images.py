@@ -0,0 +1,175 @@
+# images.py and flask gc-images: content-addressed uploads, variants, and
+# collecting the files no entity points at.
+import io
+import os
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+import app as fyyur
+from conftest import DATA_DIR
+from images import Image, ImageStore, find_orphans, original_path, variant_path
+
+needs_pillow = pytest.mark.skipif(Image is None, reason='Pillow is not installed')
+
+
+def jpeg(color, size=(700, 400)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def upload(data):
+    return FileStorage(io.BytesIO(data), 'photo.jpg')
+
+def touch(path, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+# Waits for the variant jobs of path | return list of existing variant paths
+def variants(store, path, timeout=10):
+    wanted = [variant_path(path, width) for width in store.widths]
+    deadline = time.time() + timeout
+    while not all(os.path.exists(variant) for variant in wanted) and time.time() < deadline:
+        time.sleep(0.01)
+    return [variant for variant in wanted if os.path.exists(variant)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    app = Flask(__name__)
+    app.config.update(IMAGE_STORE_DIR=str(tmp_path / 'store'), IMAGE_VARIANTS={'tile': 320, 'detail': 960},
+                      IMAGE_SRCSET_WIDTHS=(320, 640))
+    ready = []
+    store = ImageStore(app, on_ready=ready.append)
+    store.ready_paths = ready
+    yield store
+    if store.pool is not None:
+        store.pool.shutdown(wait=True)
+
+
+def test_variant_and_original_paths():
+    assert variant_path('static/img/store/ab/abc.jpg', 320) == 'static/img/store/ab/abc-320w.jpg'
+    assert original_path('static/img/store/ab/abc-320w.jpg') == 'static/img/store/ab/abc.jpg'
+    assert original_path('static/img/my-photo.jpg') == 'static/img/my-photo.jpg'
+
+@needs_pillow
+def test_identical_uploads_share_a_file(store):
+    data = jpeg((10, 20, 30))
+    path = store.save(upload(data), 'jpeg')
+    assert store.save(upload(data), 'JPG') == path
+    assert path.endswith('.jpg')
+    assert os.path.basename(os.path.dirname(path)) == os.path.basename(path)[:2]
+    assert store.save(upload(jpeg((30, 20, 10))), 'jpg') != path
+    with open(path, 'rb') as f:
+        assert f.read() == data
+
+@needs_pillow
+def test_variants_are_made_after_the_upload(store):
+    path = store.save(upload(jpeg((10, 20, 30))), 'jpg')
+    assert len(variants(store, path)) == 3
+    store.pool.shutdown(wait=True)
+    assert store.ready_paths == [path]
+    with Image.open(variant_path(path, 320)) as image:
+        assert image.width == 320
+    # Smaller than the original; the 960 variant keeps the original's size
+    with Image.open(variant_path(path, 960)) as image:
+        assert image.width == 700
+    assert store.url(path) == '/' + variant_path(path, 320).lstrip('/')
+    assert store.url(path, 'detail') == '/' + variant_path(path, 960).lstrip('/')
+    # By the real width of each variant
+    assert store.srcset(path) == '/{} 320w, /{} 640w, /{} 700w'.format(
+        *[variant_path(path, width).lstrip('/') for width in (320, 640, 960)])
+
+@needs_pillow
+def test_srcset_of_a_small_original(store):
+    path = store.save(upload(jpeg((10, 20, 30), size=(200, 100))), 'jpg')
+    assert len(variants(store, path)) == 3
+    assert store.srcset(path) == '/{} 200w'.format(variant_path(path, 320).lstrip('/'))
+
+def test_identical_upload_renews_the_mtime(store):
+    path = store.save(upload(b'data'), 'jpg')
+    touch(path, age=7200)
+    store.save(upload(b'data'), 'jpg')
+    assert time.time() - os.path.getmtime(path) < 60
+    assert [name for name in os.listdir(store.directory) if name.startswith('.upload-')] == []
+
+def test_url_falls_back_to_the_original(store):
+    path = os.path.join(store.directory, 'ab', 'abc.jpg')
+    assert store.url(path) == '/' + path.lstrip('/')
+    assert store.srcset(path) == ''
+    assert store.url('https://example.com/a.jpg') == 'https://example.com/a.jpg'
+    assert store.url('static/img/legacy.jpg') == '/static/img/legacy.jpg'
+
+@needs_pillow
+def test_collected_variants_are_made_again(store):
+    data = jpeg((10, 20, 30))
+    path = store.save(upload(data), 'jpg')
+    for variant in variants(store, path):
+        assert store.has(variant)
+        os.remove(variant)
+    store.save(upload(data), 'jpg')
+    assert len(variants(store, path)) == 3
+
+def test_forget(store):
+    path = touch(os.path.join(store.directory, 'ab', 'abc-320w.jpg'))
+    assert store.has(path)
+    os.remove(path)
+    assert store.has(path)
+    store.forget(path)
+    assert not store.has(path)
+
+
+# Paths are relative to the working directory, as image_link values are
+def test_find_orphans(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    kept = touch(os.path.join('store', 'ab', 'abc.jpg'), age=7200)
+    kept_variant = touch(os.path.join('store', 'ab', 'abc-320w.jpg'), age=7200)
+    orphan = touch(os.path.join('store', 'cd', 'cde.png'), age=7200)
+    orphan_variant = touch(os.path.join('store', 'cd', 'cde-640w.png'), age=7200)
+    young = touch(os.path.join('store', 'ef', 'efg.jpg'))
+    partial_upload = touch(os.path.join('store', '.upload-123.tmp'), age=7200)
+    other = touch(os.path.join('store', 'notes.txt'), age=7200)
+    found = dict(find_orphans([('store', True)], ['/' + kept], 3600, time.time(), {'jpg', 'png'}))
+    assert sorted(found) == sorted([orphan, orphan_variant, partial_upload])
+    assert found[orphan] == 1
+    assert not set(found) & {kept, kept_variant, young, other}
+
+def test_find_orphans_at_the_top_level_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    touch(os.path.join('img', 'legacy.jpg'), age=7200)
+    touch(os.path.join('img', 'store', 'ab', 'abc.jpg'), age=7200)
+    found = find_orphans([('img', False)], [], 3600, time.time(), {'jpg'})
+    assert [path for path, _ in found] == [os.path.join('img', 'legacy.jpg')]
+
+
+def test_gc_images_drops_collected_files_from_the_store(database, monkeypatch):
+    monkeypatch.chdir(DATA_DIR)
+    monkeypatch.setitem(fyyur.app.config, 'IMAGE_STORE_DIR', 'gc-store')
+    store = 'gc-store'
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    database.session.add(city_state)
+    database.session.flush()
+    kept = touch(os.path.join(store, 'aa', 'aaa.jpg'), age=7200)
+    orphan = touch(os.path.join(store, 'bb', 'bbb-320w.jpg'), age=7200)
+    database.session.add(fyyur.Venue(name='Venue', address='1 Main St', city_state_id=city_state.id, image_link=kept))
+    database.session.commit()
+    assert fyyur.images.has(orphan)
+
+    runner = fyyur.app.test_cli_runner()
+    result = runner.invoke(args=['gc-images', '--dry-run'])
+    assert 'Would reclaim 1 bytes in 1 files' in result.output
+    assert os.path.exists(orphan)
+
+    result = runner.invoke(args=['gc-images'])
+    assert 'Reclaimed 1 bytes in 1 files' in result.output
+    assert not os.path.exists(orphan)
+    assert os.path.exists(kept)
+    # Through the invalidation bus, as in every other worker
+    assert not fyyur.images.has(orphan)
@@ -0,0 +1,121 @@
+# Bulk import (importer.py and flask import): record parsing, and resuming an
+# import that stopped at a bad record from its checkpoint.
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from conftest import DATA_DIR
+from importer import BulkImporter, Checkpoint, RecordError, read_records
+
+
+def write_lines(name, lines):
+    path = os.path.join(DATA_DIR, name)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+def venue_line(i):
+    return json.dumps({'name': 'Venue {}'.format(i), 'city': 'san francisco', 'state': 'CA',
+                       'address': '{} Main St'.format(i), 'genres': ['Jazz', 'Folk']})
+
+def run_import(*args):
+    return fyyur.app.test_cli_runner().invoke(args=['import'] + list(args))
+
+
+def test_malformed_json_line_is_a_record_error():
+    path = write_lines('broken.jsonl', [venue_line(1), '{"name": "Venue 2",', '[1, 2]'])
+    records = read_records(path)
+    assert next(records)[0] == 1
+    with pytest.raises(RecordError, match='line 2: invalid JSON'):
+        next(records)
+
+def test_json_line_must_be_an_object():
+    records = read_records(write_lines('list.jsonl', ['[1, 2]']))
+    with pytest.raises(RecordError, match='line 1: not a JSON object'):
+        next(records)
+
+def test_show_end_from_duration_or_default():
+    importer = BulkImporter(fyyur.db, show_duration=timedelta(minutes=90))
+    row = importer.show_row('shows', {'artist_id': '1', 'venue_id': '2', 'start_time': '2030-01-01 20:00', 'duration': '45'})
+    assert (row['artist_id'], row['venue_id']) == (1, 2)
+    assert row['end_time'] == datetime(2030, 1, 1, 20, 45)
+    row = importer.show_row('shows', {'artist_id': 1, 'venue_id': 2, 'start_time': '2030-01-01 20:00'})
+    assert row['end_time'] == datetime(2030, 1, 1, 21, 30)
+
+def test_show_ending_before_it_starts_is_rejected():
+    importer = BulkImporter(fyyur.db)
+    with pytest.raises(RecordError, match='end_time before start_time'):
+        importer.show_row('shows', {'artist_id': 1, 'venue_id': 2, 'start_time': '2030-01-01 20:00',
+                                    'end_time': '2030-01-01 19:00'})
+
+
+def test_resume_after_bad_record(database):
+    lines = [venue_line(i) for i in range(1, 6)]
+    path = write_lines('venues.jsonl', lines[:3] + ['{"name": '] + lines[4:])
+
+    result = run_import('venues', path, '--batch-size', '2')
+    assert result.exit_code == 1
+    assert 'line 4: invalid JSON' in result.output
+    assert 'resume with the same command' in result.output
+    # The first batch is committed and checkpointed, the second one is not
+    assert [name for (name,) in database.session.query(fyyur.Venue.name).order_by(fyyur.Venue.id)] == ['Venue 1', 'Venue 2']
+    assert Checkpoint(path + '.checkpoint', 'venues', path).load() == 2
+
+    write_lines('venues.jsonl', lines[:3] + [venue_line(4)] + lines[4:])
+    result = run_import('venues', path, '--batch-size', '2')
+    assert result.exit_code == 0, result.output
+    assert 'Resuming after 2 records' in result.output
+    assert [name for (name,) in database.session.query(fyyur.Venue.name).order_by(fyyur.Venue.id)] == \
+        ['Venue {}'.format(i) for i in range(1, 6)]
+    assert not os.path.exists(path + '.checkpoint')
+    venue = fyyur.Venue.query.filter_by(name='Venue 5').one()
+    assert sorted(genre.name for genre in venue.genres) == ['Folk', 'Jazz']
+    assert venue.city_state.city == 'San Francisco'
+
+def test_checkpoint_of_another_import_is_refused(database):
+    path = write_lines('artists.jsonl', [venue_line(1)])
+    Checkpoint(path + '.checkpoint', 'venues', path).save(1)
+    result = run_import('artists', path)
+    assert result.exit_code == 1
+    assert 'belongs to another import' in result.output
+    assert '--restart' in result.output
+
+
+def seed_show_targets(db):
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    db.session.add(city_state)
+    db.session.flush()
+    db.session.add_all([fyyur.Venue(name='Venue', address='1 Main St', city_state_id=city_state.id),
+                        fyyur.Artist(name='Free Artist', city_state_id=city_state.id),
+                        fyyur.Artist(name='Busy Artist', city_state_id=city_state.id)])
+    db.session.flush()
+    db.session.add(fyyur.ArtistAvailability(artist_id=2, start_time=datetime(2030, 1, 1, 18), end_time=datetime(2030, 1, 1, 22)))
+    db.session.commit()
+
+def show_line(artist_id, start, duration=120):
+    return json.dumps({'artist_id': artist_id, 'venue_id': 1, 'start_time': start, 'duration': duration})
+
+def test_imported_shows_may_not_double_book_a_venue(database):
+    seed_show_targets(database)
+    path = write_lines('overlap.jsonl', [show_line(1, '2030-01-02 20:00'), show_line(1, '2030-01-02 22:00'),
+                                         show_line(1, '2030-01-02 23:30')])
+    result = run_import('shows', path, '--batch-size', '10')
+    assert result.exit_code == 1
+    assert 'line 3: venue 1 is already booked at this time' in result.output
+    assert database.session.query(fyyur.Show).count() == 0
+
+def test_imported_shows_must_fit_the_artist_availability(database):
+    seed_show_targets(database)
+    path = write_lines('availability.jsonl', [show_line(2, '2030-01-01 20:00'), show_line(2, '2030-01-01 21:00')])
+    result = run_import('shows', path)
+    assert result.exit_code == 1
+    assert 'line 2: artist 2 is not available at this time' in result.output
+
+    write_lines('availability.jsonl', [show_line(2, '2030-01-01 20:00'), show_line(1, '2030-01-02 20:00')])
+    result = run_import('shows', path, '--restart')
+    assert result.exit_code == 0, result.output
+    assert database.session.query(fyyur.Show).count() == 2
+    assert database.session.get(fyyur.Artist, 2).upcoming_shows_count == 1
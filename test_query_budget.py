@@ -0,0 +1,259 @@
+# Query-budget regression suite: every route is requested against a small and
+# a larger fixture dataset, and the number of SQL statements each request runs
+# must stay within its QUERY_BUDGETS entry (config.py) and must not grow with
+# the data. An N+1 shows up as a count that differs between the two runs:
+# every table, shows per venue and artist included, grows with the dataset.
+#
+#   python -m pytest -q test_query_budget.py
+#
+# Runs with the settings of conftest.py: a throwaway SQLite database with the
+# page and fragment caches off, so every request does its full work.
+import base64
+import io
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import config
+import app as fyyur
+from metrics import QueryBudgetExceeded
+from search import SQLiteSearchBackend
+
+SMALL = 3
+LARGE = 12
+AUTH = {'Authorization': 'Bearer ' + config.STATUS_TOKEN}
+
+
+# 1x1 PNG
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+def png():
+    return (io.BytesIO(PNG), 'image.png')
+
+def artist_form(name='Budget Artist'):
+    return {'name': name, 'city': 'San Francisco', 'state': 'CA', 'phone': '123-123-1234',
+            'genres': ['Jazz', 'Folk'], 'facebook_link': 'https://www.facebook.com/budget',
+            'website': 'https://budget.example.com', 'seeking_description': '',
+            'available_time': '', 'image_link': png()}
+
+def venue_form(name='Budget Venue'):
+    return {'name': name, 'city': 'San Francisco', 'state': 'CA', 'address': '1 Budget St',
+            'phone': '123-123-1234', 'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/budget',
+            'website': 'https://budget.example.com', 'seeking_description': '', 'image_link': png()}
+
+# Inside the availability of artist 2 (see seed) and clear of venue 3's shows
+def show_start():
+    return this_hour() + timedelta(days=2, hours=12)
+
+def show_form():
+    return {'artist_id': '2', 'venue_id': '3', 'start_time': show_start().strftime('%Y-%m-%d %H:%M:%S'), 'duration': '120'}
+
+def schedule_body():
+    return {'queries': [{'artist_ids': [1, 2], 'venue_ids': [1]}, {'venue_ids': [2, 3], 'days': 30}]}
+
+
+# (method, path, request options, expected status). Writes come after the
+# reads, the delete last; a write that fails validation re-renders its form
+# with a 200, so they must redirect.
+REQUESTS = [
+  ('GET', '/', {}, 200),
+  ('GET', '/venues', {}, 200),
+  ('GET', '/venues/1', {}, 200),
+  ('GET', '/venues/1/edit', {}, 200),
+  ('GET', '/venues/create', {}, 200),
+  ('GET', '/artists', {}, 200),
+  ('GET', '/artists/areas', {}, 200),
+  ('GET', '/artists/1', {}, 200),
+  ('GET', '/artists/1/edit', {}, 200),
+  ('GET', '/artists/create', {}, 200),
+  ('GET', '/shows', {}, 200),
+  ('GET', '/shows/create', {}, 200),
+  ('POST', '/artists/search', {'data': {'search_term': 'art'}}, 200),
+  ('POST', '/artists/search_by_city', {'data': {'search_term': 'san'}}, 200),
+  ('POST', '/venues/search', {'data': {'search_term': 'ven'}}, 200),
+  ('POST', '/venues/search_by_city', {'data': {'search_term': 'york'}}, 200),
+  ('GET', '/schedule/free?artist_id=1&artist_id=2&venue_id=1', {}, 200),
+  ('POST', '/schedule/free', {'json': schedule_body}, 200),
+  ('GET', '/api/v1/venues', {}, 200),
+  ('GET', '/api/v1/venues/1', {}, 200),
+  ('GET', '/api/v1/artists', {}, 200),
+  ('GET', '/api/v1/artists/1', {}, 200),
+  ('GET', '/api/v1/shows', {}, 200),
+  ('GET', '/api/v1/shows?format=ndjson', {}, 200),
+  ('GET', '/api/v1/search?type=artists&q=art', {}, 200),
+  ('GET', '/export/shows.csv', {'headers': AUTH}, 200),
+  ('GET', '/export/venues.ndjson', {'headers': AUTH}, 200),
+  ('GET', '/cache/stats', {'headers': AUTH}, 200),
+  ('GET', '/status/pool', {'headers': AUTH}, 200),
+  ('GET', '/metrics', {'headers': AUTH}, 200),
+  ('POST', '/artists/create', {'data': artist_form}, 302),
+  ('POST', '/venues/create', {'data': venue_form}, 302),
+  ('POST', '/shows/create', {'data': show_form}, 302),
+  ('POST', '/artists/1/edit', {'data': lambda: artist_form('Edited Artist')}, 302),
+  ('POST', '/venues/1/edit', {'data': lambda: venue_form('Edited Venue')}, 302),
+  ('POST', '/venues/2', {}, 302),
+]
+
+# Served by Flask or assets.py from files, no database
+UNCOUNTED_ENDPOINTS = ('static', 'asset')
+
+
+def this_hour():
+    return datetime.now().replace(minute=0, second=0, microsecond=0)
+
+# Venues and artists in two cities, each with size past and upcoming shows and
+# each artist with availability, so every page has rows to loop over
+def seed(size):
+    db = fyyur.db
+    db.drop_all()
+    # The FTS tables of search.py are not models; they go with their tables
+    with db.engine.begin() as conn:
+        for table, _ in SQLiteSearchBackend.indexed:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS "{}_fts"'.format(table))
+    db.create_all()
+    fyyur.search.reset()
+    fyyur.bookings.clear()
+    san_francisco = fyyur.CityState(city='San Francisco', state='CA')
+    new_york = fyyur.CityState(city='New York', state='NY')
+    genres = [fyyur.Genre(name=name) for name in ('Jazz', 'Folk', 'Rock')]
+    db.session.add_all([san_francisco, new_york] + genres)
+    db.session.flush()
+    venues = [fyyur.Venue(name='Venue {}'.format(i), address='{} Main St'.format(i), image_link='static/img/venue.png',
+                          city_state_id=(san_francisco if i % 2 else new_york).id, genres=genres[:1 + i % 3])
+              for i in range(size)]
+    artists = [fyyur.Artist(name='Artist {}'.format(i), image_link='static/img/artist.png',
+                            city_state_id=(san_francisco if i % 2 else new_york).id, genres=genres[i % 3:])
+               for i in range(size)]
+    db.session.add_all(venues + artists)
+    db.session.flush()
+    now = this_hour()
+    for i, venue in enumerate(venues):
+        for j in range(size):
+            start = now + timedelta(days=(j - size // 2) * 7 + i, hours=20)
+            db.session.add(fyyur.Show(venue_id=venue.id, artist_id=artists[(i + j) % size].id,
+                                      start_time=start, end_time=start + timedelta(hours=2)))
+    for i, artist in enumerate(artists):
+        start = now + timedelta(days=i + 1, hours=10)
+        db.session.add(fyyur.ArtistAvailability(artist_id=artist.id, start_time=start, end_time=start + timedelta(hours=8)))
+    db.session.commit()
+    fyyur.refresh_show_counters()
+    db.session.commit()
+    db.session.remove()
+    # One-time setup of the search backend is not a cost of the first search
+    fyyur.search.get_backend()
+
+
+def endpoint(method, path):
+    return fyyur.app.url_map.bind('localhost').match(path.split('?')[0], method)[0]
+
+def options(spec):
+    return {key: value() if callable(value) else value for key, value in spec.items()}
+
+# The writes of REQUESTS are in the database
+def check_writes(size):
+    db = fyyur.db
+    names = lambda model: set(name for (name,) in db.session.query(model.name))
+    assert 'Budget Artist' in names(fyyur.Artist)
+    assert 'Budget Venue' in names(fyyur.Venue)
+    assert db.session.get(fyyur.Artist, 1).name == 'Edited Artist'
+    assert db.session.get(fyyur.Venue, 1).name == 'Edited Venue'
+    assert db.session.get(fyyur.Venue, 2) is None
+    assert db.session.query(fyyur.Show).filter_by(artist_id=2, venue_id=3, start_time=show_start()).count() == 1
+    assert db.session.query(fyyur.Artist).count() == size + 1
+    assert db.session.query(fyyur.Venue).count() == size
+
+
+# Statement counts of every request | return dict (method, path): count
+def count_queries(size):
+    with fyyur.app.app_context():
+        seed(size)
+        engine = fyyur.db.engine
+    client = fyyur.app.test_client()
+    counted = []
+    thread = threading.get_ident()
+    jobs = threading.local()
+
+    # Only the request's own statements, not those of image jobs, which may
+    # also finish on the request thread (on_ready of a done future)
+    def count(*args):
+        if threading.get_ident() == thread and not getattr(jobs, 'running', False):
+            counted[-1] += 1
+
+    def on_ready(path):
+        jobs.running = True
+        try:
+            image_ready(path)
+        finally:
+            jobs.running = False
+
+    image_ready = fyyur.images.on_ready
+    fyyur.images.on_ready = on_ready
+    event.listen(engine, 'after_cursor_execute', count)
+    try:
+        counts = {}
+        for method, path, spec, status in REQUESTS:
+            counted.append(0)
+            response = client.open(path, method=method, **options(spec))
+            response.get_data()
+            response.close()
+            assert response.status_code == status, '{} {} returned {}'.format(method, path, response.status_code)
+            counts[(method, path)] = counted[-1]
+    finally:
+        event.remove(engine, 'after_cursor_execute', count)
+        fyyur.images.on_ready = image_ready
+    with fyyur.app.app_context():
+        check_writes(size)
+    return counts
+
+
+@pytest.fixture(scope='module')
+def counts():
+    return count_queries(SMALL), count_queries(LARGE)
+
+
+def test_every_route_is_requested():
+    requested = set(endpoint(method, path) for method, path, _, _ in REQUESTS)
+    routes = set(rule.endpoint for rule in fyyur.app.url_map.iter_rules()) - set(UNCOUNTED_ENDPOINTS)
+    assert routes - requested == set()
+
+
+@pytest.mark.parametrize('method,path', [(method, path) for method, path, _, _ in REQUESTS])
+def test_query_budget(counts, method, path):
+    small, large = counts
+    budget = fyyur.metrics.budget(endpoint(method, path))
+    assert large[(method, path)] == small[(method, path)], \
+        'query count grows with the data: {} with {} rows, {} with {}'.format(
+            small[(method, path)], SMALL, large[(method, path)], LARGE)
+    assert budget is not None and large[(method, path)] <= budget, \
+        '{} queries, budget {}'.format(large[(method, path)], budget)
+
+
+# The guard of metrics.py, on in development ('log') and in CI ('raise')
+@pytest.fixture
+def over_budget(database, monkeypatch):
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    database.session.add(city_state)
+    database.session.flush()
+    database.session.add_all([fyyur.Venue(name='Budget Venue', address='1 Main St', city_state_id=city_state.id),
+                              fyyur.Artist(name='Budget Artist', city_state_id=city_state.id)])
+    database.session.commit()
+    monkeypatch.setattr(fyyur.metrics, 'budgets', {'show_venue': 1, 'create_show_submission': 1})
+    return monkeypatch
+
+def test_log_mode_logs_an_over_budget_request(over_budget, caplog):
+    over_budget.setattr(fyyur.metrics, 'budget_mode', 'log')
+    response = fyyur.app.test_client().get('/venues/1')
+    assert response.status_code == 200
+    assert 'Query budget exceeded: GET /venues/1 ran' in caplog.text
+
+def test_raise_mode_fails_an_over_budget_request(over_budget):
+    over_budget.setattr(fyyur.metrics, 'budget_mode', 'raise')
+    client = fyyur.app.test_client()
+    with pytest.raises(QueryBudgetExceeded, match='show_venue ran more than 1 queries'):
+        client.get('/venues/1')
+    # The show handler catches every exception; the request fails all the same
+    with pytest.raises(QueryBudgetExceeded, match='create_show_submission ran [0-9]+ queries, budget 1'):
+        client.post('/shows/create', data={'artist_id': '1', 'venue_id': '1',
+                                           'start_time': '2030-01-01 20:00:00', 'duration': '120'})
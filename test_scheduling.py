@@ -0,0 +1,153 @@
+# scheduling.py: interval overlap probes, the venue double-booking guard and
+# the free slot finder.
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduling import IntervalIndex, VenueBookings, common_free_slots, intersect_all, merge, subtract
+
+
+def at(hour, minute=0):
+    return datetime(2030, 1, 1) + timedelta(hours=hour, minutes=minute)
+
+
+@pytest.mark.parametrize('start,end,expected', [
+  (at(18), at(20), False), # ends where the booking starts
+  (at(22), at(23), False), # starts where the booking ends
+  (at(19), at(21), True),
+  (at(21), at(22, 30), True),
+  (at(20, 30), at(21), True), # inside
+  (at(19), at(23), True), # around
+])
+def test_overlap_at_boundaries(start, end, expected):
+    index = IntervalIndex([(at(20), at(22))])
+    assert index.overlaps(start, end) is expected
+
+def test_long_interval_is_found_from_far_behind():
+    index = IntervalIndex([(at(0), at(48)), (at(30), at(31)), (at(50), at(51))])
+    assert index.overlapping(at(40), at(41)) == [(at(0), at(48))]
+    assert index.overlapping(at(30, 30), at(50, 30)) == [(at(0), at(48)), (at(30), at(31)), (at(50), at(51))]
+
+def test_empty_and_inverted_intervals_are_ignored():
+    index = IntervalIndex([(at(2), at(2)), (at(3), at(1))])
+    assert len(index) == 0
+    assert not index.overlaps(at(0), at(4))
+    index.add(at(5), at(5))
+    assert len(index) == 0
+
+def test_removed_intervals_are_not_probed():
+    index = IntervalIndex([(at(1), at(5)), (at(6), at(7))])
+    index.remove(at(1), at(5))
+    index.remove(at(2), at(3))
+    assert index.intervals == [(at(6), at(7))]
+    assert not index.overlaps(at(2), at(6))
+
+def test_added_intervals_are_probed():
+    index = IntervalIndex()
+    index.add(at(10), at(12))
+    index.add(at(1), at(2))
+    assert index.overlaps(at(11), at(13))
+    assert not index.overlaps(at(2), at(10))
+
+
+def test_reserve_records_only_free_bookings():
+    loaded = []
+
+    def load(venue_id):
+        loaded.append(venue_id)
+        return [(at(20), at(22))]
+
+    bookings = VenueBookings(load)
+    with bookings.reserve(1, at(21), at(23)) as free:
+        assert not free
+    with bookings.reserve(1, at(22), at(23)) as free:
+        assert free
+    with bookings.reserve(1, at(22, 30), at(23, 30)) as free:
+        assert not free
+    assert loaded == [1]
+
+def test_reserve_drops_the_booking_when_the_insert_fails():
+    bookings = VenueBookings(lambda venue_id: [])
+    with pytest.raises(RuntimeError):
+        with bookings.reserve(1, at(20), at(22)) as free:
+            assert free
+            raise RuntimeError('insert failed')
+    with bookings.reserve(1, at(20), at(22)) as free:
+        assert free
+
+def test_forget_reloads_the_venue():
+    rows = []
+    bookings = VenueBookings(lambda venue_id: list(rows))
+    with bookings.reserve(1, at(20), at(22)) as free:
+        assert free
+    rows.append((at(8), at(10)))
+    bookings.forget(1)
+    with bookings.reserve(1, at(9), at(11)) as free:
+        assert not free
+    with bookings.reserve(1, at(20), at(22)) as free:
+        assert free
+
+def test_reservation_holds_only_its_interval_of_its_venue():
+    bookings = VenueBookings(lambda venue_id: [])
+    with bookings.reserve(1, at(20), at(22)) as free:
+        assert free
+        # Inside the block (the insert and commit): another venue is not held
+        # up, and the same venue sees the interval as taken
+        with bookings.reserve(2, at(20), at(22)) as other_free:
+            assert other_free
+        with bookings.reserve(1, at(21), at(23)) as other_free:
+            assert not other_free
+
+def test_idle_venues_are_evicted():
+    loaded = []
+
+    def load(venue_id):
+        loaded.append(venue_id)
+        return []
+
+    bookings = VenueBookings(load, max_venues=2)
+    with bookings.reserve(1, at(20), at(22)):
+        for venue_id in (2, 3, 4):
+            with bookings.reserve(venue_id, at(20), at(22)):
+                pass
+        # The pending reservation keeps venue 1
+        assert list(bookings.venues) == [1, 4]
+    with bookings.reserve(1, at(21), at(23)) as free:
+        assert not free
+    assert loaded == [1, 2, 3, 4]
+
+
+def test_merge_joins_overlapping_and_touching_intervals():
+    assert merge([(at(5), at(6)), (at(1), at(3)), (at(2), at(4)), (at(4), at(5)), (at(8), at(8))]) == [(at(1), at(6))]
+
+def test_subtract_busy_from_free():
+    free = [(at(0), at(10)), (at(12), at(14))]
+    busy = [(at(2), at(3)), (at(2, 30), at(4)), (at(9), at(13)), (at(20), at(21))]
+    assert subtract(free, busy) == [(at(0), at(2)), (at(4), at(9)), (at(13), at(14))]
+    assert subtract(free, []) == free
+    assert subtract(free, [(at(0), at(14))]) == []
+
+def test_intersect_all_is_half_open():
+    a = [(at(0), at(4)), (at(6), at(10))]
+    b = [(at(2), at(6)), (at(8), at(12))]
+    assert intersect_all([a, b]) == [(at(2), at(4)), (at(8), at(10))]
+    assert intersect_all([[(at(0), at(2))], [(at(2), at(4))]]) == []
+    assert intersect_all([]) == []
+
+def test_common_free_slots():
+    horizon = (at(0), at(24))
+    artist = ([(at(8), at(12)), (at(14), at(20))], [(at(10), at(11))])
+    unrestricted_artist = (None, [(at(15), at(16))])
+    venue = (None, [(at(18), at(23))])
+    assert common_free_slots(horizon, [artist, unrestricted_artist, venue]) == \
+        [(at(8), at(10)), (at(11), at(12)), (at(14), at(15)), (at(16), at(18))]
+    assert common_free_slots(horizon, [artist, unrestricted_artist, venue], min_length=timedelta(hours=2)) == \
+        [(at(8), at(10)), (at(16), at(18))]
+
+def test_common_free_slots_clips_availability_to_the_horizon():
+    artist = ([(at(-5), at(3)), (at(22), at(30))], [])
+    assert common_free_slots((at(0), at(24)), [artist]) == [(at(0), at(3)), (at(22), at(24))]
+
+def test_common_free_slots_without_availability_is_never_free():
+    assert common_free_slots((at(0), at(24)), [([], []), (None, [])]) == []
+    assert common_free_slots((at(0), at(24)), []) == [(at(0), at(24))]
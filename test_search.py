@@ -0,0 +1,112 @@
+# search.py: the trigram index and the ranking of the in-process backend.
+import pytest
+
+import app as fyyur
+from search import MemorySearchBackend, SQLiteSearchBackend, TrigramIndex, trigrams
+
+
+def test_trigrams():
+    assert trigrams('jazz') == {'jaz', 'azz'}
+    assert trigrams('ja') == set()
+
+def test_substring_search_is_case_insensitive():
+    index = TrigramIndex()
+    index.build([(1, 'The Jazz Band'), (2, 'Jazzy'), (3, 'Rock Trio'), (4, None)])
+    assert sorted(index.search('JAZZ')) == [1, 2]
+    assert index.search('azz b') == [1]
+    assert index.search('jazzz') == []
+
+def test_short_terms_scan_the_texts():
+    index = TrigramIndex()
+    index.build([(1, 'Ab'), (2, 'cab'), (3, 'xyz')])
+    assert sorted(index.search('ab')) == [1, 2]
+    assert sorted(index.search('')) == [1, 2, 3]
+
+def test_add_replaces_and_remove_drops_postings():
+    index = TrigramIndex()
+    index.build([(1, 'Jazz'), (2, 'Blues')])
+    index.add(1, 'Folk')
+    assert index.search('jazz') == []
+    assert index.search('folk') == [1]
+    index.add(3, 'Jazz Club')
+    index.remove(2)
+    index.remove(2)
+    assert index.search('blu') == []
+    assert 'blu' not in index.postings
+    assert index.search('jazz') == [3]
+
+
+@pytest.fixture
+def backend(database):
+    city_states = [fyyur.CityState(city='San Francisco', state='CA'), fyyur.CityState(city='New York', state='NY')]
+    database.session.add_all(city_states)
+    database.session.flush()
+    sf, ny = [city_state.id for city_state in city_states]
+    jazz, rock = fyyur.Genre(name='Jazz'), fyyur.Genre(name='Rock')
+    database.session.add_all([
+      fyyur.Artist(name='Bill and the Jazz Cats', city_state_id=sf),
+      fyyur.Artist(name='Jazzmatazz', city_state_id=ny),
+      fyyur.Artist(name='All That Jazz', city_state_id=sf),
+      fyyur.Artist(name='Rock Trio', city_state_id=ny),
+      fyyur.Venue(name='The Jazz Corner', address='1 Main St', city_state_id=sf, genres=[rock]),
+      fyyur.Venue(name='Rockefeller Hall', address='2 Main St', city_state_id=ny, genres=[jazz]),
+      fyyur.Venue(name='Jazz Loft', address='3 Main St', city_state_id=ny, genres=[jazz]),
+    ])
+    database.session.commit()
+    backend = MemorySearchBackend(database)
+    backend.setup()
+    return backend
+
+def names(hits):
+    return [hit.name for hit in hits]
+
+def test_prefix_matches_rank_first(backend):
+    assert names(backend.search('artists', 'jazz')) == ['Jazzmatazz', 'All That Jazz', 'Bill and the Jazz Cats']
+
+def test_genre_only_matches_rank_last(backend):
+    assert names(backend.search('venues', 'jaz')) == ['Jazz Loft', 'The Jazz Corner', 'Rockefeller Hall']
+
+def test_genre_only_matches_rank_below_late_name_matches(backend, database):
+    jazz = fyyur.Genre.query.filter_by(name='Jazz').one()
+    venues = [fyyur.Venue(name='The Long and Winding Hall of Jazz', address='4 Main St', city_state_id=1),
+              fyyur.Venue(name='Rox', address='5 Main St', city_state_id=1, genres=[jazz])]
+    database.session.add_all(venues)
+    database.session.commit()
+    for venue in venues:
+        backend.update('Venue', venue.id)
+    hits = names(backend.search('venues', 'jaz'))
+    assert hits.index('The Long and Winding Hall of Jazz') < hits.index('Rox')
+    assert hits[-2:] == ['Rockefeller Hall', 'Rox']
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_any_part_of_a_genre_matches(kind, database):
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    database.session.add(city_state)
+    database.session.flush()
+    database.session.add(fyyur.Venue(name='The Forge', address='1 Main St', city_state_id=city_state.id,
+                                     genres=[fyyur.Genre(name='Heavy Metal')]))
+    database.session.commit()
+    backend = (MemorySearchBackend if kind == 'memory' else SQLiteSearchBackend)(database)
+    backend.setup()
+    assert names(backend.search('venues', 'metal')) == ['The Forge']
+    assert names(backend.search('venues', 'heavy')) == ['The Forge']
+
+def test_search_by_city(backend):
+    assert names(backend.search('artists_by_city', 'york')) == ['Jazzmatazz', 'Rock Trio']
+    assert names(backend.search('venues_by_city', 'san fran')) == ['The Jazz Corner']
+
+def test_update_and_remove_follow_the_writes(backend, database):
+    artist = fyyur.Artist.query.filter_by(name='Rock Trio').one()
+    artist.name = 'Jazz Trio'
+    database.session.commit()
+    backend.update('Artist', artist.id)
+    assert names(backend.search('artists', 'jazz')) == ['Jazz Trio', 'Jazzmatazz', 'All That Jazz', 'Bill and the Jazz Cats']
+    assert backend.search('artists', 'rock') == []
+    backend.remove('Artist', artist.id)
+    assert 'Jazz Trio' not in names(backend.search('artists', 'jazz'))
+
+def test_memory_and_sqlite_backends_find_the_same_rows(backend, database):
+    sqlite = SQLiteSearchBackend(database)
+    sqlite.setup()
+    for kind, term in [('artists', 'jazz'), ('venues', 'jaz'), ('artists_by_city', 'york'), ('venues_by_city', 'new')]:
+        assert sorted(names(sqlite.search(kind, term))) == sorted(names(backend.search(kind, term)))
@@ -0,0 +1,89 @@
+# Booking shows in app.py against artist availability, including the slots of
+# bare start times and of the availability migration, and rolling the show
+# counters of started shows.
+import importlib.util
+import os
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+import app as fyyur
+from forms import ShowForm
+
+DEFAULT_DURATION = ShowForm.duration.kwargs['default']
+
+
+def load_migration(name):
+    path = os.path.join(os.path.dirname(__file__), 'migrations', 'versions', name + '.py')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed(db, slots):
+    city_state = fyyur.CityState(city='San Francisco', state='CA')
+    db.session.add(city_state)
+    db.session.flush()
+    db.session.add_all([fyyur.Venue(name='Venue', address='1 Main St', city_state_id=city_state.id),
+                        fyyur.Artist(name='Artist', city_state_id=city_state.id)])
+    db.session.flush()
+    db.session.add_all([fyyur.ArtistAvailability(artist_id=1, start_time=start, end_time=end) for start, end in slots])
+    db.session.commit()
+
+def book(start_time, duration=DEFAULT_DURATION):
+    return fyyur.app.test_client().post('/shows/create', data={'artist_id': '1', 'venue_id': '1',
+        'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'), 'duration': str(duration)})
+
+
+def test_default_show_fits_a_bare_start_time(database):
+    slots = fyyur.parse_availability('2030-01-01 20:00, 2030-01-02 20:00, 2030-01-03 18:00/2030-01-03 19:00')
+    assert slots[0] == (datetime(2030, 1, 1, 20), datetime(2030, 1, 1, 20) + timedelta(minutes=DEFAULT_DURATION))
+    seed(database, slots)
+    assert book(datetime(2030, 1, 1, 20)).status_code == 302
+    # A longer show than the slot, or one past the end of a range, does not fit
+    assert book(datetime(2030, 1, 2, 20), DEFAULT_DURATION + 1).status_code == 200
+    assert book(datetime(2030, 1, 3, 18, 30), 60).status_code == 200
+    assert database.session.query(fyyur.Show).count() == 1
+
+def test_default_show_fits_a_migrated_start_time(database):
+    migration = load_migration('5a9be0c7d312_artist_availability_table')
+    engine = sa.create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE "Artist" (id INTEGER PRIMARY KEY, available_time VARCHAR)')
+        conn.exec_driver_sql("""INSERT INTO "Artist" VALUES (1, '2030-01-01 20:00:00,not a time')""")
+        with Operations.context(MigrationContext.configure(conn)):
+            migration.upgrade()
+        slots = conn.exec_driver_sql('SELECT start_time, end_time FROM "ArtistAvailability"').fetchall()
+    slots = [(datetime.fromisoformat(start), datetime.fromisoformat(end)) for start, end in slots]
+    assert len(slots) == 1
+    seed(database, slots)
+    assert book(datetime(2030, 1, 1, 20)).status_code == 302
+    assert database.session.query(fyyur.Show).count() == 1
+
+
+# A show that started without the counters knowing, by the database clock
+def started_show(db, ago):
+    now = db.session.scalar(db.select(db.func.now()))
+    db.session.add(fyyur.Show(artist_id=1, venue_id=1, start_time=now - ago, end_time=now - ago + timedelta(hours=2)))
+    db.session.commit()
+    return now
+
+def roll(*args):
+    return fyyur.app.test_cli_runner().invoke(args=['roll-show-counters'] + list(args))
+
+def test_roll_show_counters_catches_up_from_the_watermark(database, tmp_path, monkeypatch):
+    watermark = str(tmp_path / 'show-counters.watermark')
+    monkeypatch.setitem(fyyur.app.config, 'SHOW_COUNTERS_WATERMARK', watermark)
+    seed(database, [])
+    now = started_show(database, timedelta(hours=1))
+    # Without a watermark only the last --window minutes are looked at
+    assert 'Show counters refreshed: 0 artists, 0 venues changed' in roll().output
+    assert fyyur.read_watermark(watermark) >= now
+    # A missed run: the next one starts where the last one ended
+    fyyur.write_watermark(watermark, now - timedelta(hours=2))
+    assert 'Show counters refreshed: 1 artists, 1 venues changed' in roll().output
+    database.session.expire_all()
+    assert database.session.get(fyyur.Artist, 1).past_shows_count == 1
+    assert database.session.get(fyyur.Venue, 1).past_shows_count == 1